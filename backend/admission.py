@@ -0,0 +1,176 @@
+"""
+Admission control for detect requests.
+
+Without it, every request thread goes straight to inference. Once inference
+falls behind they all queue inside the pool, and every session's latency
+grows together until requests time out. The controller sits in front:
+
+* at most `limit` frames are in inference at once; the rest wait in a FIFO;
+* a session has at most one frame in inference and one waiting. A newer
+  frame replaces the waiting one, which is answered 429 right away (the
+  client has already sent something more recent);
+* a frame that would wait longer than `queue_timeout` is rejected with 503
+  up front, using the current latency and queue length as the estimate. A
+  frame still waiting at its deadline is rejected too. Both carry a
+  Retry-After hint.
+
+`limit` adapts AIMD-style to the observed inference latency. Each completion
+under `target_latency` adds 1/limit, so about +1 per round of frames. A
+completion over target multiplies it by `decrease`, at most once per
+latency period, within [min_limit, max_limit].
+"""
+import logging
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+_WAITING, _ADMITTED, _SUPERSEDED = 'waiting', 'admitted', 'superseded'
+
+
+class Rejected(Exception):
+    """A frame was not admitted; answer with `status` and a Retry-After of `retry_after` seconds."""
+
+    def __init__(self, status, reason, retry_after):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    __slots__ = ('session_id', 'state')
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.state = _WAITING
+
+
+class AdmissionController:
+    def __init__(self, max_limit, min_limit=1, initial_limit=None, target_latency=0.25,
+                 queue_timeout=1.0, decrease=0.9):
+        self.max_limit = max(1, int(max_limit))
+        self.min_limit = max(1, min(int(min_limit), self.max_limit))
+        initial = self.max_limit if initial_limit is None else initial_limit
+        self._limit = float(min(self.max_limit, max(self.min_limit, initial)))
+        self.target_latency = float(target_latency)
+        self.queue_timeout = float(queue_timeout)
+        self.decrease = float(decrease)
+        self._cv = threading.Condition()
+        self._queue = deque()
+        self._waiting = {}
+        self._running = set()
+        self._in_flight = 0
+        # Smoothed inference latency, seeded with the target
+        self._latency = self.target_latency
+        self._last_decrease = 0.0
+        self._stats = {'admitted': 0, 'queued': 0, 'shed': 0, 'timeouts': 0, 'superseded': 0}
+
+    @contextmanager
+    def admit(self, session_id=None):
+        """Hold an inference slot for the body of the `with`; raises Rejected instead."""
+        ticket = self._acquire(session_id)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(ticket, time.monotonic() - started)
+
+    def _can_run(self, session_id):
+        return self._in_flight < int(self._limit) and (session_id is None or session_id not in self._running)
+
+    def _grant(self, ticket):
+        ticket.state = _ADMITTED
+        self._in_flight += 1
+        if ticket.session_id is not None:
+            self._running.add(ticket.session_id)
+        self._stats['admitted'] += 1
+
+    def _retry_after(self, position):
+        """Seconds until `position` frames ahead of a new one have likely gone through."""
+        return self._latency * math.ceil(position / max(1, int(self._limit)))
+
+    def _unqueue(self, ticket):
+        self._queue.remove(ticket)
+        if ticket.session_id is not None and self._waiting.get(ticket.session_id) is ticket:
+            del self._waiting[ticket.session_id]
+
+    def _acquire(self, session_id):
+        ticket = _Ticket(session_id)
+        with self._cv:
+            previous = self._waiting.get(session_id) if session_id is not None else None
+            if previous is not None:
+                # Only the newest waiting frame of a session is worth running
+                self._unqueue(previous)
+                previous.state = _SUPERSEDED
+                self._stats['superseded'] += 1
+                self._cv.notify_all()
+            if not self._queue and self._can_run(session_id):
+                self._grant(ticket)
+                return ticket
+            # The frame ahead of us in this session also has to finish first
+            position = len(self._queue) + 1 + (1 if session_id in self._running else 0)
+            wait = self._retry_after(position)
+            if wait > self.queue_timeout:
+                self._stats['shed'] += 1
+                raise Rejected(503, 'Face processing overloaded, retry later', wait)
+            self._queue.append(ticket)
+            if session_id is not None:
+                self._waiting[session_id] = ticket
+            self._stats['queued'] += 1
+            deadline = time.monotonic() + self.queue_timeout
+            while ticket.state == _WAITING:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    self._unqueue(ticket)
+                    self._stats['timeouts'] += 1
+                    raise Rejected(503, 'Face processing busy, retry later', self._retry_after(len(self._queue) + 1))
+                self._cv.wait(left)
+            if ticket.state == _SUPERSEDED:
+                raise Rejected(429, 'Superseded by a newer frame from this session', 0.0)
+            return ticket
+
+    def _release(self, ticket, latency):
+        with self._cv:
+            self._in_flight -= 1
+            if ticket.session_id is not None:
+                self._running.discard(ticket.session_id)
+            self._latency += 0.2 * (latency - self._latency)
+            now = time.monotonic()
+            if latency > self.target_latency:
+                # One decrease per latency period: the frames in flight now
+                # were admitted under the old limit
+                if now - self._last_decrease >= self._latency:
+                    self._limit = max(self.min_limit, self._limit * self.decrease)
+                    self._last_decrease = now
+            else:
+                self._limit = min(self.max_limit, self._limit + 1.0 / self._limit)
+            self._dispatch()
+
+    def _dispatch(self):
+        granted = False
+        for ticket in list(self._queue):
+            if self._in_flight >= int(self._limit):
+                break
+            if self._can_run(ticket.session_id):
+                self._unqueue(ticket)
+                self._grant(ticket)
+                granted = True
+        if granted:
+            self._cv.notify_all()
+
+    def stats(self):
+        with self._cv:
+            return dict(
+                self._stats,
+                limit=round(self._limit, 2),
+                min_limit=self.min_limit,
+                max_limit=self.max_limit,
+                in_flight=self._in_flight,
+                waiting=len(self._queue),
+                latency_ms=round(self._latency * 1000.0, 1),
+                target_latency_ms=round(self.target_latency * 1000.0, 1),
+            )
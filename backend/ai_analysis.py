@@ -0,0 +1,359 @@
+"""
+Background LLM analysis for session reports.
+
+Reports no longer call Gemini inside the request. The prompt is hashed
+(SHA-256 of model + prompt text) and looked up in a small LRU/TTL cache;
+a miss starts a job on a background thread pool and the report is returned
+right away with the heuristics only. Later requests for the same prompt get
+the finished analysis from the cache; concurrent requests for a prompt that
+is still running share the one job.
+
+`GeminiAnalyzer` keeps one google.genai client and one pooled requests
+session for the HTTP fallback, instead of creating them per report.
+
+Under ASGI (asgi.py) the same cache is used from the event loop: `aget`
+runs the job as a task that awaits `GeminiAnalyzer.agenerate` (the genai
+client's async API, or an httpx.AsyncClient for the HTTP fallback), so a
+pending analysis holds no thread.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except Exception:
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+READY = 'ready'
+FAILED = 'error'
+
+
+class AnalysisError(Exception):
+    """An analysis call failed; `details` is returned to the client as `ai_analysis_error`."""
+
+    def __init__(self, details):
+        super().__init__(str(details))
+        self.details = details
+
+
+def _response_text(jr):
+    """Pull the text out of the loosely specified HTTP fallback response."""
+    ai_text = None
+    if isinstance(jr, dict):
+        ai_text = jr.get('output') or jr.get('text') or jr.get('result') or jr.get('choices')
+        if isinstance(ai_text, list) and ai_text:
+            ai_text = ' '.join([str(x) for x in ai_text])
+        elif isinstance(ai_text, dict):
+            ai_text = ai_text.get('text') or str(ai_text)
+    return ai_text
+
+
+class GeminiAnalyzer:
+    """Turns a prompt into analysis text via google.genai, or GEMINI_URL over HTTP."""
+
+    def __init__(self, genai=None, api_key=None, url=None, model='gemini-2.5-flash', timeout=6.0, pool_size=4):
+        self.genai = genai
+        self.api_key = api_key
+        self.url = url
+        self.model = model
+        self.timeout = timeout
+        self._pool_size = pool_size
+        self._client = None
+        self._session = None
+        self._async_http = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.api_key) and (self.genai is not None or bool(self.url))
+
+    def _genai_client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = self.genai.Client()
+            return self._client
+
+    def _http(self):
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._pool_size)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._session = session
+            return self._session
+
+    def _async_client(self):
+        # Created on the event loop that uses it (one per ASGI worker process)
+        if self._async_http is None:
+            limits = httpx.Limits(max_connections=self._pool_size, max_keepalive_connections=self._pool_size)
+            self._async_http = httpx.AsyncClient(limits=limits, timeout=self.timeout)
+        return self._async_http
+
+    async def aclose(self):
+        client, self._async_http = self._async_http, None
+        if client is not None:
+            await client.aclose()
+
+    def __call__(self, prompt_text):
+        if self.genai is not None:
+            return self._generate_genai(prompt_text)
+        return self._generate_http(prompt_text)
+
+    async def agenerate(self, prompt_text):
+        """`self(prompt_text)` without blocking the event loop."""
+        if self.genai is not None:
+            return await self._agenerate_genai(prompt_text)
+        if httpx is None:
+            return await asyncio.to_thread(self._generate_http, prompt_text)
+        return await self._agenerate_http(prompt_text)
+
+    def _generate_genai(self, prompt_text):
+        try:
+            client = self._genai_client()
+            try:
+                gen_resp = client.models.generate_content(model=self.model, contents=prompt_text)
+            except Exception:
+                # Some versions expose a more generic call shape
+                gen_resp = client.generate(model=self.model, input=prompt_text)
+        except Exception as e:
+            logger.error(f'Error calling google.genai client: {e}', exc_info=True)
+            raise AnalysisError({'error': str(e)})
+        return self._genai_text(gen_resp)
+
+    async def _agenerate_genai(self, prompt_text):
+        try:
+            # The first call imports google.genai (most of a second): not on the loop
+            client = self._client or await asyncio.to_thread(self._genai_client)
+            aio = getattr(client, 'aio', None)
+            if aio is not None:
+                gen_resp = await aio.models.generate_content(model=self.model, contents=prompt_text)
+            else:
+                # Versions without the async API
+                return await asyncio.to_thread(self._generate_genai, prompt_text)
+        except AnalysisError:
+            raise
+        except Exception as e:
+            logger.error(f'Error calling google.genai client: {e}', exc_info=True)
+            raise AnalysisError({'error': str(e)})
+        return self._genai_text(gen_resp)
+
+    @staticmethod
+    def _genai_text(gen_resp):
+        if gen_resp is None:
+            return None
+        if hasattr(gen_resp, 'text'):
+            return gen_resp.text
+        try:
+            jr = gen_resp if isinstance(gen_resp, dict) else gen_resp.__dict__
+            return jr.get('output') or jr.get('text') or jr.get('result') or str(jr)
+        except Exception:
+            return str(gen_resp)
+
+    def _http_request(self, prompt_text):
+        headers = {
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json'
+        }
+        return headers, {'input': prompt_text, 'max_output_tokens': 512}
+
+    def _generate_http(self, prompt_text):
+        headers, payload = self._http_request(prompt_text)
+        try:
+            resp = self._http().post(self.url, headers=headers, json=payload, timeout=self.timeout)
+        except Exception as e:
+            logger.error(f'Error calling Gemini via HTTP: {e}', exc_info=True)
+            raise AnalysisError({'error': str(e)})
+        return self._http_text(resp)
+
+    async def _agenerate_http(self, prompt_text):
+        headers, payload = self._http_request(prompt_text)
+        try:
+            resp = await self._async_client().post(self.url, headers=headers, json=payload)
+        except Exception as e:
+            logger.error(f'Error calling Gemini via HTTP: {e}', exc_info=True)
+            raise AnalysisError({'error': str(e)})
+        return self._http_text(resp)
+
+    @staticmethod
+    def _http_text(resp):
+        # requests and httpx responses share status_code, text and json()
+        if resp.status_code != 200:
+            logger.warning(f'Gemini request failed: {resp.status_code} {resp.text}')
+            raise AnalysisError({'status': resp.status_code, 'text': resp.text})
+        try:
+            return _response_text(resp.json()) or resp.text
+        except Exception:
+            return resp.text
+
+
+class _Entry:
+    __slots__ = ('status', 'result', 'error', 'expires', 'done', 'task', 'future')
+
+    def __init__(self):
+        self.status = PENDING
+        self.result = None
+        self.error = None
+        self.expires = None
+        self.done = threading.Event()
+        # asyncio task running the job, when started by aget(), or the pool's
+        # future, when started by get()
+        self.task = None
+        self.future = None
+
+
+class AnalysisJobs:
+    """Content-addressed cache of analysis results, filled by background jobs.
+
+    Finished results live for `ttl` seconds, failures for `error_ttl` (so a
+    transient outage is retried soon), and at most `max_entries` are kept (LRU).
+    """
+
+    def __init__(self, generate, workers=2, ttl=3600.0, error_ttl=60.0, max_entries=256, key_prefix='', agenerate=None):
+        self._generate = generate
+        self._agenerate = agenerate
+        self.workers = max(1, int(workers))
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self.max_entries = max(1, int(max_entries))
+        self._key_prefix = key_prefix
+        self._reset()
+        # Pool threads do not survive a fork; the child starts its own on first use
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._counts = {'hits': 0, 'misses': 0, 'joined': 0, 'completed': 0, 'failed': 0, 'evicted': 0}
+
+    def key(self, prompt_text):
+        return hashlib.sha256((self._key_prefix + '\0' + prompt_text).encode('utf-8')).hexdigest()
+
+    def get(self, prompt_text, wait=0.0):
+        """(key, status, result, error) for `prompt_text`, starting a job on a miss.
+
+        With `wait` > 0, block up to that many seconds for a pending job.
+        """
+        key, entry, created = self._lookup(prompt_text)
+        if created:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ai-analysis')
+                entry.future = self._executor.submit(self._run, entry, prompt_text)
+        if wait and entry.status == PENDING:
+            entry.done.wait(wait)
+        return key, entry.status, entry.result, entry.error
+
+    async def aget(self, prompt_text, wait=0.0):
+        """`get` for the event loop: a miss starts an asyncio task (`agenerate`, else
+        `generate` in a thread), and `wait` suspends instead of blocking.
+        """
+        key, entry, created = self._lookup(prompt_text)
+        if created:
+            entry.task = asyncio.get_running_loop().create_task(self._arun(entry, prompt_text))
+        if wait and entry.status == PENDING:
+            if entry.task is not None:
+                await asyncio.wait({entry.task}, timeout=wait)
+            else:
+                # Started by get() on a thread
+                await asyncio.to_thread(entry.done.wait, wait)
+        return key, entry.status, entry.result, entry.error
+
+    def _lookup(self, prompt_text):
+        """(key, entry, created): the live entry for the prompt, or a new pending one."""
+        key = self.key(prompt_text)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires is not None and entry.expires <= now:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self._counts['misses'] += 1
+                entry = _Entry()
+                self._entries[key] = entry
+                while len(self._entries) > self.max_entries:
+                    old_key, old = next(iter(self._entries.items()))
+                    if old.status == PENDING:
+                        # Never drop a running job; it finishes into the cache
+                        self._entries.move_to_end(old_key)
+                        if all(e.status == PENDING for e in self._entries.values()):
+                            break
+                        continue
+                    del self._entries[old_key]
+                    self._counts['evicted'] += 1
+                return key, entry, True
+            self._entries.move_to_end(key)
+            self._counts['hits' if entry.status != PENDING else 'joined'] += 1
+            return key, entry, False
+
+    def _run(self, entry, prompt_text):
+        try:
+            self._finish(entry, result=self._generate(prompt_text))
+        except Exception as e:
+            self._finish(entry, error=e)
+
+    async def _arun(self, entry, prompt_text):
+        try:
+            if self._agenerate is not None:
+                result = await self._agenerate(prompt_text)
+            else:
+                result = await asyncio.to_thread(self._generate, prompt_text)
+            self._finish(entry, result=result)
+        except asyncio.CancelledError as e:
+            # Event loop shutting down; expire it so the next request starts over
+            self._finish(entry, error=e)
+            entry.expires = 0.0
+            raise
+        except Exception as e:
+            self._finish(entry, error=e)
+
+    def _finish(self, entry, result=None, error=None):
+        with self._lock:
+            if error is None:
+                entry.result = result
+                entry.status = READY
+                entry.expires = time.monotonic() + self.ttl
+                self._counts['completed'] += 1
+            else:
+                entry.error = error.details if isinstance(error, AnalysisError) else {'error': str(error) or type(error).__name__}
+                entry.status = FAILED
+                entry.expires = time.monotonic() + self.error_ttl
+                self._counts['failed'] += 1
+            entry.task = None
+            entry.future = None
+        entry.done.set()
+
+    def stats(self):
+        with self._lock:
+            pending = sum(1 for e in self._entries.values() if e.status == PENDING)
+            return dict(self._counts, entries=len(self._entries), pending=pending)
+
+    def close(self):
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+        if executor is None:
+            return
+        executor.shutdown(wait=False, cancel_futures=True)
+        # Jobs cancelled before they started never reach _finish: fail them so
+        # waiters wake up, and expire them so a later request starts over
+        with self._lock:
+            cancelled = [e for e in self._entries.values() if e.future is not None and e.future.cancelled()]
+        for entry in cancelled:
+            self._finish(entry, error=AnalysisError({'error': 'analysis cancelled at shutdown'}))
+            entry.expires = 0.0
@@ -1,27 +1,42 @@
-from flask import Flask, request, jsonify
-import base64
-import io
-from PIL import Image
+from flask import Flask, request, jsonify, Response, g
 import numpy as np
-import mediapipe as mp
 import os
 from datetime import datetime, timezone
 import sys
+import atexit
+import math
+import threading
+import tempfile
+import hashlib
+import time
+import multiprocessing
 from bson import ObjectId
 import uuid
-import requests
-try:
-    # Prefer the official Google GenAI client when available (user-provided snippet)
-    from google import genai  # type: ignore
-except Exception:
-    genai = None
-try:
-    # load .env in development if present
-    from dotenv import load_dotenv
-    load_dotenv()
-except Exception:
-    # python-dotenv is optional; env vars may be set in the environment
-    pass
+import json
+import io
+import base64
+
+# Sibling modules are imported by plain name whether the app is started as
+# `app:app` (from backend/) or `backend.app:app` (from the repo root).
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, _APP_DIR)
+from startup import lifecycle, lazy_import
+
+# Prefer the official Google GenAI client when available (user-provided snippet).
+# It takes most of a second to import, so that happens on the first analysis.
+genai = lazy_import('google.genai')
+
+# load .env in development if present; python-dotenv is only imported when
+# there is a file to load (next to the app or one level up, as find_dotenv would)
+for _env_dir in (_APP_DIR, os.path.dirname(_APP_DIR)):
+    if os.path.isfile(os.path.join(_env_dir, '.env')):
+        try:
+            from dotenv import load_dotenv
+            load_dotenv(os.path.join(_env_dir, '.env'))
+        except Exception:
+            # python-dotenv is optional; env vars may be set in the environment
+            pass
+        break
 
 # Optional MongoDB (persistence) - only used if MONGO_URI is set
 try:
@@ -35,6 +50,37 @@ try:
 except Exception:
     CORS = None
 
+# Optional WebSocket support for the per-session frame stream
+try:
+    from flask_sock import Sock
+except Exception:
+    Sock = None
+
+from facemesh_pool import FaceMeshPool, PoolTimeout
+from inference_engine import ProcessInferenceEngine, EngineError, EngineBusy, BadFrame
+import landmark_codec
+from landmark_codec import landmarks_array
+from batch_scheduler import MicroBatchScheduler, SchedulerTimeout
+from session_graphs import SessionGraphCache
+from contextlib import contextmanager
+from preprocess import decode_image, detect_landmarks, landmark_bbox, RawFrame
+from ingest import read_base64_field, InvalidDataUrl
+from frame_stream import FrameStream
+from face_metrics import SessionMetrics
+from write_behind import WriteBehindQueue
+import metrics_store
+from report_engine import MongoReportBackend, MemoryReportBackend
+from ai_analysis import GeminiAnalyzer, AnalysisJobs
+from session_store import SessionStore
+from shared_sessions import MmapSessionTable, RedisSessionTable, MMAP_AVAILABLE
+from frame_cache import FrameCache
+from admission import AdmissionController, Rejected
+from telemetry import Telemetry
+from landmark_archive import LandmarkArchive
+import face_tracks
+import synthetic_face
+from concurrent.futures import ThreadPoolExecutor
+
 app = Flask(__name__)
 
 # Optional: allow restricting origins via ALLOWED_ORIGINS env (comma-separated)
@@ -49,9 +95,185 @@ else:
 if CORS:
     CORS(app, resources={r"/*": {"origins": CORS_ORIGINS}})
 
-mp_face_mesh = mp.solutions.face_mesh
-# Use static_image_mode=True for single-image inference (no tracking)
-face_mesh = mp_face_mesh.FaceMesh(static_image_mode=True, max_num_faces=1, refine_landmarks=True, min_detection_confidence=0.5)
+# Latency instrumentation: per-stage histograms and request counters served
+# at /internal/metrics (Prometheus text format, aggregated across gunicorn
+# workers when PROMETHEUS_MULTIPROC_DIR is set, see gunicorn.conf.py).
+# METRICS_SERVER_TIMING adds a Server-Timing header with this request's stages.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_SERVER_TIMING = os.environ.get('METRICS_SERVER_TIMING', 'false').lower() == 'true'
+INTERNAL_METRICS_TOKEN = os.environ.get('INTERNAL_METRICS_TOKEN') or None
+telemetry = Telemetry(enabled=METRICS_ENABLED, server_timing=METRICS_SERVER_TIMING)
+
+# Faces found per frame. Above 1, each session frame's faces get stable track
+# IDs and the result lists every face's box (see face_tracks.py)
+DETECT_MAX_FACES = max(1, min(face_tracks.MAX_TRACKS, int(os.environ.get('DETECT_MAX_FACES', '1'))))
+
+FACE_MESH_KWARGS = {
+    # Use static_image_mode=True for single-image inference (no tracking)
+    'static_image_mode': True,
+    'max_num_faces': DETECT_MAX_FACES,
+    'refine_landmarks': True,
+    'min_detection_confidence': 0.5,
+}
+
+
+def _face_mesh_module():
+    # MediaPipe (about a second to import) is only loaded where graphs are built
+    import mediapipe as mp
+    return mp.solutions.face_mesh
+
+
+def _new_face_mesh():
+    return _face_mesh_module().FaceMesh(**FACE_MESH_KWARGS)
+
+
+# INFERENCE_ENGINE selects where FaceMesh runs:
+#   thread  - a bounded pool of graphs shared by request threads (default)
+#   process - worker processes that own a graph each and receive frames over
+#             shared memory; request threads only do I/O and dispatch
+INFERENCE_ENGINE = os.environ.get('INFERENCE_ENGINE', 'thread').strip().lower()
+FACEMESH_POOL_SIZE = max(1, int(os.environ.get('FACEMESH_POOL_SIZE', '2')))
+FACEMESH_POOL_TIMEOUT = float(os.environ.get('FACEMESH_POOL_TIMEOUT', '5.0'))
+# Seconds between probes of the idle pooled graphs (0 disables)
+FACEMESH_HEALTH_INTERVAL = float(os.environ.get('FACEMESH_HEALTH_INTERVAL', '60'))
+INFERENCE_WORKERS = max(1, int(os.environ.get('INFERENCE_WORKERS', '2')))
+INFERENCE_SLOTS_PER_WORKER = max(1, int(os.environ.get('INFERENCE_SLOTS_PER_WORKER', '2')))
+INFERENCE_MAX_FRAME_BYTES = int(os.environ.get('INFERENCE_MAX_FRAME_BYTES', str(16 * 1024 * 1024)))
+INFERENCE_HANG_TIMEOUT = float(os.environ.get('INFERENCE_HANG_TIMEOUT', '30.0'))
+
+face_mesh_pool = None
+inference_engine = None
+
+if INFERENCE_ENGINE == 'process':
+    # Never start workers from inside a worker (spawn re-imports the main module)
+    if multiprocessing.parent_process() is None:
+        inference_engine = ProcessInferenceEngine(
+            FACE_MESH_KWARGS,
+            workers=INFERENCE_WORKERS,
+            slots_per_worker=INFERENCE_SLOTS_PER_WORKER,
+            slot_bytes=INFERENCE_MAX_FRAME_BYTES,
+            timeout=FACEMESH_POOL_TIMEOUT,
+            hang_timeout=INFERENCE_HANG_TIMEOUT,
+            start_method=os.environ.get('INFERENCE_START_METHOD') or None,
+            # Workers are started by the 'inference' startup hook, after any fork
+            start=False,
+        )
+        atexit.register(inference_engine.close)
+else:
+    # A FaceMesh graph is not safe to call from several threads at once, so each
+    # request thread checks one out of a bounded pool (Waitress/gunicorn threads).
+    # Graphs are built by the 'inference' startup hook, after any fork
+    face_mesh_pool = FaceMeshPool(_new_face_mesh, size=FACEMESH_POOL_SIZE, timeout=FACEMESH_POOL_TIMEOUT, prefill=False)
+
+# Opt-in video mode: keep a tracking (static_image_mode=False) graph per active
+# session so consecutive frames skip full face detection. Graph count is capped
+# by FACEMESH_TRACKING_MAX_GRAPHS; idle graphs are dropped after the TTL and
+# when the session ends. Sessions that don't get a graph use the shared pool.
+FACEMESH_TRACKING = os.environ.get('FACEMESH_TRACKING', 'false').lower() == 'true'
+FACEMESH_TRACKING_MAX_GRAPHS = max(1, int(os.environ.get('FACEMESH_TRACKING_MAX_GRAPHS', '8')))
+FACEMESH_TRACKING_IDLE_TTL = float(os.environ.get('FACEMESH_TRACKING_IDLE_TTL', '120'))
+
+session_graphs = None
+
+
+def _new_tracking_face_mesh():
+    return _face_mesh_module().FaceMesh(**dict(FACE_MESH_KWARGS, static_image_mode=False))
+
+
+if FACEMESH_TRACKING and face_mesh_pool is not None:
+    session_graphs = SessionGraphCache(
+        _new_tracking_face_mesh,
+        max_graphs=FACEMESH_TRACKING_MAX_GRAPHS,
+        idle_ttl=FACEMESH_TRACKING_IDLE_TTL,
+        timeout=FACEMESH_POOL_TIMEOUT,
+    )
+
+
+@contextmanager
+def _face_mesh_for(session_id=None):
+    """Yield (graph, tracking): the session's tracking graph in video mode, else a pooled static graph."""
+    if session_graphs is not None and session_id is not None:
+        with session_graphs.checkout(session_id) as mesh:
+            if mesh is not None:
+                yield mesh, True
+                return
+    with face_mesh_pool.checkout() as mesh:
+        yield mesh, False
+
+
+# Each graph (or inference worker) runs one detection on a drawn face before
+# it serves requests, so the first real frame doesn't pay for initializing
+# the graph. STARTUP_WARMUP=false skips it.
+STARTUP_WARMUP = os.environ.get('STARTUP_WARMUP', 'true').lower() == 'true'
+
+
+def _warm_graph(mesh, frame):
+    try:
+        if not len(landmarks_array(mesh.process(frame))):
+            app.logger.warning('Warmup frame produced no face; the graph is initialized regardless')
+    except Exception as e:
+        app.logger.warning(f'Warmup inference failed: {e}')
+
+
+@lifecycle.hook('inference')
+def _init_inference():
+    frame = synthetic_face.face_jpeg() if STARTUP_WARMUP else None
+    if face_mesh_pool is not None:
+        if frame is None:
+            face_mesh_pool.fill()
+        else:
+            rgb = decode_image(frame)
+            face_mesh_pool.fill(warmup=lambda mesh: _warm_graph(mesh, rgb))
+        face_mesh_pool.start_health_checks(FACEMESH_HEALTH_INTERVAL)
+    if inference_engine is not None:
+        inference_engine.start()
+        if frame is not None:
+            # Concurrent frames go to the least-loaded workers, one each
+            def warm(_):
+                try:
+                    inference_engine.infer(frame, timeout=max(60.0, FACEMESH_POOL_TIMEOUT))
+                except EngineError as e:
+                    app.logger.warning(f'Warmup inference failed: {e}')
+            with ThreadPoolExecutor(max_workers=INFERENCE_WORKERS) as pool:
+                list(pool.map(warm, range(INFERENCE_WORKERS)))
+
+
+# Preprocessing: decode large uploads at reduced size (JPEG draft mode) down to
+# DETECT_MAX_LONG_EDGE px, and crop to the session's last face box plus a margin
+# when it is known. Landmarks are always returned in full-frame coordinates.
+DETECT_MAX_LONG_EDGE = max(0, int(os.environ.get('DETECT_MAX_LONG_EDGE', '1280')))
+DETECT_ROI_CROP = os.environ.get('DETECT_ROI_CROP', 'true').lower() == 'true'
+DETECT_ROI_MARGIN = float(os.environ.get('DETECT_ROI_MARGIN', '0.5'))
+# Multi-face sessions: faces are matched to the previous frame's tracks by box
+# IoU (then centroid distance); a track unseen for DETECT_TRACK_MAX_MISSED
+# frames is dropped. The ROI is the box around all tracked faces, and every
+# DETECT_FULL_FRAME_INTERVAL frames the full frame is searched for new faces.
+DETECT_TRACK_IOU = float(os.environ.get('DETECT_TRACK_IOU', '0.3'))
+DETECT_TRACK_MAX_MISSED = max(0, int(os.environ.get('DETECT_TRACK_MAX_MISSED', '15')))
+DETECT_FULL_FRAME_INTERVAL = max(0, int(os.environ.get('DETECT_FULL_FRAME_INTERVAL', '15')))
+
+# Server-side metrics (EAR, blinks, gaze, head pose) for session detections,
+# optionally stored like client-posted metrics so reports can use them
+DETECT_METRICS = os.environ.get('DETECT_METRICS', 'true').lower() == 'true'
+DETECT_METRICS_PERSIST = os.environ.get('DETECT_METRICS_PERSIST', 'false').lower() == 'true'
+
+# Per-session cache of recent results: exact repeats of a frame skip decode
+# and inference; with DETECT_NEAR_DUPLICATES, so do frames whose thumbnail
+# hash is within DETECT_NEAR_DUPLICATE_DISTANCE bits (of 64)
+DETECT_FRAME_CACHE = os.environ.get('DETECT_FRAME_CACHE', 'true').lower() == 'true'
+DETECT_FRAME_CACHE_SIZE = max(1, int(os.environ.get('DETECT_FRAME_CACHE_SIZE', '8')))
+DETECT_FRAME_CACHE_SESSIONS = max(1, int(os.environ.get('DETECT_FRAME_CACHE_SESSIONS', '256')))
+DETECT_NEAR_DUPLICATES = os.environ.get('DETECT_NEAR_DUPLICATES', 'false').lower() == 'true'
+DETECT_NEAR_DUPLICATE_DISTANCE = max(0, int(os.environ.get('DETECT_NEAR_DUPLICATE_DISTANCE', '4')))
+
+frame_cache = None
+if DETECT_FRAME_CACHE:
+    frame_cache = FrameCache(
+        max_entries=DETECT_FRAME_CACHE_SIZE,
+        max_sessions=DETECT_FRAME_CACHE_SESSIONS,
+        near_duplicates=DETECT_NEAR_DUPLICATES,
+        max_distance=DETECT_NEAR_DUPLICATE_DISTANCE,
+    )
 
 # Optional MongoDB initialization
 MONGO_URI = os.environ.get('MONGO_URI')
@@ -65,7 +287,8 @@ detections_collection = None
 
 if MongoClient is not None and MONGO_URI:
     try:
-        mongo_client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
+        # connect=False: no monitor threads until first use, so the client survives a fork (gunicorn --preload)
+        mongo_client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000, connect=False)
         db_name = os.environ.get('MONGO_DB', 'neurovision')
         mongo_db = mongo_client[db_name]
         # Pre-create handles for common collections; they may be None in tests
@@ -81,39 +304,215 @@ if MongoClient is not None and MONGO_URI:
         detections_collection = None
 
 
+# Metric samples are stored in per-session time buckets of this many seconds
+METRICS_BUCKET_SECONDS = max(1, int(os.environ.get('METRICS_BUCKET_SECONDS', '60')))
+
+
+def _ensure_indexes():
+    try:
+        # One bucket per session and time window; the unique index also keeps
+        # concurrent upserts from creating duplicate buckets
+        mongo_db.get_collection(metrics_store.BUCKETS_COLLECTION).create_index(
+            [('sessionId', 1), ('bucket', 1)], unique=True)
+        # Per-session range scans ordered by time (reports on pre-bucketing
+        # sessions, detection exports)
+        for name in ('metrics', 'detections'):
+            mongo_db.get_collection(name).create_index([('sessionId', 1), ('timestamp', 1)])
+    except Exception as e:
+        app.logger.warning(f'Failed to create MongoDB indexes: {e}')
+
+
+@lifecycle.hook('mongo_indexes')
+def _start_index_creation():
+    if mongo_db is not None:
+        # In the background so an unreachable server doesn't hold up readiness
+        threading.Thread(target=_ensure_indexes, name='mongo-indexes', daemon=True).start()
+
+
+def _collection(name):
+    """Collection handle by name, or None when MongoDB is not configured."""
+    handles = {'sessions': sessions_collection, 'metrics': metrics_collection, 'detections': detections_collection}
+    col = handles.get(name)
+    if col is None and mongo_db is not None:
+        col = mongo_db.get_collection(name)
+    return col
+
+
+# Without MongoDB, metric samples are kept in memory for reports
+METRICS_MEMORY_MAX_SAMPLES = max(2, int(os.environ.get('METRICS_MEMORY_MAX_SAMPLES', '100000')))
+METRICS_MEMORY_MAX_SESSIONS = max(1, int(os.environ.get('METRICS_MEMORY_MAX_SESSIONS', '10000')))
+METRICS_MEMORY_IDLE_TTL = float(os.environ.get('METRICS_MEMORY_IDLE_TTL', '3600'))
+METRICS_MEMORY_MAX_MB = float(os.environ.get('METRICS_MEMORY_MAX_MB', '256'))
+memory_reports = MemoryReportBackend(
+    METRICS_MEMORY_MAX_SAMPLES,
+    max_sessions=METRICS_MEMORY_MAX_SESSIONS,
+    idle_ttl=METRICS_MEMORY_IDLE_TTL,
+    max_bytes=int(METRICS_MEMORY_MAX_MB * 1024 * 1024),
+) if mongo_db is None else None
+
+
+# Write-behind persistence: detections and metrics are queued and written in
+# batches by a background thread instead of inside the request
+PERSIST_WRITE_BEHIND = os.environ.get('PERSIST_WRITE_BEHIND', 'true').lower() == 'true'
+PERSIST_QUEUE_MAX = max(1, int(os.environ.get('PERSIST_QUEUE_MAX', '10000')))
+PERSIST_BATCH_SIZE = max(1, int(os.environ.get('PERSIST_BATCH_SIZE', '500')))
+PERSIST_FLUSH_INTERVAL_MS = float(os.environ.get('PERSIST_FLUSH_INTERVAL_MS', '200'))
+PERSIST_OVERFLOW = os.environ.get('PERSIST_OVERFLOW', 'block').strip().lower()
+PERSIST_BLOCK_TIMEOUT = float(os.environ.get('PERSIST_BLOCK_TIMEOUT', '1.0'))
+PERSIST_SPILL_PATH = os.environ.get('PERSIST_SPILL_PATH') or None
+PERSIST_MAX_RETRIES = max(0, int(os.environ.get('PERSIST_MAX_RETRIES', '5')))
+
+write_queue = None
+if PERSIST_WRITE_BEHIND and mongo_db is not None:
+    write_queue = WriteBehindQueue(
+        _collection,
+        max_queue=PERSIST_QUEUE_MAX,
+        batch_size=PERSIST_BATCH_SIZE,
+        flush_interval=PERSIST_FLUSH_INTERVAL_MS / 1000.0,
+        overflow=PERSIST_OVERFLOW,
+        block_timeout=PERSIST_BLOCK_TIMEOUT,
+        spill_path=PERSIST_SPILL_PATH,
+        max_retries=PERSIST_MAX_RETRIES,
+        on_write=telemetry.observe_mongo_write if telemetry.enabled else None,
+    )
+    atexit.register(write_queue.close)
+
+
+@lifecycle.hook('replay_spill')
+def _replay_spilled_writes():
+    # In the serving process: writes queued before a fork would be lost with the parent's queue
+    if write_queue is None:
+        return
+    try:
+        replayed = write_queue.replay_spill()
+        if replayed:
+            app.logger.info(f'Re-queued {replayed} spilled writes from {PERSIST_SPILL_PATH}')
+    except Exception as e:
+        app.logger.error(f'Failed to replay spilled writes: {e}')
+
+
+# Per-session landmark archive (opt-in): each detection with a face is
+# appended as a fixed-size float16 record (landmark_archive.py), and
+# /api/sessions/<id>/landmarks reads ranges back through a memory map.
+# With DETECTIONS_STORE_LANDMARKS=false, detection documents leave the
+# landmarks out and keep only the summary fields.
+LANDMARK_ARCHIVE = os.environ.get('LANDMARK_ARCHIVE', 'false').lower() == 'true'
+LANDMARK_ARCHIVE_DIR = os.environ.get('LANDMARK_ARCHIVE_DIR') or os.path.join(tempfile.gettempdir(), 'neurovision-landmarks')
+LANDMARK_ARCHIVE_RETENTION_HOURS = max(0.0, float(os.environ.get('LANDMARK_ARCHIVE_RETENTION_HOURS', '168')))
+DETECTIONS_STORE_LANDMARKS = os.environ.get('DETECTIONS_STORE_LANDMARKS', 'true').lower() == 'true'
+
+landmark_archive = None
+if LANDMARK_ARCHIVE:
+    try:
+        landmark_archive = LandmarkArchive(
+            LANDMARK_ARCHIVE_DIR,
+            n_landmarks=landmark_codec.N_LANDMARKS,
+            retention=LANDMARK_ARCHIVE_RETENTION_HOURS * 3600 or None,
+        )
+        atexit.register(landmark_archive.close)
+    except OSError as e:
+        app.logger.error(f'Failed to open landmark archive at {LANDMARK_ARCHIVE_DIR}: {e}')
+
+
+@lifecycle.hook('landmark_archive')
+def _prune_landmark_archive():
+    if landmark_archive is None:
+        return
+    removed = landmark_archive.prune()
+    if removed:
+        app.logger.info(f'Removed {removed} landmark archives older than {LANDMARK_ARCHIVE_RETENTION_HOURS:g}h')
+
+
+# Names accepted for the base64 image payload in JSON bodies
+_IMAGE_JSON_KEYS = ('dataUrl', 'dataurl', 'imageBase64', 'image_base64')
+# Content types that carry the frame itself as the request body
+_BINARY_FRAME_TYPES = ('application/octet-stream', 'image/jpeg', 'image/png', 'image/webp')
+
+
 def _extract_image_bytes_from_request():
-    """Return (img_bytes, None) on success or (None, (body_dict, status)) on error."""
+    """Return (img_bytes, None) on success or (None, (body_dict, status)) on error.
+
+    `img_bytes` is a RawFrame for uncompressed binary uploads (see below).
+    """
     # Accept multipart/form-data file or JSON {dataUrl: 'data:...'}
     if 'image' in request.files:
         f = request.files['image']
         return f.read(), None
 
+    # Binary body: encoded JPEG/PNG, or raw pixels described by headers
+    #   X-Frame-Format: rgb | nv21, X-Frame-Width, X-Frame-Height
+    if request.mimetype in _BINARY_FRAME_TYPES:
+        body = request.get_data(cache=False)
+        if not body:
+            return None, ({'error': 'No image provided'}, 400)
+        fmt = request.headers.get('X-Frame-Format', '').strip().lower()
+        if fmt and fmt not in ('jpeg', 'jpg', 'png', 'webp'):
+            try:
+                width = int(request.headers.get('X-Frame-Width', '0'))
+                height = int(request.headers.get('X-Frame-Height', '0'))
+                return RawFrame(body, fmt, width, height), None
+            except ValueError as e:
+                return None, ({'error': f'Invalid raw frame: {e}'}, 400)
+        return body, None
+
     if not request.is_json:
         return None, ({'error': 'Request must be JSON when not using form-data'}, 400)
 
-    data = request.get_json() or {}
-    # support several names for base64 image payload
-    data_url = data.get('dataUrl') or data.get('dataurl') or data.get('imageBase64') or data.get('image_base64')
-    if not data_url:
-        return None, ({'error': 'No image provided'}, 400)
-
-    # If data_url is a data: URI, strip header
-    if isinstance(data_url, str) and data_url.startswith('data:'):
-        try:
-            _, b64 = data_url.split(',', 1)
-        except Exception:
-            return None, ({'error': 'Invalid data URL'}, 400)
-    else:
-        b64 = data_url
-
+    # Decode the base64 field while streaming the body instead of building the
+    # whole JSON document (and its base64 text) in memory first.
     try:
-        img_bytes = base64.b64decode(b64)
-    except Exception:
+        img_bytes = read_base64_field(request.stream, _IMAGE_JSON_KEYS, max_bytes=INFERENCE_MAX_FRAME_BYTES)
+    except InvalidDataUrl:
+        return None, ({'error': 'Invalid data URL'}, 400)
+    except ValueError:
         return None, ({'error': 'Failed to decode image data'}, 400)
+    if not img_bytes:
+        return None, ({'error': 'No image provided'}, 400)
 
     return img_bytes, None
 
 
+def _metrics_writes(session_id, data):
+    """(timestamp, values, [(collection name, filter, update), ...]) storing one metrics sample.
+
+    The sample is appended to its time bucket and folded into the running
+    aggregates on the session document (see metrics_store.py); both writes
+    are upserts.
+    """
+    timestamp = datetime.now(timezone.utc)
+    values = metrics_store.sample_values(data)
+    bucket_filter, bucket_update = metrics_store.bucket_update(session_id, timestamp, values, METRICS_BUCKET_SECONDS)
+    # Use an upsert that ensures 'sessionId' is set so a unique index on
+    # sessionId won't see null values.
+    session_filter = {'$or': [{'_id': session_id}, {'sessionId': session_id}]}
+    session_update = metrics_store.summary_update(session_id, timestamp, values)
+    return timestamp, values, [
+        (metrics_store.BUCKETS_COLLECTION, bucket_filter, bucket_update),
+        ('sessions', session_filter, session_update),
+    ]
+
+
+def _persist_metrics(session_id, data):
+    """Store one metrics sample (client-posted or computed server-side), best-effort."""
+    timestamp, values, writes = _metrics_writes(session_id, data)
+
+    if memory_reports is not None:
+        memory_reports.add(session_id, timestamp, values)
+        return
+
+    # Persist metrics (best-effort)
+    try:
+        for name, filter_, update in writes:
+            if write_queue is not None:
+                write_queue.update(name, filter_, update, upsert=True)
+                continue
+            col = _collection(name)
+            if col is not None:
+                col.update_one(filter_, update, upsert=True)
+    except Exception as e:
+        app.logger.warning(f'Failed to persist metrics: {e}')
+
+
 @app.route('/api/sessions/<session_id>/metrics', methods=['POST', 'OPTIONS'])
 def post_session_metrics(session_id):
     if request.method == 'OPTIONS':
@@ -125,7 +524,7 @@ def post_session_metrics(session_id):
 
     try:
         # Validate session exists in memory or allow creation if not
-        if session_id not in sessions:
+        if sessions.get(session_id) is None:
             # If we don't have in-memory session, still allow metrics if sessions_collection has it
             if sessions_collection is None:
                 response = jsonify({'error': 'Session not found'})
@@ -139,35 +538,7 @@ def post_session_metrics(session_id):
 
         data = request.get_json() or {}
 
-        # Attach timestamp and source
-        metrics_doc = {
-            'sessionId': session_id,
-            'timestamp': datetime.now(timezone.utc),
-            'source': request.remote_addr,
-            'metrics': data,
-        }
-
-        # Persist metrics (best-effort)
-        try:
-            if metrics_collection is not None:
-                col = metrics_collection
-            else:
-                col = mongo_db.get_collection('metrics') if mongo_db is not None else None
-            if col is not None:
-                to_insert = dict(metrics_doc)
-                col.insert_one(to_insert)
-
-            # Also push to the session document for quick aggregation (best-effort).
-            # Use an upsert that ensures 'sessionId' is set so a unique index on
-            # sessionId won't see null values.
-            if sessions_collection is not None:
-                sc = sessions_collection
-            else:
-                sc = mongo_db.get_collection('sessions') if mongo_db is not None else None
-            if sc is not None:
-                sc.update_one({'$or': [{'_id': session_id}, {'sessionId': session_id}]}, {'$set': {'last_activity': metrics_doc['timestamp'], 'sessionId': session_id}, '$push': {'metrics': metrics_doc}}, upsert=True)
-        except Exception as e:
-            app.logger.warning(f'Failed to persist metrics: {e}')
+        _persist_metrics(session_id, data)
 
         response = jsonify({'status': 'ok'})
         response.headers.add('Access-Control-Allow-Origin', '*')
@@ -179,57 +550,372 @@ def post_session_metrics(session_id):
         return response, 500
 
 
-def _process_image_bytes(img_bytes, remote_addr=None):
-    """Process raw image bytes with MediaPipe face_mesh and return a JSON-serializable result plus HTTP status.
-    This is a lightweight best-effort processor used by the /detect endpoints.
-    """
-    try:
-        image = Image.open(io.BytesIO(img_bytes)).convert('RGB')
-    except Exception as e:
-        app.logger.error(f'Failed to open image: {e}')
-        return {'error': 'Invalid image data'}, 400
+def _faces_response(faces, track_ids=None):
+    """Build the /detect result from a (faces, landmarks, 3) array.
 
-    try:
-        img_np = np.array(image)
-        # MediaPipe expects RGB image
-        results = face_mesh.process(img_np)
-    except Exception as e:
-        app.logger.error(f'Error running MediaPipe face mesh: {e}', exc_info=True)
-        return {'error': 'Face processing failed'}, 500
-
-    out = {'faces': 0, 'landmarks': [], 'face_area_percent': None}
-    if not results or not getattr(results, 'multi_face_landmarks', None):
-        return out, 200
+    'landmarks' holds the first face as a float32 array (or None); it is
+    serialized by _render_detection in whatever encoding the client asked for.
+    With DETECT_MAX_FACES above 1, 'face_boxes' lists every face (track id,
+    box, area, and landmarks that _render_detection keeps only for the faces
+    the client asked for) and 'track_id' is the first face's track.
+    """
+    out = {'faces': 0, 'landmarks': None, 'face_area_percent': None}
+    if DETECT_MAX_FACES > 1:
+        out['track_id'] = track_ids[0] if track_ids else None
+        out['face_boxes'] = []
+    if faces is None or len(faces) == 0:
+        return out
+
+    if DETECT_MAX_FACES > 1:
+        boxes = face_tracks.face_boxes(faces)
+        areas = face_tracks.box_areas(boxes)
+        out['face_boxes'] = [
+            {'track_id': track_ids[i] if track_ids else None, 'bbox': [float(v) for v in boxes[i]],
+             'area_percent': float(areas[i]), 'landmarks': faces[i]}
+            for i in range(len(faces))
+        ]
 
-    faces = results.multi_face_landmarks
     out['faces'] = len(faces)
     # Only return first face landmarks to keep payload small
     first = faces[0]
-    lms = []
-    xs = []
-    ys = []
-    for lm in first.landmark:
-        lms.append({'x': lm.x, 'y': lm.y, 'z': lm.z})
-        xs.append(lm.x)
-        ys.append(lm.y)
-
-    out['landmarks'] = lms
+    out['landmarks'] = first
 
     try:
-        minx = min(xs)
-        maxx = max(xs)
-        miny = min(ys)
-        maxy = max(ys)
-        area = max(0.0, (maxx - minx) * (maxy - miny) * 100.0)
+        xy = first[:, :2].astype(np.float64)
+        minx, miny = xy.min(axis=0)
+        maxx, maxy = xy.max(axis=0)
+        area = max(0.0, float((maxx - minx) * (maxy - miny) * 100.0))
         out['face_area_percent'] = area
     except Exception:
         out['face_area_percent'] = None
 
+    return out
+
+
+def _render_detection(body, encoding='json', indices=None, faces=None):
+    """JSON-ready copy of a detection result with landmarks in the requested encoding.
+
+    `faces` picks the 'face_boxes' entries that keep their landmarks: None
+    (the first face's are the top-level landmarks, so none), 'all', or a set
+    of track ids (see _face_selection).
+    """
+    if 'landmarks' not in body:
+        # error bodies pass through unchanged
+        return body
+    out = {k: v for k, v in body.items() if k != 'landmarks'}
+    out.update(landmark_codec.encode_json(body['landmarks'], encoding, indices))
+    if body.get('face_boxes'):
+        out['face_boxes'] = [_render_face_box(entry, encoding, indices, faces and n > 0 and (
+            faces == 'all' or entry['track_id'] in faces)) for n, entry in enumerate(body['face_boxes'])]
+    return out
+
+
+def _render_face_box(entry, encoding, indices, with_landmarks):
+    out = {k: v for k, v in entry.items() if k != 'landmarks'}
+    if with_landmarks:
+        out.update(landmark_codec.encode_json(entry['landmarks'], encoding, indices))
+    return out
+
+
+def _face_selection():
+    """Faces whose landmarks a multi-face result carries besides the first, from `?faces=`.
+
+    `primary` (the default) for none, `all`, or comma-separated track ids.
+    """
+    value = (request.args.get('faces') or 'primary').strip().lower()
+    if value == 'primary':
+        return None
+    if value == 'all':
+        return 'all'
+    try:
+        return frozenset(int(v) for v in value.split(',') if v.strip())
+    except ValueError:
+        raise ValueError(f'faces must be primary, all or track ids, not {value!r}')
+
+
+def _landmark_format():
+    """Negotiate (encoding, subset indices, binary) from the request.
+
+    `?encoding=json|f32|f16|i16` or an Accept of
+    `application/vnd.neurovision.landmarks+<encoding>` picks the encoding;
+    `?subset=eyes,iris,mouth` restricts the landmarks. Packed encodings are
+    returned as a raw body when the client accepts application/octet-stream
+    (or the vnd type), otherwise base64 inside the usual JSON.
+    """
+    accept = request.headers.get('Accept', '')
+    encoding = (request.args.get('encoding') or '').strip().lower()
+    vnd = 'application/vnd.neurovision.landmarks+'
+    if not encoding and vnd in accept:
+        encoding = accept.split(vnd, 1)[1].split(',')[0].split(';')[0].strip().lower()
+    encoding = encoding or 'json'
+    if encoding not in landmark_codec.ENCODINGS:
+        raise ValueError(f'unsupported landmark encoding {encoding!r}')
+    subset = request.args.get('subset')
+    indices = landmark_codec.subset_indices(subset) if subset else None
+    binary = encoding != 'json' and ('application/octet-stream' in accept or vnd in accept)
+    return encoding, indices, binary
+
+
+def _binary_detection_response(body, encoding, indices):
+    """Packed landmarks as the response body; the scalar fields travel in headers."""
+    points = body.get('landmarks')
+    if points is not None and indices is not None:
+        points = points[indices]
+    payload = landmark_codec.pack(points, encoding) if points is not None else b''
+    response = Response(payload, mimetype='application/octet-stream')
+    response.headers['X-Faces'] = str(body.get('faces', 0))
+    if body.get('face_area_percent') is not None:
+        response.headers['X-Face-Area-Percent'] = repr(body['face_area_percent'])
+    response.headers['X-Landmark-Encoding'] = encoding
+    response.headers['X-Landmark-Count'] = str(0 if points is None else len(points))
+    if encoding == 'i16':
+        response.headers['X-Landmark-Scale'] = repr(landmark_codec.I16_SCALE)
+    if indices is not None:
+        response.headers['X-Landmark-Indices'] = ','.join(map(str, indices.tolist()))
+    if body.get('metrics') is not None:
+        response.headers['X-Metrics'] = json.dumps(body['metrics'], separators=(',', ':'))
+    if 'face_boxes' in body:
+        # Boxes only; other faces' landmarks are only in the JSON result
+        if body.get('track_id') is not None:
+            response.headers['X-Track-Id'] = str(body['track_id'])
+        response.headers['X-Face-Boxes'] = json.dumps(
+            [_render_face_box(entry, encoding, indices, False) for entry in body['face_boxes']], separators=(',', ':'))
+    return response
+
+
+def _process_image_bytes(img_bytes, remote_addr=None, session_id=None, session=None):
+    """Process raw image bytes with MediaPipe face_mesh and return a JSON-serializable result plus HTTP status.
+    This is a lightweight best-effort processor used by the /detect endpoints.
+    When `session_id` is given and video mode is on, the session's tracking graph is used.
+    `session` is the in-memory session record; its 'last_bbox' seeds ROI cropping
+    and is updated from this frame's landmarks, and its rolling metrics state
+    produces the 'metrics' field (see face_metrics.py). With DETECT_MAX_FACES
+    above 1 its 'face_tracks' assign track ids, and the primary track's face
+    comes first. Session frames seen recently are answered from the frame
+    cache (see frame_cache.py).
+    """
+    roi = session.get('last_bbox') if (session is not None and DETECT_ROI_CROP) else None
+    tracks = session.get('face_tracks') if (session is not None and DETECT_MAX_FACES > 1) else None
+    # A crop that lost one of the tracked faces falls back to the full frame
+    min_faces = max(1, face_tracks.live_tracks(tracks))
+    if (roi is not None and min_faces < DETECT_MAX_FACES and DETECT_FULL_FRAME_INTERVAL
+            and session.get('frames_processed', 0) % DETECT_FULL_FRAME_INTERVAL == 0):
+        # The crop only sees the faces already tracked; look for new ones now and then
+        roi = None
+
+    cached = probe = None
+    if frame_cache is not None and session is not None:
+        # A repeated (or, optionally, near-identical) frame reuses its result
+        with telemetry.stage('cache'):
+            cached, probe = frame_cache.lookup(session_id, img_bytes)
+    if cached is not None:
+        faces, frame_size = cached
+    else:
+        started = time.perf_counter()
+        if inference_engine is not None:
+            try:
+                # Decoding happens in the worker process, so it is part of this stage
+                with telemetry.stage('inference'):
+                    faces, frame_size = inference_engine.infer(
+                        img_bytes, max_long_edge=DETECT_MAX_LONG_EDGE, roi=roi, margin=DETECT_ROI_MARGIN,
+                        min_faces=min_faces, with_size=True)
+            except BadFrame as e:
+                app.logger.error(f'Failed to open image: {e}')
+                return {'error': 'Invalid image data'}, 400
+            except EngineBusy as e:
+                app.logger.warning(f'Inference engine busy: {e}')
+                return {'error': 'Face processing busy, retry later'}, 503
+            except EngineError as e:
+                app.logger.error(f'Error running MediaPipe face mesh in worker: {e}')
+                return {'error': 'Face processing failed'}, 500
+        else:
+            try:
+                with telemetry.stage('decode'):
+                    img_np = decode_image(img_bytes, DETECT_MAX_LONG_EDGE)
+                frame_size = img_np.shape[:2]
+            except Exception as e:
+                app.logger.error(f'Failed to open image: {e}')
+                return {'error': 'Invalid image data'}, 400
+
+            try:
+                # MediaPipe expects RGB image
+                with _face_mesh_for(session_id) as (face_mesh, tracking), telemetry.stage('inference'):
+                    def infer(frame):
+                        return landmarks_array(face_mesh.process(frame))
+                    # A tracking graph keeps its own ROI; cropping would break its frame-to-frame state
+                    faces = infer(img_np) if tracking else detect_landmarks(infer, img_np, roi, DETECT_ROI_MARGIN, min_faces)
+            except PoolTimeout as e:
+                app.logger.warning(f'FaceMesh pool exhausted: {e}')
+                return {'error': 'Face processing busy, retry later'}, 503
+            except Exception as e:
+                app.logger.error(f'Error running MediaPipe face mesh: {e}', exc_info=True)
+                return {'error': 'Face processing failed'}, 500
+        if probe is not None:
+            frame_cache.store(session_id, probe, (faces, frame_size), time.perf_counter() - started)
+
+    track_ids = None
+    if session is not None and DETECT_MAX_FACES > 1:
+        with telemetry.stage('tracking'):
+            boxes = face_tracks.face_boxes(faces)
+            track_ids, primary, session['face_tracks'] = face_tracks.update(
+                tracks, boxes, DETECT_TRACK_IOU, max_missed=DETECT_TRACK_MAX_MISSED)
+            if primary:
+                # The primary face first: top-level landmarks and metrics follow one person
+                order = [primary] + [i for i in range(len(faces)) if i != primary]
+                faces = faces[order]
+                track_ids = [track_ids[i] for i in order]
+            session['last_bbox'] = face_tracks.union_box(boxes)
+    out = _faces_response(faces, track_ids)
+    if session is not None:
+        if DETECT_MAX_FACES == 1:
+            session['last_bbox'] = landmark_bbox(faces)
+        if DETECT_METRICS:
+            state = session.get('metrics_state')
+            if state is None:
+                state = session.setdefault('metrics_state', SessionMetrics())
+            height, width = frame_size
+            with telemetry.stage('metrics'):
+                out['metrics'] = state.update(faces[0] if len(faces) else None, aspect=width / height)
     return out, 200
 
 
-# Session management
-sessions = {}
+# Optional micro-batching in front of _process_image_bytes. Concurrent detect
+# requests are grouped for up to DETECT_BATCH_MAX_DELAY_MS or
+# DETECT_BATCH_MAX_SIZE frames; each batch is decoded and run through the
+# inference pool in parallel and results are fanned back out.
+DETECT_BATCHING = os.environ.get('DETECT_BATCHING', 'false').lower() == 'true'
+DETECT_BATCH_MAX_SIZE = max(1, int(os.environ.get('DETECT_BATCH_MAX_SIZE', '8')))
+DETECT_BATCH_MAX_DELAY_MS = float(os.environ.get('DETECT_BATCH_MAX_DELAY_MS', '5'))
+
+batch_scheduler = None
+_batch_item_executor = None
+
+
+def _process_image_batch(batch):
+    """Run a batch of _process_image_bytes argument tuples concurrently; results keep input order."""
+    return list(_batch_item_executor.map(lambda args: _process_image_bytes(*args), batch))
+
+
+if DETECT_BATCHING and (face_mesh_pool is not None or inference_engine is not None):
+    # One item thread per graph (or worker slot) keeps the pool saturated
+    _capacity = FACEMESH_POOL_SIZE if face_mesh_pool is not None else INFERENCE_WORKERS * INFERENCE_SLOTS_PER_WORKER
+    _batch_item_executor = ThreadPoolExecutor(max_workers=_capacity, thread_name_prefix='detect-item')
+    batch_scheduler = MicroBatchScheduler(
+        _process_image_batch,
+        max_batch_size=DETECT_BATCH_MAX_SIZE,
+        max_delay=DETECT_BATCH_MAX_DELAY_MS / 1000.0,
+    )
+    atexit.register(batch_scheduler.close)
+
+
+# Admission control in front of inference: a bounded number of frames in
+# flight (tuned AIMD-style from inference latency between ADMISSION_MIN_INFLIGHT
+# and ADMISSION_MAX_INFLIGHT), one frame per session, and fast 429/503 with
+# Retry-After instead of queueing past ADMISSION_QUEUE_TIMEOUT_MS
+ADMISSION_CONTROL = os.environ.get('ADMISSION_CONTROL', 'true').lower() == 'true'
+_inference_capacity = INFERENCE_WORKERS * INFERENCE_SLOTS_PER_WORKER if inference_engine is not None else FACEMESH_POOL_SIZE
+ADMISSION_MAX_INFLIGHT = max(1, int(os.environ.get('ADMISSION_MAX_INFLIGHT') or 2 * _inference_capacity))
+ADMISSION_MIN_INFLIGHT = max(1, int(os.environ.get('ADMISSION_MIN_INFLIGHT', '1')))
+ADMISSION_TARGET_LATENCY_MS = float(os.environ.get('ADMISSION_TARGET_LATENCY_MS', '250'))
+ADMISSION_QUEUE_TIMEOUT_MS = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT_MS', '1000'))
+
+admission = None
+if ADMISSION_CONTROL:
+    admission = AdmissionController(
+        max_limit=ADMISSION_MAX_INFLIGHT,
+        min_limit=ADMISSION_MIN_INFLIGHT,
+        initial_limit=_inference_capacity,
+        target_latency=ADMISSION_TARGET_LATENCY_MS / 1000.0,
+        queue_timeout=ADMISSION_QUEUE_TIMEOUT_MS / 1000.0,
+    )
+
+
+def _detect_frame(img_bytes, remote_addr=None, session_id=None, session=None):
+    """Entry point for /detect: admission control, then the batch scheduler when enabled.
+
+    A rejected frame gets a 429/503 body carrying 'retry_after' (seconds),
+    as does a frame arriving before the graphs are built and warmed up.
+    """
+    if not lifecycle.ready:
+        lifecycle.wait(FACEMESH_POOL_TIMEOUT)
+        if not lifecycle.finished:
+            return {'error': 'Face processing is starting, retry later', 'retry_after': 1}, 503
+    if admission is None:
+        return _dispatch_frame(img_bytes, remote_addr, session_id, session)
+    try:
+        queued = time.perf_counter()
+        with admission.admit(session_id):
+            telemetry.observe_stage('queue', time.perf_counter() - queued)
+            return _dispatch_frame(img_bytes, remote_addr, session_id, session)
+    except Rejected as e:
+        return {'error': e.reason, 'retry_after': math.ceil(e.retry_after)}, e.status
+
+
+def _dispatch_frame(img_bytes, remote_addr=None, session_id=None, session=None):
+    if batch_scheduler is None or (session_graphs is not None and session_id is not None):
+        # Tracking frames are sequential per session; batching would not help
+        return _process_image_bytes(img_bytes, remote_addr, session_id, session)
+    try:
+        return batch_scheduler.submit((img_bytes, remote_addr, session_id, session), timeout=FACEMESH_POOL_TIMEOUT * 2)
+    except SchedulerTimeout as e:
+        app.logger.warning(f'Batched detection timed out: {e}')
+        return {'error': 'Face processing busy, retry later'}, 503
+
+
+# Session management. Each worker keeps a compact record per session (no
+# detection payloads), bounded by count, idle time and an estimated memory
+# budget; evicted sessions are reloaded from MongoDB on their next request.
+SESSION_STORE_MAX = max(1, int(os.environ.get('SESSION_STORE_MAX', '10000')))
+SESSION_IDLE_TTL = float(os.environ.get('SESSION_IDLE_TTL', '3600'))
+SESSION_COMPLETED_TTL = float(os.environ.get('SESSION_COMPLETED_TTL', '300'))
+SESSION_STORE_MAX_MB = float(os.environ.get('SESSION_STORE_MAX_MB', '64'))
+# Records shared by all workers (gunicorn -w N): 'mmap' (one host), 'redis',
+# 'local' (per worker), or 'auto' = mmap where available. Each worker
+# re-reads a shared record at most every SESSION_CACHE_TTL seconds. The mmap
+# table is keyed by SESSION_SHARED_NAME (default: this app's directory), so
+# unrelated deployments on one host never share it.
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'auto').strip().lower()
+SESSION_SHARED_NAME = os.environ.get('SESSION_SHARED_NAME') or _APP_DIR
+SESSION_SHARED_PATH = os.environ.get('SESSION_SHARED_PATH') or os.path.join(
+    tempfile.gettempdir(),
+    f"neurovision-sessions-{hashlib.sha1(SESSION_SHARED_NAME.encode('utf-8')).hexdigest()[:12]}.tbl")
+SESSION_SHARED_SLOTS = max(16, int(os.environ.get('SESSION_SHARED_SLOTS', '8192')))
+SESSION_REDIS_URL = os.environ.get('SESSION_REDIS_URL', 'redis://localhost:6379/0')
+SESSION_CACHE_TTL = max(0.0, float(os.environ.get('SESSION_CACHE_TTL', '1.0')))
+
+shared_sessions = None
+try:
+    if SESSION_BACKEND == 'redis':
+        shared_sessions = RedisSessionTable(SESSION_REDIS_URL)
+    elif SESSION_BACKEND == 'mmap' or (SESSION_BACKEND == 'auto' and MMAP_AVAILABLE):
+        shared_sessions = MmapSessionTable(SESSION_SHARED_PATH, slots=SESSION_SHARED_SLOTS)
+except Exception as e:
+    app.logger.error(f'Failed to open shared session table ({SESSION_BACKEND}); sessions stay per worker: {e}')
+    shared_sessions = None
+
+
+def _on_session_evicted(session_id, record):
+    if session_graphs is not None:
+        session_graphs.evict(session_id)
+    if frame_cache is not None:
+        frame_cache.discard(session_id)
+    if landmark_archive is not None:
+        landmark_archive.release(session_id)
+    if memory_reports is not None and shared_sessions is None:
+        # This store was the session's only copy; with a shared table it lives
+        # on in other workers, and the samples go by memory_reports' own limits
+        memory_reports.discard(session_id)
+
+
+sessions = SessionStore(
+    max_sessions=SESSION_STORE_MAX,
+    idle_ttl=SESSION_IDLE_TTL,
+    completed_ttl=SESSION_COMPLETED_TTL,
+    max_bytes=int(SESSION_STORE_MAX_MB * 1024 * 1024),
+    on_evict=_on_session_evicted,
+    backend=shared_sessions,
+    cache_ttl=SESSION_CACHE_TTL,
+)
 
 @app.route('/api/sessions/start', methods=['POST', 'OPTIONS'])
 def start_session():
@@ -270,7 +956,7 @@ def start_session():
             'detections': []
         }
 
-        sessions[session_id] = session_data
+        sessions[session_id] = {k: v for k, v in session_data.items() if k != 'detections'}
 
         # persist session document (best-effort) -- ensure we set sessionId so a
         # unique index on sessionId won't see a null value.
@@ -318,34 +1004,28 @@ def end_session(session_id):
     try:
         # If session not in memory (e.g., server restart or different worker),
         # try to hydrate from MongoDB so clients can still end sessions.
-        if session_id not in sessions:
-            try:
-                sc = sessions_collection if sessions_collection is not None else (mongo_db.get_collection('sessions') if mongo_db is not None else None)
-                if sc is not None:
-                    doc = sc.find_one({'$or': [{'_id': session_id}, {'sessionId': session_id}]})
-                    if doc:
-                        sessions[session_id] = {
-                            'session_id': session_id,
-                            'start_time': doc.get('start_time'),
-                            'end_time': doc.get('end_time'),
-                            'status': doc.get('status', 'active'),
-                            'metadata': doc.get('metadata', {}),
-                            'frames_processed': doc.get('frames_processed', 0),
-                            'detections': doc.get('detections', []),
-                        }
-            except Exception:
-                pass
+        session = _hydrate_session(session_id)
 
-        if session_id not in sessions:
+        if session is None:
             response = jsonify({'error': 'Session not found'})
             response.headers.add('Access-Control-Allow-Origin', '*')
             return response, 404
         
         end_time = datetime.now(timezone.utc)
-        sessions[session_id].update({
+        session.update({
             'end_time': end_time,
             'status': 'completed'
         })
+        # Ended sessions are kept briefly (for late requests) and evicted first
+        sessions.complete(session_id)
+
+        # Release the session's tracking graph right away instead of waiting for the TTL
+        if session_graphs is not None:
+            session_graphs.evict(session_id)
+        if frame_cache is not None:
+            frame_cache.discard(session_id)
+        if landmark_archive is not None:
+            landmark_archive.release(session_id)
         
         try:
             if sessions_collection is not None:
@@ -376,83 +1056,146 @@ def end_session(session_id):
         response.headers.add('Access-Control-Allow-Origin', '*')
         return response, 500
 
+# Fields of session documents never needed in memory (pre-bucketing sessions
+# pushed every sample and detection onto the document)
+_SESSION_PROJECTION = {'metrics': 0, 'detections': 0}
+
+
+def _hydrate_session(session_id):
+    """The session's in-memory record, loaded from MongoDB (restart / other worker /
+    evicted) when missing, or None."""
+    session = sessions.get(session_id)
+    if session is not None:
+        return session
+    try:
+        sc = sessions_collection if sessions_collection is not None else (mongo_db.get_collection('sessions') if mongo_db is not None else None)
+        if sc is not None:
+            # Search by either the document _id or the indexed 'sessionId' field.
+            # Older documents may carry long pushed arrays; don't ship them.
+            doc = sc.find_one({'$or': [{'_id': session_id}, {'sessionId': session_id}]}, _SESSION_PROJECTION)
+            if doc:
+                # Normalize into in-memory session structure
+                session = {
+                    'session_id': session_id,
+                    'start_time': doc.get('start_time'),
+                    'end_time': doc.get('end_time'),
+                    'status': doc.get('status', 'active'),
+                    'metadata': doc.get('metadata', {}),
+                    'frames_processed': doc.get('frames_processed', 0),
+                }
+                sessions[session_id] = session
+                if session['status'] == 'completed':
+                    sessions.complete(session_id)
+    except Exception:
+        pass
+    return session
+
+
+def _record_detection(session_id, session, resp_body, remote_addr):
+    """Count a successful detection on the in-memory session and persist it (best-effort)."""
+    try:
+        detection_data = {
+            'timestamp': datetime.now(timezone.utc),
+            'data': resp_body,
+            'source': remote_addr
+        }
+
+        # Memory keeps counters and the last result's summary; payloads only go to MongoDB
+        session['frames_processed'] = session.get('frames_processed', 0) + 1
+        if resp_body.get('faces'):
+            session['frames_with_face'] = session.get('frames_with_face', 0) + 1
+        session['last_detection'] = {
+            'timestamp': detection_data['timestamp'],
+            'faces': resp_body.get('faces', 0),
+            'face_area_percent': resp_body.get('face_area_percent'),
+        }
+
+        try:
+            # Use 'sessionId' to be consistent with session documents/indexes;
+            # stored documents keep the default JSON landmark shape
+            with telemetry.stage('persist'):
+                if DETECTIONS_STORE_LANDMARKS:
+                    data = _render_detection(resp_body)
+                else:
+                    # The landmarks are in the archive; keep only the summary fields
+                    data = {k: v for k, v in resp_body.items() if k != 'landmarks'}
+                    if data.get('face_boxes'):
+                        data['face_boxes'] = [_render_face_box(entry, 'json', None, False) for entry in data['face_boxes']]
+                doc = {'sessionId': session_id, **detection_data, 'data': data}
+                if write_queue is not None:
+                    write_queue.insert('detections', doc)
+                else:
+                    col = _collection('detections')
+                    if col is not None:
+                        started = time.perf_counter()
+                        col.insert_one(doc)
+                        telemetry.observe_mongo_write('detections', 'insert_one', time.perf_counter() - started)
+        except Exception as e:
+            app.logger.error(f'Failed to save detection to MongoDB: {e}')
+
+        if landmark_archive is not None and resp_body.get('faces'):
+            with telemetry.stage('archive'):
+                landmark_archive.append(session_id, resp_body['landmarks'])
+
+        # Update session in memory, and for the other workers
+        session['last_activity'] = detection_data['timestamp']
+        sessions.record_frame(session_id, session, resp_body.get('faces'))
+
+        if DETECT_METRICS_PERSIST and resp_body.get('metrics'):
+            _persist_metrics(session_id, dict(resp_body['metrics'], landmarkCount=landmark_codec.N_LANDMARKS if resp_body.get('faces') else 0))
+
+    except Exception as e:
+        app.logger.error(f'Error processing detection data: {str(e)}', exc_info=True)
+
+
 @app.route('/api/sessions/<session_id>/detect', methods=['POST', 'OPTIONS'])
 def detect_with_session(session_id):
     if request.method == 'OPTIONS':
         # Handle preflight request
         response = jsonify({'status': 'preflight'})
         response.headers.add('Access-Control-Allow-Origin', '*')
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type, x-api-key, Authorization')
+        response.headers.add('Access-Control-Allow-Headers', 'Content-Type, x-api-key, Authorization, X-Frame-Format, X-Frame-Width, X-Frame-Height')
         response.headers.add('Access-Control-Allow-Methods', 'POST, OPTIONS')
         return response
     
     try:
-        if session_id not in sessions:
-            # Try to hydrate session from MongoDB if available
-            try:
-                    sc = sessions_collection if sessions_collection is not None else (mongo_db.get_collection('sessions') if mongo_db is not None else None)
-                    if sc is not None:
-                        # Search by either the document _id or the indexed 'sessionId' field.
-                        doc = sc.find_one({'$or': [{'_id': session_id}, {'sessionId': session_id}]})
-                    if doc:
-                        # Normalize into in-memory session structure
-                        sessions[session_id] = {
-                            'session_id': session_id,
-                            'start_time': doc.get('start_time'),
-                            'end_time': doc.get('end_time'),
-                            'status': doc.get('status', 'active'),
-                            'metadata': doc.get('metadata', {}),
-                            'frames_processed': doc.get('frames_processed', 0),
-                            'detections': doc.get('detections', [])
-                        }
-            except Exception:
-                pass
+        session = _hydrate_session(session_id)
 
-        if session_id not in sessions:
+        if session is None:
             response = jsonify({'error': 'Session not found or expired'})
             response.headers.add('Access-Control-Allow-Origin', '*')
             return response, 404
 
+        try:
+            encoding, indices, binary = _landmark_format()
+            faces = _face_selection()
+        except ValueError as e:
+            response = jsonify({'error': str(e)})
+            response.headers.add('Access-Control-Allow-Origin', '*')
+            return response, 400
+
         # Extract image bytes from request
-        img_bytes, err = _extract_image_bytes_from_request()
+        with telemetry.stage('parse'):
+            img_bytes, err = _extract_image_bytes_from_request()
         if err is not None:
             err_body, err_status = err
             response = jsonify(err_body)
             response.headers.add('Access-Control-Allow-Origin', '*')
             return response, err_status
 
-        resp_body, resp_status = _process_image_bytes(img_bytes, request.remote_addr)
+        resp_body, resp_status = _detect_frame(img_bytes, request.remote_addr, session_id, session)
 
         # If detection was successful, log it to the session
         if resp_status == 200:
-            try:
-                detection_data = {
-                    'timestamp': datetime.now(timezone.utc),
-                    'data': resp_body,
-                    'source': request.remote_addr
-                }
-
-                sessions[session_id]['detections'].append(detection_data)
-                sessions[session_id]['frames_processed'] = len(sessions[session_id]['detections'])
-
-                try:
-                    if detections_collection is not None:
-                        col = detections_collection
-                    else:
-                        col = mongo_db.get_collection('detections') if mongo_db is not None else None
-                    if col is not None:
-                        # Use 'sessionId' to be consistent with session documents/indexes
-                        col.insert_one({'sessionId': session_id, **detection_data})
-                except Exception as e:
-                    app.logger.error(f'Failed to save detection to MongoDB: {e}')
-
-                # Update session in memory
-                sessions[session_id]['last_activity'] = detection_data['timestamp']
-
-            except Exception as e:
-                app.logger.error(f'Error processing detection data: {str(e)}', exc_info=True)
+            _record_detection(session_id, session, resp_body, request.remote_addr)
 
-        response = jsonify(resp_body)
+        with telemetry.stage('serialize'):
+            if binary and resp_status == 200:
+                response = _binary_detection_response(resp_body, encoding, indices)
+            else:
+                response = jsonify(_render_detection(resp_body, encoding, indices, faces))
+        if 'retry_after' in resp_body:
+            response.headers['Retry-After'] = str(resp_body['retry_after'])
         response.headers.add('Access-Control-Allow-Origin', '*')
         return response, resp_status
         
@@ -466,6 +1209,196 @@ def detect_with_session(session_id):
         return response, 500
 
 
+# WebSocket stream: one connection per session, frames pushed continuously and
+# results returned in order. The session is validated once per connection.
+STREAM_MAX_QUEUE = max(1, int(os.environ.get('STREAM_MAX_QUEUE', '2')))
+
+
+def stream_session(ws, session_id):
+    session = _hydrate_session(session_id)
+    if session is None:
+        ws.send(json.dumps({'type': 'error', 'error': 'Session not found or expired'}))
+        return
+    remote_addr = request.remote_addr
+    try:
+        # Packed encodings are sent base64-encoded inside the JSON result messages
+        encoding, indices, _ = _landmark_format()
+        faces = _face_selection()
+    except ValueError as e:
+        ws.send(json.dumps({'type': 'error', 'error': str(e)}))
+        return
+
+    def process(frame):
+        resp_body, resp_status = _detect_frame(frame, remote_addr, session_id, session)
+        if resp_status == 200:
+            _record_detection(session_id, session, resp_body, remote_addr)
+        return _render_detection(resp_body, encoding, indices, faces), resp_status
+
+    stream = FrameStream(ws, process, _IMAGE_JSON_KEYS, max_queue=STREAM_MAX_QUEUE, max_frame_bytes=INFERENCE_MAX_FRAME_BYTES)
+    stream.run({'session_id': session_id})
+    app.logger.info(f'Stream for session {session_id} closed: {stream.processed} processed, {stream.dropped} dropped')
+
+
+sock = Sock(app) if Sock is not None else None
+if sock is not None:
+    sock.route('/api/sessions/<session_id>/stream')(stream_session)
+
+
+# LLM analysis of reports. Calls run on a small background pool with one
+# reused client, and results are cached by a hash of the prompt.
+GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
+GEMINI_URL = os.environ.get('GEMINI_URL')
+GEMINI_TIMEOUT = float(os.environ.get('GEMINI_TIMEOUT', '6.0'))
+GEMINI_MODEL = os.environ.get('GEMINI_MODEL', 'gemini-2.5-flash')
+AI_ANALYSIS_WORKERS = max(1, int(os.environ.get('AI_ANALYSIS_WORKERS', '2')))
+AI_ANALYSIS_CACHE_TTL = float(os.environ.get('AI_ANALYSIS_CACHE_TTL', '3600'))
+AI_ANALYSIS_ERROR_TTL = float(os.environ.get('AI_ANALYSIS_ERROR_TTL', '60'))
+AI_ANALYSIS_CACHE_SIZE = max(1, int(os.environ.get('AI_ANALYSIS_CACHE_SIZE', '256')))
+# Longest a report request may wait for a pending analysis (?wait=<seconds>)
+REPORT_AI_MAX_WAIT = max(0.0, float(os.environ.get('REPORT_AI_MAX_WAIT', '10')))
+# Retry-After (seconds) sent while the analysis is pending
+REPORT_AI_RETRY_AFTER = 2
+
+ai_analyzer = GeminiAnalyzer(genai, GEMINI_API_KEY, GEMINI_URL, GEMINI_MODEL, GEMINI_TIMEOUT, pool_size=AI_ANALYSIS_WORKERS)
+ai_jobs = None
+if ai_analyzer.enabled:
+    ai_jobs = AnalysisJobs(
+        ai_analyzer,
+        workers=AI_ANALYSIS_WORKERS,
+        ttl=AI_ANALYSIS_CACHE_TTL,
+        error_ttl=AI_ANALYSIS_ERROR_TTL,
+        max_entries=AI_ANALYSIS_CACHE_SIZE,
+        key_prefix=GEMINI_MODEL,
+        # Used from the event loop under ASGI (asgi.py)
+        agenerate=ai_analyzer.agenerate,
+    )
+    atexit.register(ai_jobs.close)
+
+
+# Most points returned in a report's 'raw' series
+REPORT_RAW_MAX_POINTS = max(1, int(os.environ.get('REPORT_RAW_MAX_POINTS', '500')))
+
+
+def _report_series(samples):
+    """Report 'raw' lists from metric samples ({'timestamp', 'metrics': {...}} or flat documents)."""
+    raw = {'timestamps': []}
+    raw.update({key: [] for key in metrics_store.REPORT_FIELDS})
+    for m in samples:
+        raw['timestamps'].append(str(m.get('timestamp')))
+        metrics = m.get('metrics') if isinstance(m.get('metrics'), dict) else m
+        for key, field in metrics_store.REPORT_FIELDS.items():
+            v = metrics.get(field)
+            if v is None or isinstance(v, bool):
+                continue
+            try:
+                raw[key].append(float(v))
+            except (TypeError, ValueError):
+                pass
+    return raw
+
+
+def _bucket_samples_cursor(bc, session_id, count):
+    """Cursor over a bucketed session's buckets, strided inside MongoDB (pymongo or motor collection)."""
+    stride = max(1, math.ceil(count / REPORT_RAW_MAX_POINTS))
+    if stride > 1:
+        return bc.aggregate(metrics_store.strided_samples_pipeline(session_id, stride))
+    return bc.find({'sessionId': session_id}).sort('bucket', 1)
+
+
+def _downsample_bucket_docs(docs):
+    # Each bucket starts a new stride, so trim the few extra points
+    return metrics_store.downsample(list(metrics_store.iter_bucket_samples(docs)), REPORT_RAW_MAX_POINTS)
+
+
+def _downsampled_bucket_samples(session_id, count):
+    """At most REPORT_RAW_MAX_POINTS samples of a bucketed session, strided inside MongoDB."""
+    bc = _collection(metrics_store.BUCKETS_COLLECTION)
+    if bc is None:
+        return []
+    return _downsample_bucket_docs(_bucket_samples_cursor(bc, session_id, count))
+
+
+def _report_prompt(report):
+    """Prompt asking the LLM to assess a report's summary and first few raw values."""
+    prompt_lines = [
+        "You are a clinical reasoning assistant. Analyze the following session metrics and provide:",
+        "1) A short plain-language assessment mentioning if there are possible neurological symptoms (tentative, non-diagnostic).",
+        "2) If no neurological concerns, provide a brief generic well-being summary and suggestions.",
+        "3) A short list of recommended next steps or follow-ups (non-medical, non-diagnostic guidance).",
+        "\nSession metrics:\n"
+    ]
+    summary = report.get('summary', {})
+    prompt_lines.append(f"metrics_count: {report.get('metrics_count')}")
+    for k, v in summary.items():
+        prompt_lines.append(f"{k}: {v}")
+    prompt_lines.append("\nRecent values (first/last up to 10):")
+    raw = report.get('raw', {})
+    for key in ['attention', 'drowsiness', 'blink_rate', 'face_area', 'ear']:
+        vals = raw.get(key, [])
+        if vals:
+            sample = vals[:5]
+            prompt_lines.append(f"{key}: {sample} (total {len(vals)})")
+    return "\n".join(prompt_lines)
+
+
+def _build_report(session_id, metrics_count, stats, raw):
+    """Report body from the metric statistics, with heuristic flags and recommendations."""
+    report = {
+        'session_id': session_id,
+        'metrics_count': metrics_count,
+        'summary': {f'avg_{key}': stats[key]['mean'] for key in metrics_store.REPORT_FIELDS},
+        'stats': stats,
+        'flags': [],
+        'recommendations': [],
+        'raw': raw,
+    }
+
+    # Heuristics
+    try:
+        if report['summary']['avg_drowsiness'] is not None and report['summary']['avg_drowsiness'] >= 60.0:
+            report['flags'].append({'code': 'high_drowsiness', 'message': 'Elevated drowsiness detected'})
+        if report['summary']['avg_attention'] is not None and report['summary']['avg_attention'] < 40.0:
+            report['flags'].append({'code': 'low_attention', 'message': 'Low attention/engagement detected'})
+        if report['summary']['avg_blink_rate'] is not None and (report['summary']['avg_blink_rate'] > 40.0 or report['summary']['avg_blink_rate'] < 2.0):
+            report['flags'].append({'code': 'abnormal_blink_rate', 'message': 'Abnormal blink rate observed'})
+        if report['summary']['avg_face_area'] is not None and report['summary']['avg_face_area'] < 5.0:
+            report['flags'].append({'code': 'small_face_area', 'message': 'Face small in frame (poor visibility) — results may be unreliable'})
+        if report['summary']['avg_ear'] is not None and report['summary']['avg_ear'] < 0.12:
+            report['flags'].append({'code': 'very_low_ear', 'message': 'Eyes frequently closed or nearly closed'})
+    except Exception:
+        pass
+
+    if any(f['code'] == 'high_drowsiness' for f in report['flags']):
+        report['recommendations'].append('Suggest a break and a short rest; avoid driving or operating machinery.')
+    if any(f['code'] == 'low_attention' for f in report['flags']):
+        report['recommendations'].append('Encourage focused tasks, reduce distractions, or repeat the test under quieter conditions.')
+    if any(f['code'] == 'abnormal_blink_rate' for f in report['flags']):
+        report['recommendations'].append('Consider evaluating for dry eyes, fatigue, or medication side-effects.')
+    if not report['flags']:
+        report['recommendations'].append('No immediate concerns detected by heuristic analysis.')
+    return report
+
+
+def _report_wait(value):
+    """Seconds a report may wait for a pending analysis, from `?wait=`."""
+    try:
+        return min(REPORT_AI_MAX_WAIT, max(0.0, float(value or 0)))
+    except ValueError:
+        return 0.0
+
+
+def _attach_ai_analysis(report, ai_status, ai_text, ai_error):
+    """Add the analysis job's state to `report`; returns Retry-After seconds while it is pending."""
+    report['ai_analysis_status'] = ai_status
+    if ai_status == 'ready':
+        report['ai_analysis'] = ai_text
+    elif ai_status == 'error':
+        report['ai_analysis_error'] = ai_error
+    else:
+        return REPORT_AI_RETRY_AFTER
+    return None
+
+
 @app.route('/api/sessions/<session_id>/report', methods=['GET'])
 def session_report(session_id):
     """Generate a simple heuristic report for a session by aggregating stored metrics.
@@ -479,224 +1412,60 @@ def session_report(session_id):
         session_doc = None
         try:
             if sc is not None:
-                session_doc = sc.find_one({'$or': [{'_id': session_id}, {'sessionId': session_id}]})
+                session_doc = sc.find_one({'$or': [{'_id': session_id}, {'sessionId': session_id}]}, _SESSION_PROJECTION)
         except Exception:
             session_doc = None
 
-        metrics_cursor = []
+        metrics_count = 0
+        stats = metrics_store.rollup_report_stats(None)
+        raw = _report_series([])
+        summary_doc = (session_doc or {}).get('metrics_summary') or {}
         try:
-            if mc is not None:
-                metrics_cursor = list(mc.find({'$or': [{'sessionId': session_id}, {'session_id': session_id}, {'_id': session_id}]}).sort('timestamp', 1))
+            if summary_doc.get('count'):
+                # Aggregates maintained at ingest: O(1) in the session length;
+                # only a downsampled series is fetched for 'raw'
+                metrics_count = summary_doc['count']
+                stats = metrics_store.rollup_report_stats(summary_doc)
+                raw = _report_series(_downsampled_bucket_samples(session_id, metrics_count))
+            else:
+                # Sessions recorded before rollups keep one document per sample:
+                # aggregate them inside MongoDB. Without MongoDB, samples are in memory.
+                data = None
+                if mc is not None:
+                    data = MongoReportBackend(mc).report_data(session_id, REPORT_RAW_MAX_POINTS)
+                elif memory_reports is not None:
+                    data = memory_reports.report_data(session_id, REPORT_RAW_MAX_POINTS)
+                if data is not None:
+                    metrics_count = data['count']
+                    stats = data['stats']
+                    raw = _report_series(data['series'])
         except Exception as e:
             app.logger.error(f'Error fetching metrics for report: {e}', exc_info=True)
-            metrics_cursor = []
 
-        if not metrics_cursor and session_doc is None:
+        if not metrics_count and session_doc is None:
             return jsonify({'error': 'No metrics or session found', 'session_id': session_id}), 404
 
-        # Helpers
-        def safe_get(doc, path, default=None):
-            try:
-                cur = doc
-                for p in path.split('.'):
-                    if isinstance(cur, dict):
-                        cur = cur.get(p, default)
-                    else:
-                        return default
-                return cur
-            except Exception:
-                return default
-
-        def avg(xs):
-            return sum(xs) / len(xs) if xs else None
-
-        attention = []
-        drowsiness = []
-        blink_rate = []
-        face_area = []
-        ear = []
-        timestamps = []
-
-        for m in metrics_cursor:
-            timestamps.append(str(m.get('timestamp')))
-            a = safe_get(m, 'metrics.attentionPercent') or safe_get(m, 'attentionPercent')
-            d = safe_get(m, 'metrics.drowsinessPercent') or safe_get(m, 'drowsinessPercent')
-            br = safe_get(m, 'metrics.blinkRate') or safe_get(m, 'blinkRate')
-            fa = safe_get(m, 'metrics.faceAreaPercent') or safe_get(m, 'faceAreaPercent')
-            e = safe_get(m, 'metrics.ear') or safe_get(m, 'ear')
-            try:
-                if a is not None:
-                    attention.append(float(a))
-            except Exception:
-                pass
-            try:
-                if d is not None:
-                    drowsiness.append(float(d))
-            except Exception:
-                pass
-            try:
-                if br is not None:
-                    blink_rate.append(float(br))
-            except Exception:
-                pass
-            try:
-                if fa is not None:
-                    face_area.append(float(fa))
-            except Exception:
-                pass
-            try:
-                if e is not None:
-                    ear.append(float(e))
-            except Exception:
-                pass
-
-        report = {
-            'session_id': session_id,
-            'metrics_count': len(metrics_cursor),
-            'summary': {
-                'avg_attention': avg(attention),
-                'avg_drowsiness': avg(drowsiness),
-                'avg_blink_rate': avg(blink_rate),
-                'avg_face_area': avg(face_area),
-                'avg_ear': avg(ear),
-            },
-            'flags': [],
-            'recommendations': [],
-            'raw': {
-                'timestamps': timestamps,
-                'attention': attention,
-                'drowsiness': drowsiness,
-                'blink_rate': blink_rate,
-                'face_area': face_area,
-                'ear': ear,
-            }
-        }
-
-        # Heuristics
-        try:
-            if report['summary']['avg_drowsiness'] is not None and report['summary']['avg_drowsiness'] >= 60.0:
-                report['flags'].append({'code': 'high_drowsiness', 'message': 'Elevated drowsiness detected'})
-            if report['summary']['avg_attention'] is not None and report['summary']['avg_attention'] < 40.0:
-                report['flags'].append({'code': 'low_attention', 'message': 'Low attention/engagement detected'})
-            if report['summary']['avg_blink_rate'] is not None and (report['summary']['avg_blink_rate'] > 40.0 or report['summary']['avg_blink_rate'] < 2.0):
-                report['flags'].append({'code': 'abnormal_blink_rate', 'message': 'Abnormal blink rate observed'})
-            if report['summary']['avg_face_area'] is not None and report['summary']['avg_face_area'] < 5.0:
-                report['flags'].append({'code': 'small_face_area', 'message': 'Face small in frame (poor visibility) — results may be unreliable'})
-            if report['summary']['avg_ear'] is not None and report['summary']['avg_ear'] < 0.12:
-                report['flags'].append({'code': 'very_low_ear', 'message': 'Eyes frequently closed or nearly closed'})
-        except Exception:
-            pass
-
-        if any(f['code'] == 'high_drowsiness' for f in report['flags']):
-            report['recommendations'].append('Suggest a break and a short rest; avoid driving or operating machinery.')
-        if any(f['code'] == 'low_attention' for f in report['flags']):
-            report['recommendations'].append('Encourage focused tasks, reduce distractions, or repeat the test under quieter conditions.')
-        if any(f['code'] == 'abnormal_blink_rate' for f in report['flags']):
-            report['recommendations'].append('Consider evaluating for dry eyes, fatigue, or medication side-effects.')
-        if not report['flags']:
-            report['recommendations'].append('No immediate concerns detected by heuristic analysis.')
-
-        # If Gemini/LLM is configured, send the metrics as a prompt for an assistant analysis.
-        gemini_key = os.environ.get('GEMINI_API_KEY')
-        gemini_url = os.environ.get('GEMINI_URL')
-        gemini_timeout = float(os.environ.get('GEMINI_TIMEOUT', '6.0'))
-        gemini_model = os.environ.get('GEMINI_MODEL', 'gemini-2.5-flash')
-
-        # Build a concise prompt
-        prompt_lines = [
-            "You are a clinical reasoning assistant. Analyze the following session metrics and provide:",
-            "1) A short plain-language assessment mentioning if there are possible neurological symptoms (tentative, non-diagnostic).",
-            "2) If no neurological concerns, provide a brief generic well-being summary and suggestions.",
-            "3) A short list of recommended next steps or follow-ups (non-medical, non-diagnostic guidance).",
-            "\nSession metrics:\n"
-        ]
-        summary = report.get('summary', {})
-        prompt_lines.append(f"metrics_count: {report.get('metrics_count')}")
-        for k, v in summary.items():
-            prompt_lines.append(f"{k}: {v}")
-        prompt_lines.append("\nRecent values (first/last up to 10):")
-        raw = report.get('raw', {})
-        for key in ['attention', 'drowsiness', 'blink_rate', 'face_area', 'ear']:
-            vals = raw.get(key, [])
-            if vals:
-                sample = vals[:5]
-                prompt_lines.append(f"{key}: {sample} (total {len(vals)})")
-
-        prompt_text = "\n".join(prompt_lines)
-
-        # Prefer the official google.genai client when available and GEMINI_API_KEY present
-        if genai is not None and gemini_key:
-            try:
-                try:
-                    client = genai.Client()
-                    # Use the models.generate_content API if present (user-provided sample)
-                    # Some versions expose client.models.generate_content, others may differ.
-                    gen_resp = None
-                    try:
-                        gen_resp = client.models.generate_content(model=gemini_model, contents=prompt_text)
-                    except Exception:
-                        # Fallback to a more generic call shape
-                        gen_resp = client.generate(model=gemini_model, input=prompt_text)
-
-                    # Extract text
-                    ai_text = None
-                    if gen_resp is not None:
-                        if hasattr(gen_resp, 'text'):
-                            ai_text = gen_resp.text
-                        else:
-                            try:
-                                jr = gen_resp if isinstance(gen_resp, dict) else gen_resp.__dict__
-                                ai_text = jr.get('output') or jr.get('text') or jr.get('result') or str(jr)
-                            except Exception:
-                                ai_text = str(gen_resp)
-
-                    report['ai_analysis'] = ai_text
-                except Exception as e:
-                    app.logger.error(f'Error calling google.genai client: {e}', exc_info=True)
-                    report['ai_analysis_error'] = {'error': str(e)}
-            except Exception as e:
-                app.logger.error(f'Unexpected error using genai: {e}', exc_info=True)
-                report['ai_analysis_error'] = {'error': str(e)}
-
-        # If genai client not available but GEMINI_URL is provided, fall back to HTTP
-        elif gemini_key and gemini_url:
-            try:
-                headers = {
-                    'Authorization': f'Bearer {gemini_key}',
-                    'Content-Type': 'application/json'
-                }
-                payload = {'input': prompt_text, 'max_output_tokens': 512}
-                resp = requests.post(gemini_url, headers=headers, json=payload, timeout=gemini_timeout)
-                if resp.status_code == 200:
-                    try:
-                        jr = resp.json()
-                        ai_text = None
-                        if isinstance(jr, dict):
-                            ai_text = jr.get('output') or jr.get('text') or jr.get('result') or jr.get('choices')
-                            if isinstance(ai_text, list) and ai_text:
-                                ai_text = ' '.join([str(x) for x in ai_text])
-                            elif isinstance(ai_text, dict):
-                                ai_text = ai_text.get('text') or str(ai_text)
-                        if ai_text is None:
-                            ai_text = resp.text
-                        report['ai_analysis'] = ai_text
-                    except Exception:
-                        report['ai_analysis'] = resp.text
-                else:
-                    app.logger.warning(f'Gemini request failed: {resp.status_code} {resp.text}')
-                    report['ai_analysis_error'] = {'status': resp.status_code, 'text': resp.text}
-            except Exception as e:
-                app.logger.error(f'Error calling Gemini via HTTP: {e}', exc_info=True)
-                report['ai_analysis_error'] = {'error': str(e)}
-        else:
-            # No gemini config detected, skip AI analysis
-            pass
-
-        return jsonify(report), 200
+        report = _build_report(session_id, metrics_count, stats, raw)
+
+        # The LLM analysis runs as a background job cached by prompt: the
+        # heuristics are returned now and 'ai_analysis' is attached once ready
+        retry_after = None
+        if ai_jobs is not None:
+            _, ai_status, ai_text, ai_error = ai_jobs.get(_report_prompt(report), wait=_report_wait(request.args.get('wait')))
+            retry_after = _attach_ai_analysis(report, ai_status, ai_text, ai_error)
+
+        response = jsonify(report)
+        # Clients poll with If-None-Match and get 304 until something changed
+        response.add_etag()
+        response.headers['Cache-Control'] = 'no-cache'
+        if retry_after is not None:
+            response.headers['Retry-After'] = str(retry_after)
+        return response.make_conditional(request)
     except Exception as e:
         app.logger.error(f'Error generating session report: {e}', exc_info=True)
         return jsonify({'error': 'Failed to generate report', 'details': str(e)}), 500
 
+
 @app.route('/api/sessions/<session_id>', methods=['GET', 'OPTIONS'])
 def get_session(session_id):
     if request.method == 'OPTIONS':
@@ -707,12 +1476,13 @@ def get_session(session_id):
         return response
     
     try:
-        if session_id not in sessions:
+        session = sessions.get(session_id)
+        if session is None:
             response = jsonify({'error': 'Session not found'})
             response.headers.add('Access-Control-Allow-Origin', '*')
             return response, 404
         
-        session = sessions[session_id].copy()
+        session = session.copy()
         # Convert datetime objects to ISO format for JSON serialization
         for time_field in ['start_time', 'end_time', 'last_activity']:
             if session.get(time_field):
@@ -740,13 +1510,127 @@ def get_session(session_id):
         response.headers.add('Access-Control-Allow-Origin', '*')
         return response, 500
 
+# Rows per piece of a streamed raw export
+LANDMARK_EXPORT_CHUNK_ROWS = 512
+_LANDMARK_EXPORT_FORMATS = ('json', 'npz', 'raw')
+
+
+def _time_arg(name):
+    """Query argument as seconds since the epoch; accepts a number or an ISO-8601 time (UTC if no offset)."""
+    value = (request.args.get(name) or '').strip()
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        when = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"'{name}' must be seconds since the epoch or an ISO-8601 time")
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return when.timestamp()
+
+
+@app.route('/api/sessions/<session_id>/landmarks', methods=['GET', 'OPTIONS'])
+def session_landmarks(session_id):
+    """Archived landmarks of a session: `?from=&to=` (epoch seconds or ISO-8601), `&stride=`, `&format=json|npz|raw`.
+
+    The archive is memory-mapped; only the selected records are read.
+    """
+    if request.method == 'OPTIONS':
+        # Handle preflight request
+        response = jsonify({'status': 'preflight'})
+        response.headers.add('Access-Control-Allow-Origin', '*')
+        response.headers.add('Access-Control-Allow-Methods', 'GET, OPTIONS')
+        return response
+
+    try:
+        if landmark_archive is None:
+            response = jsonify({'error': 'Landmark archive is disabled'})
+            response.headers.add('Access-Control-Allow-Origin', '*')
+            return response, 404
+
+        try:
+            start, end = _time_arg('from'), _time_arg('to')
+            stride = int(request.args.get('stride') or 1)
+            if stride < 1:
+                raise ValueError("'stride' must be at least 1")
+            fmt = (request.args.get('format') or '').strip().lower()
+            if not fmt:
+                fmt = 'raw' if 'application/octet-stream' in request.headers.get('Accept', '') else 'json'
+            if fmt not in _LANDMARK_EXPORT_FORMATS:
+                raise ValueError(f"'format' must be one of {', '.join(_LANDMARK_EXPORT_FORMATS)}")
+        except ValueError as e:
+            response = jsonify({'error': str(e)})
+            response.headers.add('Access-Control-Allow-Origin', '*')
+            return response, 400
+
+        view = landmark_archive.open_session(session_id)
+        if view is None:
+            response = jsonify({'error': 'No landmarks archived for this session'})
+            response.headers.add('Access-Control-Allow-Origin', '*')
+            return response, 404
+
+        selected = view.select(start, end, stride)
+        frames = len(selected)
+        headers = {
+            'X-Frames': str(frames),
+            'X-Landmark-Count': str(view.n_landmarks),
+            'X-Landmark-Encoding': 'f16',
+        }
+        if fmt == 'raw':
+            # The records as stored, streamed in pieces straight from the map
+            def body():
+                try:
+                    for i in range(0, frames, LANDMARK_EXPORT_CHUNK_ROWS):
+                        yield selected[i:i + LANDMARK_EXPORT_CHUNK_ROWS].tobytes()
+                finally:
+                    view.close()
+            headers.update({
+                'Content-Length': str(frames * selected.dtype.itemsize),
+                'X-Record-Bytes': str(selected.dtype.itemsize),
+                'X-Record-Layout': f't:<f8,landmarks:<f2[{view.n_landmarks},3]',
+            })
+            response = Response(body(), mimetype='application/octet-stream', headers=headers)
+        elif fmt == 'npz':
+            with view:
+                buf = io.BytesIO()
+                np.savez(buf, timestamps=selected['t'], landmarks=selected['landmarks'])
+                del selected
+            headers['Content-Disposition'] = f'attachment; filename="{session_id}-landmarks.npz"'
+            response = Response(buf.getvalue(), mimetype='application/octet-stream', headers=headers)
+        else:
+            with view:
+                response = jsonify({
+                    'session_id': session_id,
+                    'frames': frames,
+                    'timestamps': selected['t'].tolist(),
+                    'landmarks': base64.b64encode(np.ascontiguousarray(selected['landmarks']).tobytes()).decode('ascii'),
+                    'landmarks_encoding': 'f16',
+                    'landmarks_shape': [frames, view.n_landmarks, 3],
+                })
+                del selected
+            response.headers.extend(headers)
+        response.headers.add('Access-Control-Allow-Origin', '*')
+        return response
+
+    except Exception as e:
+        app.logger.error(f'Error in session_landmarks: {str(e)}', exc_info=True)
+        response = jsonify({
+            'error': 'Internal server error',
+            'details': str(e)
+        })
+        response.headers.add('Access-Control-Allow-Origin', '*')
+        return response, 500
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health endpoint: reports basic app + MongoDB connectivity.
 
     Returns 200 when MongoDB is reachable (if configured), otherwise 503.
     """
-    status = {'ok': True}
     db_ok = False
     try:
         if mongo_client:
@@ -755,11 +1639,145 @@ def health():
             db_ok = True
     except Exception:
         db_ok = False
+    status, code = _health_status(db_ok)
+    return jsonify(status), code
 
+
+def _health_status(db_ok):
+    """(/health body, status code) given the result of the MongoDB ping."""
+    status = {'ok': True}
     status['mongo'] = db_ok
+    if inference_engine is not None:
+        status['inference'] = inference_engine.stats()
+    elif face_mesh_pool is not None:
+        status['inference'] = dict(face_mesh_pool.stats(), mode='thread')
+    if batch_scheduler is not None:
+        status['batching'] = batch_scheduler.stats()
+    if session_graphs is not None:
+        status['tracking'] = session_graphs.stats()
+    if write_queue is not None:
+        status['persistence'] = write_queue.stats()
+    status['sessions'] = sessions.stats()
+    if memory_reports is not None:
+        status['metrics_memory'] = memory_reports.stats()
+    if admission is not None:
+        status['admission'] = admission.stats()
+    if frame_cache is not None:
+        status['frame_cache'] = frame_cache.stats()
+    if ai_jobs is not None:
+        status['ai_analysis'] = ai_jobs.stats()
+    if landmark_archive is not None:
+        status['landmark_archive'] = landmark_archive.stats()
+    status['ready'] = lifecycle.ready
+    status['startup'] = lifecycle.status()
     status['mongo_db'] = os.environ.get('MONGO_DB', 'neurovision')
     status['require_mongo'] = REQUIRE_MONGO
-    return (jsonify(status), 200) if db_ok or not REQUIRE_MONGO else (jsonify(status), 503)
+    return status, 200 if db_ok or not REQUIRE_MONGO else 503
+
+
+@app.route('/health/live', methods=['GET'])
+def health_live():
+    """Liveness: the process is up and answering. Never checks dependencies."""
+    return jsonify({'ok': True}), 200
+
+
+@app.route('/health/ready', methods=['GET'])
+def health_ready():
+    """Readiness: startup (graph build and warmup) has finished, and MongoDB
+    answers a ping when REQUIRE_MONGO is set. 503 until then.
+    """
+    mongo_ok = None
+    if REQUIRE_MONGO:
+        try:
+            mongo_client.admin.command('ping')
+            mongo_ok = True
+        except Exception:
+            mongo_ok = False
+    status, code = _ready_status(mongo_ok)
+    return jsonify(status), code
+
+
+def _ready_status(mongo_ok=None):
+    """(/health/ready body, status code); `mongo_ok` is the ping result when REQUIRE_MONGO is set."""
+    ready = lifecycle.wait(0)
+    status = {'ready': ready, 'startup': lifecycle.status()}
+    if mongo_ok is not None:
+        status['mongo'] = mongo_ok
+        ready = ready and mongo_ok
+    return status, (200 if ready else 503)
+
+
+# Gauges are refreshed at most this often per worker (and on every scrape)
+METRICS_GAUGE_INTERVAL = 1.0
+_gauges_updated = 0.0
+
+
+def _update_gauges():
+    global _gauges_updated
+    _gauges_updated = time.monotonic()
+    telemetry.set_gauge('session_store_sessions', len(sessions), 'Session records held in worker memory')
+    if write_queue is not None:
+        telemetry.set_gauge('persist_queue_depth', write_queue.stats()['depth'], 'Writes waiting in the write-behind queue')
+    if admission is not None:
+        st = admission.stats()
+        telemetry.set_gauge('admission_in_flight', st['in_flight'], 'Frames admitted to inference')
+        telemetry.set_gauge('admission_waiting', st['waiting'], 'Frames waiting for admission')
+        telemetry.set_gauge('admission_limit', st['limit'], 'Current admission limit (sum over workers)')
+    if batch_scheduler is not None:
+        telemetry.set_gauge('batch_queue_depth', batch_scheduler.stats()['queued'], 'Frames waiting for a micro-batch')
+    if inference_engine is not None:
+        pending = sum(w['queue_depth'] for w in inference_engine.stats()['workers'])
+        telemetry.set_gauge('inference_queue_depth', pending, 'Frames queued on inference worker processes')
+    elif face_mesh_pool is not None:
+        telemetry.set_gauge('inference_queue_depth', face_mesh_pool.stats()['in_use'], 'FaceMesh graphs checked out')
+    if frame_cache is not None:
+        st = frame_cache.stats()
+        telemetry.set_total('frame_cache_lookups', st['lookups'], 'Frames looked up in the frame cache')
+        telemetry.set_total('frame_cache_hits', st['exact_hits'] + st['near_hits'], 'Frames answered from the frame cache')
+        telemetry.set_total('frame_cache_saved_seconds', st['saved_seconds'], 'Inference time saved by frame cache hits')
+
+
+def _start_request_timing():
+    g.request_started = time.perf_counter()
+    telemetry.begin_request()
+
+
+def _finish_request_timing(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    server_timing = telemetry.end_request(
+        request.endpoint or 'unmatched', request.method, response.status_code, time.perf_counter() - started)
+    if server_timing:
+        response.headers['Server-Timing'] = server_timing
+    if time.monotonic() - _gauges_updated >= METRICS_GAUGE_INTERVAL:
+        try:
+            _update_gauges()
+        except Exception as e:
+            app.logger.warning(f'Failed to update metrics gauges: {e}')
+    return response
+
+
+# Registered only when enabled, so a disabled build pays nothing per request
+if telemetry.enabled:
+    app.before_request(_start_request_timing)
+    app.after_request(_finish_request_timing)
+
+
+@app.route('/internal/metrics', methods=['GET'])
+def internal_metrics():
+    """Prometheus text exposition of latency histograms, request counters and gauges."""
+    if not telemetry.enabled:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    if INTERNAL_METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {INTERNAL_METRICS_TOKEN}':
+        return jsonify({'error': 'Unauthorized'}), 401
+    try:
+        _update_gauges()
+        body, content_type = telemetry.render()
+        return Response(body, content_type=content_type)
+    except Exception as e:
+        app.logger.error(f'Error in internal_metrics: {str(e)}', exc_info=True)
+        return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
 
 @app.route('/', methods=['GET'])
@@ -774,9 +1792,7 @@ def index():
     )
 
 
-# Ensure CORS headers are always present even if flask-cors isn't installed
-@app.after_request
-def _add_cors_headers(response):
+def _cors_headers():
     # Mirror configured origins when possible
     try:
         if CORS_ORIGINS == '*':
@@ -785,12 +1801,30 @@ def _add_cors_headers(response):
             origin_header = ','.join(CORS_ORIGINS)
     except Exception:
         origin_header = '*'
-    response.headers['Access-Control-Allow-Origin'] = origin_header
-    response.headers['Access-Control-Allow-Headers'] = 'Content-Type,Authorization'
-    response.headers['Access-Control-Allow-Methods'] = 'GET,POST,OPTIONS'
+    return {
+        'Access-Control-Allow-Origin': origin_header,
+        'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-Frame-Format,X-Frame-Width,X-Frame-Height,If-None-Match',
+        'Access-Control-Allow-Methods': 'GET,POST,OPTIONS',
+        # Binary detect responses carry their metadata in headers
+        'Access-Control-Expose-Headers': 'X-Faces,X-Face-Area-Percent,X-Track-Id,X-Face-Boxes,X-Landmark-Encoding,X-Landmark-Count,X-Landmark-Scale,X-Landmark-Indices,X-Metrics,X-Frames,X-Record-Bytes,X-Record-Layout,ETag,Retry-After,Server-Timing',
+    }
+
+
+# Ensure CORS headers are always present even if flask-cors isn't installed
+@app.after_request
+def _add_cors_headers(response):
+    for name, value in _cors_headers().items():
+        response.headers[name] = value
     return response
 
 
+# Build and warm up the graphs in the background, unless a server hook does it
+# after forking (gunicorn.conf.py). Spawned inference workers re-import this
+# module when it is the main script; they have nothing to start.
+if multiprocessing.parent_process() is None:
+    lifecycle.autostart()
+
+
 if __name__ == '__main__':
     # Allow overriding host/port via env for flexibility
     host = os.environ.get('APP_HOST', '0.0.0.0')
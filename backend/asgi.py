@@ -0,0 +1,358 @@
+"""
+ASGI entry point: async handlers for the I/O-bound endpoints, the Flask app for the rest.
+
+    pip install -r backend/requirements-asgi.txt
+    gunicorn -c backend/gunicorn.conf.py -k uvicorn.workers.UvicornWorker -w 2 backend.asgi:app
+    uvicorn asgi:app --app-dir backend --port 5000
+
+Served on the event loop, holding no thread while they wait:
+
+  GET  /api/sessions/<id>/report    MongoDB reads (motor) and the AI analysis
+                                    (AnalysisJobs.aget: google.genai's async API,
+                                    or httpx for GEMINI_URL)
+  POST /api/sessions/<id>/metrics   MongoDB upserts (motor), or the write-behind queue
+  GET  /health, /health/ready       MongoDB ping (motor)
+
+Every other route is the Flask app (app.py) behind a2wsgi, on a pool of
+ASGI_WSGI_THREADS threads. Request bodies are read on the event loop first,
+so a slow upload holds no thread; /detect then decodes and runs inference on
+that pool, or hands the frame to the inference worker processes
+(INFERENCE_ENGINE=process). The WebSocket stream runs app.stream_session on
+one of ASGI_STREAM_THREADS threads, through a blocking adapter over the
+ASGI connection.
+
+Responses keep the Flask routes' bodies, status codes and headers (including
+the report's ETag). Without motor, a configured MongoDB is used through the
+Flask routes for these endpoints too.
+"""
+import asyncio
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+from starlette.routing import Mount, Route, WebSocketRoute
+from werkzeug.http import generate_etag, parse_etags, quote_etag
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app as appmod  # noqa: E402
+import metrics_store  # noqa: E402
+from report_engine import MongoReportBackend  # noqa: E402
+from shared_sessions import RedisSessionTable  # noqa: E402
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except Exception:
+    AsyncIOMotorClient = None
+
+logger = logging.getLogger(__name__)
+
+# Threads running Flask routes (detect, sessions, landmark export, ...)
+ASGI_WSGI_THREADS = max(1, int(os.environ.get('ASGI_WSGI_THREADS', '32')))
+# Threads running WebSocket streams (one per open stream)
+ASGI_STREAM_THREADS = max(1, int(os.environ.get('ASGI_STREAM_THREADS', '64')))
+# Largest request body buffered for a Flask route (base64 JSON frames are a third larger)
+ASGI_MAX_BODY_BYTES = int(os.environ.get('ASGI_MAX_BODY_BYTES') or 2 * appmod.INFERENCE_MAX_FRAME_BYTES)
+
+# The async routes need an async driver when MongoDB is configured
+ASYNC_ROUTES = appmod.mongo_db is None or AsyncIOMotorClient is not None
+if not ASYNC_ROUTES:
+    logger.warning('motor is not installed; report, metrics and health are served by the Flask routes')
+
+# Opened on startup, in each worker process's event loop
+mongo = None
+
+_stream_executor = ThreadPoolExecutor(max_workers=ASGI_STREAM_THREADS, thread_name_prefix='stream')
+
+
+def _db():
+    return mongo[appmod.mongo_db.name] if mongo is not None else None
+
+
+def _json(body, status=200, headers=None):
+    # Same bytes as Flask's jsonify, so ETags match the WSGI routes
+    data = appmod.app.json.dumps(body, separators=(',', ':')) + '\n'
+    return Response(data, status_code=status, media_type='application/json',
+                    headers=dict(appmod._cors_headers(), **(headers or {})))
+
+
+async def _session_known(session_id):
+    if isinstance(appmod.shared_sessions, RedisSessionTable):
+        # A network read-through; keep it off the loop
+        return await run_in_threadpool(appmod.sessions.get, session_id) is not None
+    return appmod.sessions.get(session_id) is not None
+
+
+async def _report_data(session_id):
+    """(session document, metrics count, stats, raw) as app.session_report reads them, with motor."""
+    db = _db()
+    session_doc = None
+    try:
+        if db is not None:
+            session_doc = await db.get_collection('sessions').find_one(
+                {'$or': [{'_id': session_id}, {'sessionId': session_id}]}, appmod._SESSION_PROJECTION)
+    except Exception:
+        session_doc = None
+
+    metrics_count = 0
+    stats = metrics_store.rollup_report_stats(None)
+    raw = appmod._report_series([])
+    summary_doc = (session_doc or {}).get('metrics_summary') or {}
+    try:
+        if summary_doc.get('count'):
+            metrics_count = summary_doc['count']
+            stats = metrics_store.rollup_report_stats(summary_doc)
+            cursor = appmod._bucket_samples_cursor(db.get_collection(metrics_store.BUCKETS_COLLECTION), session_id, metrics_count)
+            raw = appmod._report_series(appmod._downsample_bucket_docs(await cursor.to_list(None)))
+        else:
+            data = None
+            if db is not None:
+                data = await MongoReportBackend(db.get_collection('metrics')).areport_data(session_id, appmod.REPORT_RAW_MAX_POINTS)
+            elif appmod.memory_reports is not None:
+                data = appmod.memory_reports.report_data(session_id, appmod.REPORT_RAW_MAX_POINTS)
+            if data is not None:
+                metrics_count = data['count']
+                stats = data['stats']
+                raw = appmod._report_series(data['series'])
+    except Exception as e:
+        logger.error(f'Error fetching metrics for report: {e}', exc_info=True)
+    return session_doc, metrics_count, stats, raw
+
+
+async def session_report(request):
+    session_id = request.path_params['session_id']
+    try:
+        session_doc, metrics_count, stats, raw = await _report_data(session_id)
+        if not metrics_count and session_doc is None:
+            return _json({'error': 'No metrics or session found', 'session_id': session_id}, 404)
+
+        report = appmod._build_report(session_id, metrics_count, stats, raw)
+        retry_after = None
+        if appmod.ai_jobs is not None:
+            _, ai_status, ai_text, ai_error = await appmod.ai_jobs.aget(
+                appmod._report_prompt(report), wait=appmod._report_wait(request.query_params.get('wait')))
+            retry_after = appmod._attach_ai_analysis(report, ai_status, ai_text, ai_error)
+
+        response = _json(report)
+        etag = quote_etag(generate_etag(response.body))
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = 'no-cache'
+        if retry_after is not None:
+            response.headers['Retry-After'] = str(retry_after)
+        if parse_etags(request.headers.get('if-none-match')).contains_weak(etag.strip('"')):
+            return Response(status_code=304, headers={k: v for k, v in response.headers.items()
+                                                      if k.lower() not in ('content-length', 'content-type')})
+        return response
+    except Exception as e:
+        logger.error(f'Error generating session report: {e}', exc_info=True)
+        return _json({'error': 'Failed to generate report', 'details': str(e)}, 500)
+
+
+async def _persist_metrics(session_id, data):
+    """app._persist_metrics with awaited MongoDB writes."""
+    timestamp, values, writes = appmod._metrics_writes(session_id, data)
+    if appmod.memory_reports is not None:
+        appmod.memory_reports.add(session_id, timestamp, values)
+        return
+    try:
+        queue = appmod.write_queue
+        if queue is not None:
+            def enqueue():
+                for name, filter_, update in writes:
+                    queue.update(name, filter_, update, upsert=True)
+            if queue.would_block():
+                # PERSIST_OVERFLOW=block waits for room; not on the loop
+                await run_in_threadpool(enqueue)
+            else:
+                enqueue()
+            return
+        db = _db()
+        if db is not None:
+            for name, filter_, update in writes:
+                await db.get_collection(name).update_one(filter_, update, upsert=True)
+    except Exception as e:
+        logger.warning(f'Failed to persist metrics: {e}')
+
+
+async def post_session_metrics(request):
+    session_id = request.path_params['session_id']
+    if request.method == 'OPTIONS':
+        return _json({'status': 'preflight'})
+    try:
+        if not await _session_known(session_id) and appmod.sessions_collection is None:
+            return _json({'error': 'Session not found'}, 404)
+        mimetype = request.headers.get('content-type', '').split(';')[0].strip().lower()
+        if not (mimetype == 'application/json' or (mimetype.startswith('application/') and mimetype.endswith('+json'))):
+            return _json({'error': 'Request must be JSON'}, 400)
+        data = await request.json() or {}
+        await _persist_metrics(session_id, data)
+        return _json({'status': 'ok'}, 201)
+    except Exception as e:
+        logger.error(f'Error in post_session_metrics: {str(e)}', exc_info=True)
+        return _json({'error': 'Internal server error', 'details': str(e)}, 500)
+
+
+async def _ping():
+    try:
+        await mongo.admin.command('ping')
+        return True
+    except Exception:
+        return False
+
+
+async def health(request):
+    status, code = appmod._health_status(await _ping() if mongo is not None else False)
+    return _json(status, code)
+
+
+async def health_live(request):
+    return _json({'ok': True})
+
+
+async def health_ready(request):
+    mongo_ok = None
+    if appmod.REQUIRE_MONGO:
+        mongo_ok = await _ping() if mongo is not None else False
+    status, code = appmod._ready_status(mongo_ok)
+    return _json(status, code)
+
+
+def _endpoint(name, handler):
+    """`handler` answering CORS preflights and counted in the request metrics like a Flask endpoint."""
+    async def run(request):
+        if request.method == 'OPTIONS' and handler is not post_session_metrics:
+            # Flask answers OPTIONS itself on every route
+            return Response(status_code=200, headers=appmod._cors_headers())
+        started = time.perf_counter()
+        response = await handler(request)
+        appmod.telemetry.end_request(name, request.method, response.status_code, time.perf_counter() - started)
+        return response
+    return run
+
+
+class _BlockingWebSocket:
+    """flask-sock style blocking receive()/send() over an ASGI WebSocket, for a worker thread."""
+
+    def __init__(self, websocket, loop):
+        self._ws = websocket
+        self._loop = loop
+
+    def _call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def receive(self):
+        message = self._call(self._ws.receive())
+        if message['type'] == 'websocket.disconnect':
+            raise ConnectionError('WebSocket closed by the client')
+        return message['bytes'] if message.get('bytes') is not None else message.get('text')
+
+    def send(self, data):
+        self._call(self._ws.send_bytes(data) if isinstance(data, (bytes, bytearray)) else self._ws.send_text(data))
+
+
+async def stream_session(websocket):
+    await websocket.accept()
+    ws = _BlockingWebSocket(websocket, asyncio.get_running_loop())
+    session_id = websocket.path_params['session_id']
+
+    def run():
+        # app.stream_session reads the query string, headers and client address from the Flask request
+        with appmod.app.test_request_context(
+                websocket.url.path, query_string=websocket.url.query, headers=list(websocket.headers.items()),
+                environ_base={'REMOTE_ADDR': websocket.client.host if websocket.client else None}):
+            appmod.stream_session(ws, session_id)
+
+    try:
+        await asyncio.get_running_loop().run_in_executor(_stream_executor, run)
+    finally:
+        try:
+            await websocket.close()
+        except Exception:
+            pass
+
+
+class _BufferedBody:
+    """Reads the whole request body on the event loop before calling the WSGI app,
+    so a slow client never holds one of its threads."""
+
+    def __init__(self, app, max_bytes):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        chunks, size, more = [], 0, True
+        while more:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > self.max_bytes:
+                await _json({'error': 'Request body too large'}, 413)(scope, receive, send)
+                return
+            chunks.append(chunk)
+            more = message.get('more_body', False)
+        body = b''.join(chunks)
+        replayed = False
+
+        async def replay():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            return await receive()
+
+        await self.app(scope, replay, send)
+
+
+def _close_app():
+    # What app.py leaves to atexit: uvicorn re-raises SIGTERM after the lifespan
+    # ends, so under gunicorn the worker dies before atexit runs. Queued writes
+    # go first; each close() is a no-op when atexit calls it again.
+    for name in ('write_queue', 'batch_scheduler', 'ai_jobs', 'landmark_archive', 'inference_engine'):
+        resource = getattr(appmod, name, None)
+        if resource is not None:
+            try:
+                resource.close()
+            except Exception as e:
+                logger.warning(f'Closing {name} failed: {e}')
+
+
+@asynccontextmanager
+async def lifespan(_):
+    global mongo
+    # Starts the app's hooks where nothing else did (uvicorn without gunicorn.conf.py)
+    appmod.lifecycle.start()
+    if appmod.mongo_db is not None and AsyncIOMotorClient is not None:
+        mongo = AsyncIOMotorClient(appmod.MONGO_URI, serverSelectionTimeoutMS=5000)
+    try:
+        yield
+    finally:
+        if mongo is not None:
+            mongo.close()
+            mongo = None
+        await appmod.ai_analyzer.aclose()
+        await asyncio.to_thread(_close_app)
+
+
+routes = [WebSocketRoute('/api/sessions/{session_id}/stream', stream_session)]
+if ASYNC_ROUTES:
+    routes += [
+        Route('/api/sessions/{session_id}/report', _endpoint('session_report', session_report), methods=['GET', 'OPTIONS']),
+        Route('/api/sessions/{session_id}/metrics', _endpoint('post_session_metrics', post_session_metrics), methods=['POST', 'OPTIONS']),
+        Route('/health', _endpoint('health', health), methods=['GET', 'OPTIONS']),
+        Route('/health/live', _endpoint('health_live', health_live), methods=['GET', 'OPTIONS']),
+        Route('/health/ready', _endpoint('health_ready', health_ready), methods=['GET', 'OPTIONS']),
+    ]
+routes.append(Mount('/', app=_BufferedBody(WSGIMiddleware(appmod.app, workers=ASGI_WSGI_THREADS), ASGI_MAX_BODY_BYTES)))
+
+app = Starlette(routes=routes, lifespan=lifespan)
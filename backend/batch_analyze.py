@@ -0,0 +1,540 @@
+"""
+Offline analysis of recorded sessions: a video file or a directory of images.
+
+    python batch_analyze.py recording.mp4 -o recording.npz
+    python batch_analyze.py frames/ -o frames.parquet --fps 15 --workers 4
+    python batch_analyze.py recording.mp4 -o recording.npz --mongo --session-id <id>
+
+Frames are read one at a time, never all at once, and grouped into chunks
+of --chunk-frames consecutive frames. Each chunk goes to a worker process,
+which runs the app's own `_process_image_bytes` (decode, FaceMesh, ROI crop
+from the previous frame of the chunk) and writes its landmarks to a part
+file in the work directory. Frames waiting for a worker are capped at
+--max-inflight-mb (video frames travel as raw RGB, already reduced to
+DETECT_MAX_LONG_EDGE).
+
+When every chunk is done, the parts are read back in frame order. The
+server-side metrics (EAR, blinks, gaze, head pose; face_metrics.py) are
+computed over the whole recording, and everything is written to one
+columnar file:
+- `.npz`: `landmarks` (frames, 478, 3) float32, NaN without a face, plus one
+  array per column;
+- `.parquet` (needs `pyarrow`): one row per frame, landmarks as a
+  fixed-size list of 1434 floats.
+With --mongo, each frame is also inserted into `detections` as the live
+detect endpoint would store it, tagged with `batch: {id, chunk, frame}`.
+
+The work directory (default `<output>.parts`) is the checkpoint. Rerunning
+the same command skips chunks whose part file exists and MongoDB chunks
+already loaded, so an interrupted run picks up where it stopped. It is
+removed once the output is written, unless --keep-parts is given.
+"""
+import argparse
+import hashlib
+import io
+import json
+import logging
+import math
+import os
+import shutil
+import sys
+import uuid
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Before the app is imported (here or in a worker): workers are processes of
+# their own, so each needs one graph and no per-request machinery. Metrics
+# are computed afterwards, in frame order, across chunks.
+os.environ.update({
+    'INFERENCE_ENGINE': 'thread',
+    'FACEMESH_POOL_SIZE': '1',
+    'FACEMESH_TRACKING': 'false',
+    'DETECT_BATCHING': 'false',
+    'DETECT_FRAME_CACHE': 'false',
+    'DETECT_METRICS': 'false',
+    'METRICS_ENABLED': 'false',
+    'PERSIST_WRITE_BEHIND': 'false',
+    'SESSION_BACKEND': 'local',
+})
+
+from face_metrics import SessionMetrics  # noqa: E402
+from landmark_codec import N_LANDMARKS  # noqa: E402
+from preprocess import RawFrame  # noqa: E402
+
+# Optional: video decoding (opencv comes with mediapipe)
+try:
+    import cv2
+except Exception:
+    cv2 = None
+
+# Optional: Parquet output
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except Exception:
+    pa = pq = None
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+CHECKPOINT = 'checkpoint.json'
+
+# Metric columns, flattened from SessionMetrics.update() output
+METRIC_COLUMNS = ('ear', 'earRaw', 'earLeft', 'earRight', 'mar', 'gazeX', 'gazeY', 'yaw', 'pitch', 'roll',
+                  'attentionPercent', 'drowsinessPercent', 'blinkCount', 'blinkRate')
+
+
+def _image_files(path):
+    return sorted(name for name in os.listdir(path) if name.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def source_fingerprint(path):
+    """What a resumed run checks to make sure it reads the same input."""
+    path = os.path.abspath(path)
+    if os.path.isdir(path):
+        names = _image_files(path)
+        digest = hashlib.sha1()
+        for name in names:
+            digest.update(f'{name}:{os.path.getsize(os.path.join(path, name))}\n'.encode())
+        return {'path': path, 'files': len(names), 'digest': digest.hexdigest()}
+    stat = os.stat(path)
+    return {'path': path, 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def _reduce(bgr, max_long_edge):
+    # Same integer reduce decode_image would apply, done before the frame crosses processes
+    height, width = bgr.shape[:2]
+    if not max_long_edge or max(width, height) <= max_long_edge:
+        return bgr
+    factor = math.ceil(max(width, height) / max_long_edge)
+    return cv2.resize(bgr, (width // factor, height // factor), interpolation=cv2.INTER_AREA)
+
+
+def video_frames(path, stride=1, skip=None, max_long_edge=0):
+    """Yield (index, source_frame, timestamp_ms, RawFrame) for every `stride`-th frame of a video.
+
+    Frames whose index `skip(index)` accepts are passed over without being converted.
+    """
+    if cv2 is None:
+        raise RuntimeError('Reading video files needs opencv (installed with mediapipe)')
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise ValueError(f'Cannot open video {path!r}')
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    try:
+        source_frame = 0
+        while True:
+            index, offset = divmod(source_frame, stride)
+            if offset or (skip is not None and skip(index)):
+                if not cap.grab():
+                    return
+            else:
+                ok, bgr = cap.read()
+                if not ok:
+                    return
+                rgb = cv2.cvtColor(_reduce(bgr, max_long_edge), cv2.COLOR_BGR2RGB)
+                frame = RawFrame(rgb.tobytes(), 'rgb', rgb.shape[1], rgb.shape[0])
+                yield index, source_frame, source_frame * 1000.0 / fps, frame
+            source_frame += 1
+    finally:
+        cap.release()
+
+
+def image_frames(path, fps=30.0, stride=1, skip=None):
+    """Yield (index, source_frame, timestamp_ms, bytes) for every `stride`-th image of a directory, by name."""
+    names = _image_files(path)
+    for source_frame in range(0, len(names), stride):
+        index = source_frame // stride
+        if skip is not None and skip(index):
+            continue
+        with open(os.path.join(path, names[source_frame]), 'rb') as f:
+            data = f.read()
+        yield index, source_frame, source_frame * 1000.0 / fps, data
+
+
+def source_frames(path, fps, stride, skip, max_long_edge):
+    if os.path.isdir(path):
+        return image_frames(path, fps, stride, skip)
+    return video_frames(path, stride, skip, max_long_edge)
+
+
+def chunks(frames, chunk_frames):
+    """Group consecutive frames into (chunk_index, frames) lists."""
+    current, batch = None, []
+    for frame in frames:
+        chunk = frame[0] // chunk_frames
+        if chunk != current and batch:
+            yield current, batch
+            batch = []
+        current = chunk
+        batch.append(frame)
+    if batch:
+        yield current, batch
+
+
+_app = None
+
+
+def _init_worker():
+    global _app
+    import app
+    app.face_mesh_pool.fill()
+    _app = app
+
+
+def _part_path(work_dir, chunk):
+    return os.path.join(work_dir, f'chunk-{chunk:06d}.npz')
+
+
+def analyze_chunk(work_dir, chunk, frames):
+    """Run one chunk through _process_image_bytes and write its part file; returns (chunk, frames, with a face)."""
+    n = len(frames)
+    landmarks = np.full((n, N_LANDMARKS, 3), np.nan, dtype=np.float32)
+    columns = {
+        'frame': np.empty(n, dtype=np.int64),
+        'source_frame': np.empty(n, dtype=np.int64),
+        'timestamp_ms': np.empty(n, dtype=np.float64),
+        'status': np.empty(n, dtype=np.int16),
+        'faces': np.zeros(n, dtype=np.int16),
+        'face_area_percent': np.full(n, np.nan, dtype=np.float32),
+        'width': np.zeros(n, dtype=np.int32),
+        'height': np.zeros(n, dtype=np.int32),
+    }
+    # Each chunk starts without a face box; later frames crop to the previous one
+    session = {}
+    for row, (index, source_frame, timestamp_ms, data) in enumerate(frames):
+        columns['frame'][row] = index
+        columns['source_frame'][row] = source_frame
+        columns['timestamp_ms'][row] = timestamp_ms
+        body, status = _app._process_image_bytes(data, None, None, session)
+        columns['status'][row] = status
+        if isinstance(data, RawFrame):
+            columns['width'][row], columns['height'][row] = data.width, data.height
+        else:
+            columns['width'][row], columns['height'][row] = _image_size(data)
+        if status == 200 and body['faces']:
+            columns['faces'][row] = body['faces']
+            landmarks[row] = body['landmarks']
+            if body['face_area_percent'] is not None:
+                columns['face_area_percent'][row] = body['face_area_percent']
+    path = _part_path(work_dir, chunk)
+    with open(path + '.tmp', 'wb') as f:
+        np.savez(f, landmarks=landmarks, **columns)
+    os.replace(path + '.tmp', path)
+    return chunk, n, int((columns['faces'] > 0).sum())
+
+
+def _image_size(data):
+    try:
+        return Image.open(io.BytesIO(data)).size
+    except Exception:
+        return 0, 0
+
+
+class NpzOutput:
+    """Writes an .npz without holding the landmarks in memory: they are streamed into the archive."""
+
+    def __init__(self, path, frames):
+        self.path = path
+        self._zip = zipfile.ZipFile(path + '.tmp', 'w', zipfile.ZIP_STORED, allowZip64=True)
+        self._landmarks = self._zip.open('landmarks.npy', 'w', force_zip64=True)
+        np.lib.format.write_array_header_1_0(self._landmarks, {
+            'descr': np.lib.format.dtype_to_descr(np.dtype('<f4')),
+            'fortran_order': False,
+            'shape': (frames, N_LANDMARKS, 3),
+        })
+        self._columns = {}
+
+    def write(self, landmarks, columns):
+        self._landmarks.write(np.ascontiguousarray(landmarks, dtype='<f4').tobytes())
+        for name, values in columns.items():
+            self._columns.setdefault(name, []).append(values)
+
+    def close(self):
+        self._landmarks.close()
+        for name, parts in self._columns.items():
+            with self._zip.open(f'{name}.npy', 'w', force_zip64=True) as f:
+                np.lib.format.write_array(f, np.concatenate(parts))
+        self._zip.close()
+        os.replace(self.path + '.tmp', self.path)
+
+
+class ParquetOutput:
+    """One row group per chunk; landmarks as a fixed-size list of 478 * 3 floats."""
+
+    def __init__(self, path, frames):
+        if pq is None:
+            raise RuntimeError('Parquet output needs pyarrow (pip install pyarrow), or write .npz')
+        self.path = path
+        self._writer = None
+
+    def write(self, landmarks, columns):
+        flat = pa.array(np.ascontiguousarray(landmarks, dtype=np.float32).ravel())
+        table = pa.table(dict(columns, landmarks=pa.FixedSizeListArray.from_arrays(flat, N_LANDMARKS * 3)))
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.path + '.tmp', table.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            os.replace(self.path + '.tmp', self.path)
+
+
+OUTPUTS = {'.npz': NpzOutput, '.parquet': ParquetOutput, '.pq': ParquetOutput}
+
+
+def _metric_row(metrics):
+    gaze = metrics.get('gaze') or {}
+    pose = metrics.get('headPose') or {}
+    flat = dict(metrics, gazeX=gaze.get('x'), gazeY=gaze.get('y'),
+                yaw=pose.get('yaw'), pitch=pose.get('pitch'), roll=pose.get('roll'))
+    return [np.nan if flat.get(name) is None else float(flat[name]) for name in METRIC_COLUMNS]
+
+
+class BatchJob:
+    """One offline analysis: inference into part files, then ordered assembly into the output."""
+
+    def __init__(self, source, output, work_dir=None, workers=None, chunk_frames=64, stride=1, fps=30.0,
+                 mongo=False, session_id=None, recorded_at=None, restart=False, max_inflight_mb=512):
+        self.source = source
+        self.output = output
+        self.work_dir = work_dir or output + '.parts'
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.max_inflight_bytes = max_inflight_mb * 1024 * 1024
+        self.mongo = mongo
+        ext = os.path.splitext(output)[1].lower()
+        if ext not in OUTPUTS:
+            raise ValueError(f'Output must end in one of {", ".join(OUTPUTS)}')
+        self._output_cls = OUTPUTS[ext]
+
+        params = {'chunk_frames': chunk_frames, 'stride': stride, 'fps': fps,
+                  'max_long_edge': int(os.environ.get('DETECT_MAX_LONG_EDGE', '1280'))}
+        fingerprint = source_fingerprint(source)
+        checkpoint = self._read_checkpoint()
+        if checkpoint is not None and not restart:
+            if checkpoint['source'] != fingerprint or checkpoint['params'] != params:
+                raise ValueError(f'{self.work_dir} belongs to a run with another input or settings; '
+                                 'pass --restart to discard it')
+            logger.info(f'Resuming from {self.work_dir}')
+        else:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+            if recorded_at is None:
+                recorded_at = datetime.fromtimestamp(os.path.getmtime(source), timezone.utc)
+            checkpoint = {
+                'source': fingerprint,
+                'params': params,
+                'batch_id': uuid.uuid4().hex,
+                'session_id': session_id or str(uuid.uuid4()),
+                'recorded_at': recorded_at.isoformat(),
+                'chunks': None,
+                'frames': None,
+                'loaded_chunks': 0,
+            }
+        os.makedirs(self.work_dir, exist_ok=True)
+        self.checkpoint = checkpoint
+        self._save_checkpoint()
+
+    def _read_checkpoint(self):
+        try:
+            with open(os.path.join(self.work_dir, CHECKPOINT)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_checkpoint(self):
+        path = os.path.join(self.work_dir, CHECKPOINT)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.checkpoint, f, indent=1)
+        os.replace(path + '.tmp', path)
+
+    def _done_chunks(self):
+        return {int(name[6:12]) for name in os.listdir(self.work_dir)
+                if name.startswith('chunk-') and name.endswith('.npz')}
+
+    def analyze(self):
+        """Run every chunk without a part file through the workers."""
+        if self.checkpoint['chunks'] is not None:
+            return
+        params = self.checkpoint['params']
+        done = self._done_chunks()
+        chunk_frames = params['chunk_frames']
+        frames = source_frames(self.source, params['fps'], params['stride'],
+                               lambda index: index // chunk_frames in done, params['max_long_edge'])
+        total_chunks, total_frames = len(done), 0
+        if done:
+            logger.info(f'{len(done)} chunks already analyzed')
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker) as pool:
+            # future -> bytes of frames it carries
+            pending = {}
+            try:
+                for chunk, batch in chunks(frames, chunk_frames):
+                    size = sum(len(data.data) if isinstance(data, RawFrame) else len(data) for *_, data in batch)
+                    # Keep every worker busy, but never more than one chunk over the memory cap
+                    while pending and (len(pending) >= 2 * self.workers
+                                       or sum(pending.values()) + size > self.max_inflight_bytes):
+                        finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            del pending[future]
+                        total_frames += self._collect(finished)
+                    pending[pool.submit(analyze_chunk, self.work_dir, chunk, batch)] = size
+                    total_chunks += 1
+                total_frames += self._collect(wait(pending).done)
+            except BaseException:
+                for future in pending:
+                    future.cancel()
+                raise
+        logger.info(f'Analyzed {total_frames} frames in {total_chunks - len(done)} chunks')
+        self.checkpoint['chunks'] = max(self._done_chunks(), default=-1) + 1
+        self._save_checkpoint()
+
+    @staticmethod
+    def _collect(finished):
+        frames = 0
+        for future in finished:
+            chunk, n, with_face = future.result()
+            frames += n
+            logger.info(f'chunk {chunk}: {n} frames, {with_face} with a face')
+        return frames
+
+    def _parts(self):
+        for chunk in range(self.checkpoint['chunks']):
+            path = _part_path(self.work_dir, chunk)
+            if not os.path.exists(path):
+                raise RuntimeError(f'Missing part {path}; rerun to analyze it')
+            with np.load(path) as part:
+                yield chunk, {name: part[name] for name in part.files}
+
+    def assemble(self):
+        """Read the parts in frame order, add metrics, write the output and optionally load MongoDB."""
+        total = 0
+        for chunk in range(self.checkpoint['chunks']):
+            with np.load(_part_path(self.work_dir, chunk)) as part:
+                total += len(part['frame'])
+        self.checkpoint['frames'] = total
+
+        loader = _DetectionLoader(self.checkpoint, self.source) if self.mongo else None
+        state = SessionMetrics()
+        out = self._output_cls(self.output, total)
+        try:
+            for chunk, part in self._parts():
+                landmarks = part.pop('landmarks')
+                n = len(part['frame'])
+                metric_values = np.full((n, len(METRIC_COLUMNS)), np.nan)
+                metrics = [None] * n
+                for row in range(n):
+                    if part['status'][row] != 200:
+                        continue
+                    height = part['height'][row] or 1
+                    points = landmarks[row] if part['faces'][row] else None
+                    metrics[row] = state.update(points, aspect=part['width'][row] / height,
+                                                now=part['timestamp_ms'][row] / 1000.0)
+                    metric_values[row] = _metric_row(metrics[row])
+                columns = dict(part)
+                columns.update({name: metric_values[:, i] for i, name in enumerate(METRIC_COLUMNS)})
+                out.write(landmarks, columns)
+                if loader is not None and chunk >= self.checkpoint['loaded_chunks']:
+                    loader.load(chunk, part, landmarks, metrics)
+                    self.checkpoint['loaded_chunks'] = chunk + 1
+                    self._save_checkpoint()
+        except BaseException:
+            self._save_checkpoint()
+            raise
+        out.close()
+        logger.info(f'Wrote {total} frames to {self.output}')
+        if loader is not None:
+            logger.info(f'Loaded detections for session {self.checkpoint["session_id"]} '
+                        f'(batch {self.checkpoint["batch_id"]})')
+
+    def run(self, keep_parts=False):
+        self.analyze()
+        self.assemble()
+        if not keep_parts:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+class _DetectionLoader:
+    """Bulk inserts into `detections` in the live endpoint's document shape, one chunk at a time."""
+
+    def __init__(self, checkpoint, source):
+        # The app is only needed for its MongoDB handle and detection rendering; don't start it
+        from startup import lifecycle
+        lifecycle.defer()
+        import app
+        self._app = app
+        self._collection = app._collection('detections')
+        if self._collection is None:
+            raise RuntimeError('--mongo needs MONGO_URI')
+        self._session_id = checkpoint['session_id']
+        self._batch_id = checkpoint['batch_id']
+        self._recorded_at = datetime.fromisoformat(checkpoint['recorded_at'])
+        self._source = f'batch:{os.path.basename(os.path.normpath(source))}'
+
+    def load(self, chunk, part, landmarks, metrics):
+        docs = []
+        for row in range(len(part['frame'])):
+            if part['status'][row] != 200:
+                continue
+            faces = int(part['faces'][row])
+            area = float(part['face_area_percent'][row])
+            body = {
+                'faces': faces,
+                'landmarks': landmarks[row] if faces else None,
+                'face_area_percent': None if math.isnan(area) else area,
+                'metrics': metrics[row],
+            }
+            docs.append({
+                'sessionId': self._session_id,
+                'timestamp': self._recorded_at + timedelta(milliseconds=float(part['timestamp_ms'][row])),
+                'data': self._app._render_detection(body),
+                'source': self._source,
+                'batch': {'id': self._batch_id, 'chunk': chunk, 'frame': int(part['frame'][row])},
+            })
+        # A chunk interrupted halfway is replaced as a whole (sessionId narrows it to the index)
+        self._collection.delete_many({'sessionId': self._session_id, 'batch.id': self._batch_id, 'batch.chunk': chunk})
+        if docs:
+            self._collection.insert_many(docs, ordered=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('source', help='video file, or directory of images (read in name order)')
+    parser.add_argument('-o', '--output', required=True, help='output file: .npz or .parquet')
+    parser.add_argument('--workers', type=int, help='worker processes (default: CPUs - 1)')
+    parser.add_argument('--chunk-frames', type=int, default=64, help='consecutive frames per work unit')
+    parser.add_argument('--stride', type=int, default=1, help='analyze every Nth frame')
+    parser.add_argument('--fps', type=float, default=30.0, help='frame rate of an image directory')
+    parser.add_argument('--max-inflight-mb', type=float, default=512, help='cap on frames queued for the workers')
+    parser.add_argument('--work-dir', help='part files and checkpoint (default: <output>.parts)')
+    parser.add_argument('--restart', action='store_true', help='discard an existing checkpoint')
+    parser.add_argument('--keep-parts', action='store_true', help='keep the work directory after finishing')
+    parser.add_argument('--mongo', action='store_true', help='also insert every frame into the detections collection')
+    parser.add_argument('--session-id', help='sessionId of the loaded detections (default: a new id)')
+    parser.add_argument('--recorded-at', type=datetime.fromisoformat,
+                        help='ISO time of the first frame, for detection timestamps (default: the source mtime)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if args.chunk_frames < 1 or args.stride < 1:
+        parser.error('--chunk-frames and --stride must be at least 1')
+    if args.recorded_at is not None and args.recorded_at.tzinfo is None:
+        args.recorded_at = args.recorded_at.replace(tzinfo=timezone.utc)
+    try:
+        job = BatchJob(args.source, args.output, work_dir=args.work_dir, workers=args.workers,
+                       chunk_frames=args.chunk_frames, stride=args.stride, fps=args.fps, mongo=args.mongo,
+                       session_id=args.session_id, recorded_at=args.recorded_at, restart=args.restart,
+                       max_inflight_mb=args.max_inflight_mb)
+        job.run(keep_parts=args.keep_parts)
+    except (ValueError, RuntimeError) as e:
+        logger.error(str(e))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
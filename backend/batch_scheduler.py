@@ -0,0 +1,121 @@
+"""
+Micro-batching scheduler for concurrent detect requests.
+
+Request threads submit a frame and block on a future. A dispatcher thread
+groups waiting frames into batches of up to `max_batch_size`, holding a batch
+open for at most `max_delay` seconds, and hands each batch to a handler that
+returns one result per item. When nothing is in flight a lone frame is
+dispatched immediately, so light traffic does not pay the batching delay.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+logger = logging.getLogger(__name__)
+
+
+class SchedulerTimeout(Exception):
+    """Raised when a submitted item did not complete within the wait timeout."""
+
+
+class MicroBatchScheduler:
+    """Collect submitted items into batches and run `handler(batch) -> results`.
+
+    At most `max_inflight` batches run at once; while all of them are busy,
+    new items keep accumulating (up to `max_batch_size`) instead of waiting
+    only for the delay to expire.
+    """
+
+    def __init__(self, handler, max_batch_size=8, max_delay=0.005, max_inflight=2):
+        self._handler = handler
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_delay = max(0.0, float(max_delay))
+        self.max_inflight = max(1, int(max_inflight))
+        self._queue = deque()
+        self._cv = threading.Condition()
+        self._inflight = 0
+        self._closed = False
+        self._executor = ThreadPoolExecutor(max_workers=self.max_inflight, thread_name_prefix='detect-batch')
+        self._stats = {'batches': 0, 'items': 0, 'max_batch': 0}
+        self._thread = threading.Thread(target=self._run, name='detect-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, item, timeout=None):
+        """Queue `item` and block until its result is ready."""
+        fut = Future()
+        with self._cv:
+            if self._closed:
+                raise RuntimeError('scheduler is closed')
+            self._queue.append((item, fut, time.monotonic()))
+            self._cv.notify()
+        try:
+            return fut.result(timeout=timeout)
+        except FutureTimeout:
+            raise SchedulerTimeout(f'batched item not completed after {timeout:.1f}s')
+
+    def _take_batch(self):
+        """Wait until a batch should be dispatched and pop it; None on shutdown."""
+        with self._cv:
+            while True:
+                if not self._queue:
+                    if self._closed:
+                        return None
+                    self._cv.wait()
+                    continue
+                now = time.monotonic()
+                deadline = self._queue[0][2] + self.max_delay
+                full = len(self._queue) >= self.max_batch_size
+                idle = self._inflight == 0
+                if self._inflight < self.max_inflight and (full or idle or now >= deadline or self._closed):
+                    n = min(len(self._queue), self.max_batch_size)
+                    batch = [self._queue.popleft() for _ in range(n)]
+                    self._inflight += 1
+                    return batch
+                # Woken by new items or by a batch finishing
+                self._cv.wait(timeout=max(0.0, deadline - now) if self._inflight < self.max_inflight else None)
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            self._executor.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch):
+        try:
+            results = self._handler([item for item, _, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f'handler returned {len(results)} results for {len(batch)} items')
+            for (_, fut, _), result in zip(batch, results):
+                fut.set_result(result)
+        except Exception as e:
+            logger.error(f'Batch handler failed for {len(batch)} items: {e}', exc_info=True)
+            for _, fut, _ in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+        finally:
+            with self._cv:
+                self._inflight -= 1
+                self._stats['batches'] += 1
+                self._stats['items'] += len(batch)
+                self._stats['max_batch'] = max(self._stats['max_batch'], len(batch))
+                self._cv.notify()
+
+    def stats(self):
+        with self._cv:
+            out = dict(self._stats)
+            out['queued'] = len(self._queue)
+            out['inflight_batches'] = self._inflight
+        out['avg_batch'] = (out['items'] / out['batches']) if out['batches'] else None
+        out['max_batch_size'] = self.max_batch_size
+        out['max_delay_ms'] = self.max_delay * 1000.0
+        return out
+
+    def close(self):
+        with self._cv:
+            self._closed = True
+            self._cv.notify_all()
+        self._thread.join(timeout=2.0)
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,132 @@
+"""
+Cold start: app import time, time to ready and the first detect, each in a fresh process.
+
+Every run starts a new interpreter, so nothing is cached in sys.modules:
+
+  import        `import app` (must stay light: no MediaPipe, Gemini or model work)
+  ready         from the end of the import until lifecycle.wait() returns
+                (FaceMesh graphs or inference workers built and warmed up)
+  first_detect  the first POST /api/sessions/<id>/detect once ready
+
+    python bench/cold_start.py
+    python bench/cold_start.py --runs 10 --budget-ms 1500 --output cold_start.json
+
+With --budget-ms the script exits with status 1 when the median import is
+slower, or when a heavy module (HEAVY_MODULES) was loaded by the import.
+tests/test_import_budget.py checks the same budget with `probe_import`. The
+app is imported without MongoDB.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import results  # noqa: E402
+
+HEAVY_MODULES = ('mediapipe', 'google.genai', 'matplotlib', 'tensorflow')
+
+# Runs in the child; prints one JSON line
+_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+heavy = [m for m in %(heavy)r if m in sys.modules]
+ready = app.lifecycle.wait(%(timeout)r)
+t2 = time.perf_counter()
+first = None
+if ready:
+    import synthetic_face
+    client = app.app.test_client()
+    sid = client.post('/api/sessions/start', json={}).get_json()['session_id']
+    frame = synthetic_face.face_jpeg(640, 480)
+    t3 = time.perf_counter()
+    status = client.post(f'/api/sessions/{sid}/detect', data=frame, content_type='image/jpeg').status_code
+    first = time.perf_counter() - t3 if status == 200 else None
+print(json.dumps({'import': t1 - t0, 'ready': t2 - t1 if ready else None, 'first_detect': first,
+                  'heavy': heavy, 'startup': app.lifecycle.status()}))
+"""
+
+# Import only; the startup hooks are deferred so none can load a heavy module
+# behind the import's back before the check
+_IMPORT_PROBE = """
+import json, sys, time
+import startup
+startup.lifecycle.defer()
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+print(json.dumps({'import': t1 - t0, 'heavy': [m for m in %(heavy)r if m in sys.modules]}))
+"""
+
+
+def _run(code, timeout):
+    env = dict(os.environ)
+    env.setdefault('MONGO_URI', '')
+    env.setdefault('SESSION_BACKEND', 'local')
+    env.setdefault('DETECT_FRAME_CACHE', 'false')
+    out = subprocess.run([sys.executable, '-c', code], cwd=BACKEND_DIR, env=env,
+                         capture_output=True, text=True, timeout=timeout + 60)
+    if out.returncode != 0:
+        raise RuntimeError(f'probe failed with status {out.returncode}:\n{out.stderr[-2000:]}')
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def probe(timeout):
+    """Import, readiness and first detect times of one fresh process."""
+    return _run(_PROBE % {'heavy': HEAVY_MODULES, 'timeout': timeout}, timeout)
+
+
+def probe_import(timeout=60.0):
+    """{'import': seconds, 'heavy': [...]} of `import app` in a fresh process."""
+    return _run(_IMPORT_PROBE % {'heavy': HEAVY_MODULES}, timeout)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='fresh processes to start')
+    parser.add_argument('--timeout', type=float, default=120.0, help='seconds to wait for readiness')
+    parser.add_argument('--budget-ms', type=float, help='fail if the median import takes longer')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    samples = {'import': [], 'ready': [], 'first_detect': []}
+    heavy = set()
+    for _ in range(args.runs):
+        run = probe(args.timeout)
+        heavy.update(run['heavy'])
+        for name in samples:
+            if run[name] is not None:
+                samples[name].append(run[name])
+        if run['ready'] is None:
+            print(json.dumps({'not_ready': run['startup']}), flush=True)
+
+    rows = []
+    for name, seconds in samples.items():
+        row = {'name': name, 'latency_ms': results.latency_summary(seconds)}
+        rows.append(row)
+        print(json.dumps(row), flush=True)
+
+    failures = []
+    if heavy:
+        failures.append(f'imported at app import: {", ".join(sorted(heavy))}')
+    if args.budget_ms is not None:
+        median = rows[0]['latency_ms'].get('p50')
+        if median is None or median > args.budget_ms:
+            failures.append(f'median import {median} ms over the {args.budget_ms:g} ms budget')
+    print(json.dumps({'heavy_modules': sorted(heavy), 'failures': failures}), flush=True)
+
+    if args.output:
+        results.write(args.output, 'cold_start', vars(args), rows)
+    if args.budget_ms is not None and failures:
+        for failure in failures:
+            print(failure, file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""
+Micro-benchmarks of the detect pipeline on synthetic faces.
+
+Stages, each timed separately across frame sizes and upload formats:
+
+  decode     preprocess.decode_image (reduce-on-load to DETECT_MAX_LONG_EDGE)
+  inference  FaceMesh on the decoded frame (per size; it does not depend on format)
+  serialize  _render_detection + json.dumps of a result, per landmark encoding
+  process    app._process_image_bytes end to end, as a session frame (ROI crop,
+             server-side metrics, face tracks), with the frame cache off
+
+    python bench/detect_pipeline.py
+    python bench/detect_pipeline.py --sizes vga,1080p --formats jpeg,nv21 --iterations 50 --output detect.json
+    DETECT_MAX_FACES=2 python bench/detect_pipeline.py --sizes 720p --faces 2 --stages inference,process
+
+--faces draws that many faces side by side; run it with DETECT_MAX_FACES at
+least as high, and compare against --faces 1 for the per-face cost.
+
+The app is imported without MongoDB and with per-worker sessions; set other
+DETECT_* / INFERENCE_* variables in the environment to benchmark them.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Before the app is imported: no persistence, nothing shared between runs
+os.environ.setdefault('MONGO_URI', '')
+os.environ.setdefault('SESSION_BACKEND', 'local')
+os.environ.setdefault('DETECT_FRAME_CACHE', 'false')
+
+import synthetic  # noqa: E402
+import results  # noqa: E402
+
+STAGES = ('decode', 'inference', 'serialize', 'process')
+
+
+def _time(fn, inputs, iterations, warmup):
+    for i in range(warmup):
+        fn(inputs[i % len(inputs)])
+    samples = []
+    for i in range(iterations):
+        arg = inputs[i % len(inputs)]
+        t0 = time.perf_counter()
+        fn(arg)
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def _row(name, samples, **fields):
+    summary = results.latency_summary(samples)
+    mean_s = summary.get('mean', 0) / 1000.0
+    row = dict(fields, name=name, latency_ms=summary, throughput=round(1.0 / mean_s, 2) if mean_s else None)
+    print(json.dumps(row), flush=True)
+    return row
+
+
+def run(sizes, formats, stages, iterations, warmup, clip_frames, faces=1):
+    import app as appmod
+    from preprocess import decode_image
+    from landmark_codec import landmarks_array
+
+    # Graphs built and warmed up before anything is timed
+    appmod.lifecycle.wait()
+
+    rows = []
+    for size in sizes:
+        width, height = synthetic.SIZES[size]
+        clips = {fmt: synthetic.frame_sequence(clip_frames, width, height, fmt, faces=faces) for fmt in formats}
+
+        if 'decode' in stages:
+            for fmt, frames in clips.items():
+                samples = _time(lambda f: decode_image(f, appmod.DETECT_MAX_LONG_EDGE), frames, iterations, warmup)
+                rows.append(_row(f'decode/{size}/{fmt}', samples, stage='decode', size=size, format=fmt,
+                                 frame_bytes=sum(len(f) for f in frames) // len(frames)))
+
+        if 'inference' in stages:
+            decoded = [decode_image(f, appmod.DETECT_MAX_LONG_EDGE) for f in clips[formats[0]]]
+            mesh = appmod._new_face_mesh()
+            try:
+                samples = _time(lambda a: landmarks_array(mesh.process(a)), decoded, iterations, warmup)
+                found = len(landmarks_array(mesh.process(decoded[0])))
+            finally:
+                mesh.close()
+            rows.append(_row(f'inference/{size}', samples, stage='inference', size=size,
+                             input_shape=list(decoded[0].shape), faces=found))
+
+        if 'process' in stages:
+            for fmt, frames in clips.items():
+                session = {'session_id': 'bench'}
+                samples = _time(lambda f: appmod._process_image_bytes(f, None, 'bench', session),
+                                frames, iterations, warmup)
+                faces = appmod._process_image_bytes(frames[0], None, 'bench', session)[0]['faces']
+                rows.append(_row(f'process/{size}/{fmt}', samples, stage='process', size=size, format=fmt,
+                                 faces=faces))
+
+    if 'serialize' in stages:
+        width, height = synthetic.SIZES[sizes[0]]
+        frame = synthetic.encode(synthetic.faces_image(width, height, faces), 'jpeg')
+        body, status = appmod._process_image_bytes(frame, None, 'bench-serialize', {'session_id': 'bench-serialize'})
+        if status != 200 or not body.get('faces'):
+            raise RuntimeError(f'synthetic face not detected ({status}: {body})')
+        import landmark_codec
+        for encoding in landmark_codec.ENCODINGS:
+            samples = _time(lambda b: json.dumps(appmod._render_detection(b, encoding)), [body], iterations, warmup)
+            size_bytes = len(json.dumps(appmod._render_detection(body, encoding)))
+            rows.append(_row(f'serialize/{encoding}', samples, stage='serialize', encoding=encoding,
+                             response_bytes=size_bytes))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default=','.join(synthetic.SIZES), help='comma-separated: ' + ','.join(synthetic.SIZES))
+    parser.add_argument('--formats', default=','.join(synthetic.FORMATS), help='comma-separated: ' + ','.join(synthetic.FORMATS))
+    parser.add_argument('--stages', default=','.join(STAGES), help='comma-separated: ' + ','.join(STAGES))
+    parser.add_argument('--iterations', type=int, default=30, help='timed runs per measurement')
+    parser.add_argument('--warmup', type=int, default=3, help='untimed runs before each measurement')
+    parser.add_argument('--clip-frames', type=int, default=10, help='distinct synthetic frames cycled through')
+    parser.add_argument('--faces', type=int, default=1, help='faces drawn side by side in each frame')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    sizes = [s for s in args.sizes.split(',') if s.strip()]
+    formats = [f for f in args.formats.split(',') if f.strip()]
+    stages = [s for s in args.stages.split(',') if s.strip()]
+    for value, known in ((sizes, synthetic.SIZES), (formats, synthetic.FORMATS), (stages, STAGES)):
+        unknown = [v for v in value if v not in known]
+        if unknown:
+            parser.error(f'unknown value(s): {", ".join(unknown)}')
+
+    rows = run(sizes, formats, stages, args.iterations, args.warmup, args.clip_frames, args.faces)
+    if args.output:
+        results.write(args.output, 'detect_pipeline', vars(args), rows)
+
+
+if __name__ == '__main__':
+    main()
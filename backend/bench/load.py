@@ -0,0 +1,262 @@
+"""
+End-to-end load generator: concurrent session lifecycles against the app.
+
+Each virtual user runs sessions one after another:
+
+    POST /api/sessions/start
+    POST /api/sessions/<id>/detect      x --frames (binary JPEG, synthetic face)
+    POST /api/sessions/<id>/metrics     every --metrics-every frames
+    GET  /api/sessions/<id>/report
+    POST /api/sessions/<id>/end
+
+Users are closed-loop (the next request goes out when the previous answer
+arrives) unless --fps paces their frames. The run reports latency
+percentiles and throughput per request type, status counts, and the time a
+whole session took.
+
+Targets:
+    python bench/load.py                                   # Flask test client, in-process
+    python bench/load.py --serve gunicorn --server-workers 4
+    python bench/load.py --serve waitress --server-threads 8
+    python bench/load.py --target http://127.0.0.1:5000   # an already running server
+
+--serve starts the server on a free local port with the current environment
+(MONGO_URI etc. apply as usual) and stops it afterwards.
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_DIR = os.path.dirname(BACKEND_DIR)
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic  # noqa: E402
+import results  # noqa: E402
+
+OPERATIONS = ('start', 'detect', 'metrics', 'report', 'end')
+
+
+class InProcessClient:
+    """Flask test client; one per user thread."""
+
+    def __init__(self, app):
+        self._client = app.test_client()
+
+    def request(self, method, path, data=None, json_body=None, headers=None):
+        r = self._client.open(path, method=method, data=data, json=json_body, headers=headers)
+        return r.status_code, (r.get_json(silent=True) if r.is_json else None)
+
+
+class HttpClient:
+    """Keep-alive HTTP client for a running server; one per user thread."""
+
+    def __init__(self, base_url, timeout=30.0):
+        import requests
+        self._session = requests.Session()
+        self._base = base_url.rstrip('/')
+        self._timeout = timeout
+
+    def request(self, method, path, data=None, json_body=None, headers=None):
+        import requests
+        try:
+            r = self._session.request(method, self._base + path, data=data, json=json_body,
+                                      headers=headers, timeout=self._timeout)
+        except requests.RequestException:
+            return 0, None
+        try:
+            body = r.json()
+        except ValueError:
+            body = None
+        return r.status_code, body
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+
+    def add(self, op, seconds, status):
+        with self._lock:
+            self.latencies[op].append(seconds)
+            self.statuses[op][status] += 1
+
+
+def _timed(recorder, op, client, method, path, **kwargs):
+    t0 = time.perf_counter()
+    status, body = client.request(method, path, **kwargs)
+    recorder.add(op, time.perf_counter() - t0, status)
+    return status, body
+
+
+def run_user(client, frames, args, recorder, stop_at):
+    jpeg = {'Content-Type': 'image/jpeg'}
+    interval = 1.0 / args.fps if args.fps else 0.0
+    for _ in range(args.sessions_per_user):
+        if time.monotonic() >= stop_at:
+            return
+        started = time.perf_counter()
+        status, body = _timed(recorder, 'start', client, 'POST', '/api/sessions/start',
+                              json_body={'metadata': {'source': 'bench'}})
+        if status != 201 or not body:
+            continue
+        sid = body['session_id']
+        next_frame = time.monotonic()
+        for i in range(args.frames):
+            if interval:
+                delay = next_frame - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                next_frame += interval
+            _timed(recorder, 'detect', client, 'POST', f'/api/sessions/{sid}/detect',
+                   data=frames[i % len(frames)], headers=jpeg)
+            if args.metrics_every and (i + 1) % args.metrics_every == 0:
+                _timed(recorder, 'metrics', client, 'POST', f'/api/sessions/{sid}/metrics', json_body={
+                    'attentionPercent': 70.0 + i % 20, 'drowsinessPercent': 10.0,
+                    'blinkRate': 14.0, 'faceAreaPercent': 12.0, 'landmarkCount': 478,
+                })
+        _timed(recorder, 'report', client, 'GET', f'/api/sessions/{sid}/report')
+        _timed(recorder, 'end', client, 'POST', f'/api/sessions/{sid}/end', json_body={})
+        recorder.add('session', time.perf_counter() - started, 'ok')
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(kind, workers, threads):
+    """Start gunicorn or waitress on a free port; returns (process, base_url)."""
+    port = _free_port()
+    if kind == 'gunicorn':
+        cmd = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(BACKEND_DIR, 'gunicorn.conf.py'),
+               '-w', str(workers), '--threads', str(threads), '-b', f'127.0.0.1:{port}', 'backend.app:app']
+        cwd = REPO_DIR
+    elif kind == 'waitress':
+        cmd = [sys.executable, '-m', 'waitress', f'--listen=127.0.0.1:{port}', f'--threads={threads}', 'app:app']
+        cwd = BACKEND_DIR
+    else:
+        raise ValueError(f'unknown server {kind!r}')
+    proc = subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return proc, f'http://127.0.0.1:{port}'
+
+
+def wait_ready(base_url, proc=None, timeout=120.0):
+    import requests
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f'server exited with status {proc.returncode}')
+        try:
+            if requests.get(base_url + '/health/ready', timeout=2.0).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f'server at {base_url} not ready after {timeout:.0f}s')
+
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def run(args):
+    width, height = synthetic.SIZES[args.size]
+    frames = synthetic.frame_sequence(args.clip_frames, width, height, 'jpeg')
+
+    proc = None
+    if args.serve:
+        proc, base_url = start_server(args.serve, args.server_workers, args.server_threads)
+        target = args.serve
+    elif args.target != 'inprocess':
+        base_url, target = args.target, args.target
+    else:
+        base_url, target = None, 'inprocess'
+    try:
+        if base_url is not None:
+            wait_ready(base_url, proc)
+            def make_client():
+                return HttpClient(base_url)
+        else:
+            import app as appmod
+            appmod.lifecycle.wait()
+            def make_client():
+                return InProcessClient(appmod.app)
+
+        if args.warmup:
+            warm = Recorder()
+            run_user(make_client(), frames, argparse.Namespace(
+                **dict(vars(args), sessions_per_user=1, frames=args.warmup, fps=0)), warm, float('inf'))
+
+        recorder = Recorder()
+        stop_at = time.monotonic() + args.duration if args.duration else float('inf')
+        users = [threading.Thread(target=run_user, args=(make_client(), frames, args, recorder, stop_at),
+                                  name=f'user-{i}', daemon=True) for i in range(args.users)]
+        t0 = time.perf_counter()
+        for t in users:
+            t.start()
+        for t in users:
+            t.join()
+        wall = time.perf_counter() - t0
+    finally:
+        if proc is not None:
+            stop_server(proc)
+
+    rows = []
+    for op in OPERATIONS + ('session',):
+        samples = recorder.latencies.get(op)
+        if not samples:
+            continue
+        row = {
+            'name': f'{target}/{op}',
+            'operation': op,
+            'latency_ms': results.latency_summary(samples),
+            'throughput': round(len(samples) / wall, 2),
+            'status': {str(k): v for k, v in sorted(recorder.statuses[op].items(), key=lambda kv: str(kv[0]))},
+        }
+        rows.append(row)
+        print(json.dumps(row), flush=True)
+    print(json.dumps({'target': target, 'wall_seconds': round(wall, 3),
+                      'requests': sum(len(v) for k, v in recorder.latencies.items() if k != 'session')}), flush=True)
+    return rows, wall, target
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--target', default='inprocess', help="'inprocess' or the base URL of a running server")
+    parser.add_argument('--serve', choices=('gunicorn', 'waitress'), help='start this server locally and target it')
+    parser.add_argument('--server-workers', type=int, default=4, help='gunicorn worker processes')
+    parser.add_argument('--server-threads', type=int, default=4, help='threads per gunicorn worker / waitress threads')
+    parser.add_argument('--users', type=int, default=8, help='concurrent virtual users')
+    parser.add_argument('--sessions-per-user', type=int, default=2, help='sessions each user runs in turn')
+    parser.add_argument('--frames', type=int, default=60, help='detect frames per session')
+    parser.add_argument('--metrics-every', type=int, default=10, help='post client metrics every N frames (0: never)')
+    parser.add_argument('--fps', type=float, default=0.0, help='pace each user to this frame rate (0: closed loop)')
+    parser.add_argument('--duration', type=float, default=0.0, help='stop starting new sessions after this many seconds')
+    parser.add_argument('--size', default='vga', choices=list(synthetic.SIZES), help='synthetic frame size')
+    parser.add_argument('--clip-frames', type=int, default=30, help='distinct synthetic frames cycled through')
+    parser.add_argument('--warmup', type=int, default=5, help='untimed detect frames before the run')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    rows, wall, target = run(args)
+    if args.output:
+        results.write(args.output, 'load', dict(vars(args), target=target, wall_seconds=round(wall, 3)), rows)
+
+
+if __name__ == '__main__':
+    main()
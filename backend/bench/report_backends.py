@@ -0,0 +1,147 @@
+"""
+Benchmark the report backends on synthetic metric samples.
+
+For each size, the in-memory NumPy backend and (when a MongoDB URI is given)
+the MongoDB aggregation backend summarize the same samples. The run reports
+how long each takes and whether their outputs are identical. A plain Python
+scan over the sample documents, the way reports worked before, is timed as a
+baseline.
+
+    python bench/report_backends.py --sizes 1000,100000,1000000
+    python bench/report_backends.py --mongo-uri mongodb://localhost:27017 --output report_bench.json
+
+The MongoDB run writes to a scratch collection (`--db`, default
+neurovision_bench) and drops it afterwards. `--output` writes the results in
+the layout of bench/results.py (one result per backend and size, e.g.
+`memory/100000`), so runs on two commits can be compared with it.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import results  # noqa: E402
+
+from metrics_store import REPORT_FIELDS  # noqa: E402
+from report_engine import MongoReportBackend, summarize_columns  # noqa: E402
+
+SESSION_ID = 'bench-session'
+
+
+def synthetic_columns(n, seed=0):
+    """n samples at ~30 Hz with realistic value ranges and some missing values."""
+    rng = np.random.default_rng(seed)
+    start_ms = int(datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp() * 1000)
+    ts = start_ms + np.cumsum(rng.integers(20, 47, size=n))
+    cols = {
+        'attentionPercent': np.clip(rng.normal(65, 20, n), 0, 100),
+        'drowsinessPercent': np.clip(rng.normal(20, 15, n), 0, 100),
+        'blinkRate': np.clip(rng.normal(15, 5, n), 0, None),
+        'faceAreaPercent': np.clip(rng.normal(12, 3, n), 0, 100),
+        'ear': np.clip(rng.normal(0.3, 0.04, n), 0, None),
+    }
+    for col in cols.values():
+        col[rng.random(n) < 0.05] = np.nan
+    return ts, cols
+
+
+def sample_documents(ts, cols):
+    fields = list(cols)
+    values = np.column_stack([cols[f] for f in fields]).tolist()
+    for t, row in zip(ts.tolist(), values):
+        yield {
+            'sessionId': SESSION_ID,
+            'timestamp': datetime(1970, 1, 1, tzinfo=timezone.utc) + timedelta(milliseconds=t),
+            'metrics': {f: v for f, v in zip(fields, row) if v == v},
+        }
+
+
+def python_scan(docs):
+    """The pre-engine report: walk every document in Python."""
+    sums = {key: [0.0, 0] for key in REPORT_FIELDS}
+    for doc in docs:
+        metrics = doc.get('metrics') or {}
+        for key, field in REPORT_FIELDS.items():
+            v = metrics.get(field)
+            if v is not None:
+                sums[key][0] += float(v)
+                sums[key][1] += 1
+    return {key: (s / c if c else None) for key, (s, c) in sums.items()}
+
+
+def timed(fn, repeat):
+    """(durations in seconds of `repeat` runs, the last run's result)."""
+    durations = []
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        durations.append(time.perf_counter() - t0)
+    return durations, result
+
+
+def run(sizes, max_points, repeat, mongo_uri=None, db_name='neurovision_bench'):
+    collection = None
+    if mongo_uri:
+        from pymongo import MongoClient
+        collection = MongoClient(mongo_uri)[db_name]['metrics_bench']
+
+    rows = []
+
+    def add(name, n, durations, **extra):
+        row = dict({'name': f'{name}/{n}', 'samples': n, 'max_points': max_points,
+                    'latency_ms': results.latency_summary(durations)}, **extra)
+        rows.append(row)
+        print(json.dumps(row), flush=True)
+
+    for n in sizes:
+        ts, cols = synthetic_columns(n)
+
+        durations, mem_out = timed(lambda: summarize_columns(ts, cols, max_points), repeat)
+        add('memory', n, durations)
+
+        docs = list(sample_documents(ts, cols))
+        durations, _ = timed(lambda: python_scan(docs), repeat)
+        add('python_scan', n, durations)
+
+        if collection is not None:
+            collection.drop()
+            t0 = time.perf_counter()
+            for i in range(0, len(docs), 10000):
+                collection.insert_many(docs[i:i + 10000], ordered=False)
+            load_s = round(time.perf_counter() - t0, 3)
+            collection.create_index([('sessionId', 1), ('timestamp', 1)])
+            backend = MongoReportBackend(collection)
+            durations, mongo_out = timed(lambda: backend.report_data(SESSION_ID, max_points), repeat)
+            add('mongo', n, durations, load_s=load_s, identical=mongo_out == mem_out)
+            collection.drop()
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='1000,100000,1000000', help='comma-separated sample counts')
+    parser.add_argument('--max-points', type=int, default=500, help='points in the downsampled series')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement')
+    parser.add_argument('--mongo-uri', default=os.environ.get('MONGO_URI'), help='MongoDB to benchmark (default $MONGO_URI)')
+    parser.add_argument('--db', default='neurovision_bench', help='scratch database for the MongoDB run')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    rows = run(sizes, args.max_points, args.repeat, args.mongo_uri, args.db)
+    if args.output:
+        # The URI may carry credentials; record only whether MongoDB was run
+        parameters = dict(vars(args), mongo_uri=None, mongo=bool(args.mongo_uri))
+        results.write(args.output, 'report_backends', parameters, rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Latency summaries and JSON result files shared by the benchmarks.
+
+Every result file has the same layout, so runs on two commits can be diffed:
+
+    {"benchmark": ..., "environment": {commit, python, platform, cpus, packages},
+     "parameters": {...}, "results": [{"name": ..., "latency_ms": {...}, ...}]}
+
+Comparing two files prints the change in p50/p95/p99 and throughput for
+every result they share:
+
+    python bench/results.py before.json after.json
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+
+import numpy as np
+
+PERCENTILES = (50, 95, 99)
+
+
+def latency_summary(seconds):
+    """count, mean, p50/p95/p99 and max in milliseconds of a list of durations in seconds."""
+    if not seconds:
+        return {'count': 0}
+    ms = np.asarray(seconds, dtype=np.float64) * 1000.0
+    out = {'count': int(ms.size), 'mean': round(float(ms.mean()), 3)}
+    for p, v in zip(PERCENTILES, np.percentile(ms, PERCENTILES)):
+        out[f'p{p}'] = round(float(v), 3)
+    out['max'] = round(float(ms.max()), 3)
+    return out
+
+
+def _package_version(name):
+    try:
+        from importlib.metadata import version
+        return version(name)
+    except Exception:
+        return None
+
+
+def environment():
+    """Where the numbers came from: commit, interpreter, machine and key package versions."""
+    commit = None
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip() or None
+    except Exception:
+        pass
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'packages': {name: _package_version(name) for name in ('mediapipe', 'numpy', 'pillow', 'flask')},
+    }
+
+
+def write(path, benchmark, parameters, results):
+    with open(path, 'w', encoding='utf-8') as fh:
+        json.dump({
+            'benchmark': benchmark,
+            'environment': environment(),
+            'parameters': parameters,
+            'results': results,
+        }, fh, indent=2, sort_keys=True)
+
+
+def compare(before, after):
+    """Lines describing how each shared result changed between two result documents."""
+    old = {r['name']: r for r in before.get('results', [])}
+    lines = []
+    for row in after.get('results', []):
+        prev = old.get(row['name'])
+        if prev is None:
+            continue
+        parts = []
+        for p in PERCENTILES:
+            a = prev.get('latency_ms', {}).get(f'p{p}')
+            b = row.get('latency_ms', {}).get(f'p{p}')
+            if a and b is not None:
+                parts.append(f'p{p} {a:.2f}->{b:.2f}ms ({(b - a) / a * 100.0:+.1f}%)')
+        a, b = prev.get('throughput'), row.get('throughput')
+        if a and b is not None:
+            parts.append(f'throughput {a:.1f}->{b:.1f}/s ({(b - a) / a * 100.0:+.1f}%)')
+        lines.append(f"{row['name']}: " + ', '.join(parts))
+    return lines
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        print('usage: python bench/results.py BEFORE.json AFTER.json', file=sys.stderr)
+        return 2
+    docs = []
+    for path in argv:
+        with open(path, encoding='utf-8') as fh:
+            docs.append(json.load(fh))
+    for line in compare(*docs):
+        print(line)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
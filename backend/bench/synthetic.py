@@ -0,0 +1,88 @@
+"""
+Synthetic face frames for the benchmarks, so they run offline.
+
+Faces are drawn by synthetic_face.face_image (the same frame the app warms
+up on). `frame_sequence` moves the face and blinks, so consecutive frames
+differ the way a webcam stream does and do not hit the frame cache. With
+`faces` above 1, that many faces are drawn side by side, one per column.
+
+`encode` turns an image into what a client uploads: JPEG/PNG/WebP bytes, or
+a preprocess.RawFrame for 'rgb' and 'nv21' (BT.601 full range, as Android
+cameras produce).
+"""
+import io
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from preprocess import RawFrame  # noqa: E402
+from synthetic_face import face_image  # noqa: E402
+
+SIZES = {
+    'qvga': (320, 240),
+    'vga': (640, 480),
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+}
+FORMATS = ('jpeg', 'png', 'webp', 'rgb', 'nv21')
+
+
+def _nv21(rgb):
+    rgb = rgb.astype(np.float32)
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    y = 0.299 * r + 0.587 * g + 0.114 * b
+    # Chroma subsampled 2x2 by averaging
+    h, w = y.shape
+    def sub(c):
+        return c.reshape(h // 2, 2, w // 2, 2).mean(axis=(1, 3))
+    u = sub(-0.168736 * r - 0.331264 * g + 0.5 * b) + 128.0
+    v = sub(0.5 * r - 0.418688 * g - 0.081312 * b) + 128.0
+    vu = np.stack([v, u], axis=-1)
+    planes = [np.clip(y, 0, 255).astype(np.uint8).ravel(), np.clip(vu, 0, 255).astype(np.uint8).ravel()]
+    return np.concatenate(planes).tobytes()
+
+
+def encode(img, fmt='jpeg', quality=85):
+    """Bytes (jpeg/png/webp) or a RawFrame (rgb/nv21) of a PIL image."""
+    if fmt == 'rgb':
+        return RawFrame(np.asarray(img, dtype=np.uint8).tobytes(), 'rgb', img.width, img.height)
+    if fmt == 'nv21':
+        return RawFrame(_nv21(np.asarray(img)), 'nv21', img.width, img.height)
+    buf = io.BytesIO()
+    if fmt == 'jpeg':
+        img.save(buf, 'JPEG', quality=quality)
+    elif fmt == 'png':
+        img.save(buf, 'PNG')
+    elif fmt == 'webp':
+        img.save(buf, 'WEBP', quality=quality)
+    else:
+        raise ValueError(f'unknown format {fmt!r}')
+    return buf.getvalue()
+
+
+def faces_image(width=640, height=480, faces=1, shift=(0.0, 0.0), blink=0.0):
+    """RGB PIL image of `faces` faces side by side, each moved by `shift` within its column."""
+    if faces <= 1:
+        return face_image(width, height, shift, blink)
+    img = Image.new('RGB', (width, height))
+    column = width // faces
+    for n in range(faces):
+        img.paste(face_image(column, height, shift, blink), (n * column, 0))
+    return img
+
+
+def frame_sequence(count, width=640, height=480, fmt='jpeg', seed=0, faces=1):
+    """`count` encoded frames of faces drifting and blinking, like a short webcam clip."""
+    rng = np.random.default_rng(seed)
+    frames = []
+    dx = dy = 0.0
+    for i in range(count):
+        dx = float(np.clip(dx + rng.normal(0, 0.004), -0.08, 0.08))
+        dy = float(np.clip(dy + rng.normal(0, 0.003), -0.06, 0.06))
+        blink = 1.0 if i % 45 in (20, 21) else 0.0
+        frames.append(encode(faces_image(width, height, faces, (dx, dy), blink), fmt))
+    return frames
@@ -0,0 +1,154 @@
+"""
+Server-side facial metrics from a (478, 3) FaceMesh landmark array.
+
+`frame_metrics` computes the per-frame values in one vectorised pass over a
+single gather of the landmarks it needs: eye aspect ratio (EAR) per eye,
+iris-based gaze, an approximate head pose (no solvePnP), mouth aspect ratio
+and face area. `SessionMetrics` keeps the rolling per-session state needed
+for smoothed EAR, drowsiness, blink counting and blink rate, so clients can
+use the server's numbers instead of computing their own.
+
+These are prototype heuristics, not medical measurements.
+"""
+import math
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# Six-point EAR contours (p1 outer corner, p2/p3 upper lid, p4 inner corner,
+# p5/p6 lower lid) for the subject's right and left eye.
+_EYES = np.array([
+    [33, 160, 158, 133, 153, 144],
+    [263, 387, 385, 362, 380, 373],
+])
+# Iris centres (refined topology) and the lid points above/below them
+_IRIS = np.array([468, 473])
+_LIDS = np.array([[159, 145], [386, 374]])
+# Inner-lip vertical pairs and mouth corners
+_MOUTH_V = np.array([[81, 178], [13, 14], [311, 402]])
+_MOUTH_H = np.array([78, 308])
+# Head pose reference points: nose tip, chin, forehead, face sides
+_NOSE, _CHIN, _FOREHEAD, _SIDE_R, _SIDE_L = 1, 152, 10, 234, 454
+
+
+def frame_metrics(points, aspect=1.0):
+    """Per-frame metrics for one face; `points` is a (478, 3) normalized landmark array.
+
+    `aspect` is the frame's width / height. Normalized x and y use different
+    pixel scales, so x is rescaled before any distance or angle is taken.
+    """
+    xy = np.asarray(points, dtype=np.float64)[:, :2]
+    lo = xy.min(axis=0)
+    hi = xy.max(axis=0)
+    area = max(0.0, float((hi[0] - lo[0]) * (hi[1] - lo[1]) * 100.0))
+    xy = xy * (aspect, 1.0)
+
+    eyes = xy[_EYES]                                                # (2, 6, 2)
+    vertical = np.linalg.norm(eyes[:, [1, 2]] - eyes[:, [5, 4]], axis=2).sum(axis=1)
+    horizontal = np.linalg.norm(eyes[:, 0] - eyes[:, 3], axis=1)
+    ear = vertical / np.maximum(2.0 * horizontal, 1e-9)             # (2,)
+
+    # Gaze: iris centre relative to the eye box, -1..1 on each axis (0 = centred)
+    corners = eyes[:, [0, 3]]                                       # (2, 2, 2)
+    eye_min = corners[..., 0].min(axis=1)
+    eye_max = corners[..., 0].max(axis=1)
+    iris = xy[_IRIS]                                                # (2, 2)
+    gx = 2.0 * (iris[:, 0] - eye_min) / np.maximum(eye_max - eye_min, 1e-9) - 1.0
+    lids = xy[_LIDS]                                                # (2, 2, 2)
+    gy = 2.0 * (iris[:, 1] - lids[:, 0, 1]) / np.maximum(lids[:, 1, 1] - lids[:, 0, 1], 1e-9) - 1.0
+
+    mouth_v = np.linalg.norm(xy[_MOUTH_V[:, 0]] - xy[_MOUTH_V[:, 1]], axis=1).mean()
+    mouth_h = np.linalg.norm(xy[_MOUTH_H[0]] - xy[_MOUTH_H[1]])
+    mar = mouth_v / max(mouth_h, 1e-9)
+
+    # Head pose approximation from landmark geometry:
+    #   yaw   - nose offset from the midpoint between the face sides
+    #   pitch - nose offset from the forehead-chin midpoint
+    #   roll  - angle of the line through the outer eye corners
+    side_r, side_l = xy[_SIDE_R], xy[_SIDE_L]
+    half_width = max(abs(side_l[0] - side_r[0]) / 2.0, 1e-9)
+    yaw = math.degrees(math.asin(np.clip((xy[_NOSE, 0] - (side_l[0] + side_r[0]) / 2.0) / half_width, -1.0, 1.0)))
+    half_height = max(abs(xy[_CHIN, 1] - xy[_FOREHEAD, 1]) / 2.0, 1e-9)
+    pitch = math.degrees(math.asin(np.clip((xy[_NOSE, 1] - (xy[_CHIN, 1] + xy[_FOREHEAD, 1]) / 2.0) / half_height, -1.0, 1.0)))
+    d = xy[_EYES[1, 0]] - xy[_EYES[0, 0]]
+    roll = math.degrees(math.atan2(d[1], d[0]))
+
+    gaze_x = float(gx.mean())
+    gaze_y = float(gy.mean())
+    # Attention heuristic: facing the camera and looking roughly at it
+    facing = max(0.0, 1.0 - abs(yaw) / 45.0) * max(0.0, 1.0 - abs(pitch) / 45.0)
+    looking = 1.0 - 0.5 * min(1.0, math.hypot(gaze_x, gaze_y))
+    return {
+        'earLeft': float(ear[1]),
+        'earRight': float(ear[0]),
+        'ear': float(ear.mean()),
+        'gaze': {'x': gaze_x, 'y': gaze_y},
+        'headPose': {'yaw': yaw, 'pitch': pitch, 'roll': roll},
+        'mar': float(mar),
+        'faceAreaPercent': area,
+        'attentionPercent': 100.0 * facing * looking,
+    }
+
+
+class SessionMetrics:
+    """Rolling per-session state: smoothed EAR, drowsiness, blinks and blink rate.
+
+    A blink is counted when the raw EAR drops below `blink_close` and then
+    recovers above `blink_open` (hysteresis avoids double counts on noise).
+    Blink rate is blinks per minute over the last `rate_window` seconds.
+    """
+
+    def __init__(self, smooth=30, blink_close=0.20, blink_open=0.23, rate_window=60.0):
+        self.blink_close = blink_close
+        self.blink_open = blink_open
+        self.rate_window = rate_window
+        self._ears = deque(maxlen=smooth)
+        self._blink_times = deque()
+        self._eyes_closed = False
+        self._started = None
+        self.blink_count = 0
+        self._lock = threading.Lock()
+
+    def update(self, points, aspect=1.0, now=None):
+        """Fold one frame into the session state and return its metrics dict.
+
+        `points` may be None when no face was found in the frame.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self._started is None:
+                self._started = now
+            if points is None:
+                return dict(self._rolling(now), faceDetected=False, attentionPercent=0.0)
+
+            m = frame_metrics(points, aspect)
+            ear = m['ear']
+            self._ears.append(ear)
+            if not self._eyes_closed and ear < self.blink_close:
+                self._eyes_closed = True
+            elif self._eyes_closed and ear > self.blink_open:
+                self._eyes_closed = False
+                self.blink_count += 1
+                self._blink_times.append(now)
+
+            m['earRaw'] = ear
+            m.update(self._rolling(now))
+            # Same mapping the app uses: EAR 0.28 -> 0 %, 0.15 -> 100 %
+            m['drowsinessPercent'] = 100.0 * min(1.0, max(0.0, (0.28 - m['ear']) / 0.13))
+            m['faceDetected'] = True
+            return m
+
+    def _rolling(self, now):
+        while self._blink_times and now - self._blink_times[0] > self.rate_window:
+            self._blink_times.popleft()
+        # Until a full window has passed, scale by the elapsed time
+        window = min(self.rate_window, max(now - self._started, 1.0))
+        out = {
+            'blinkCount': self.blink_count,
+            'blinkRate': len(self._blink_times) * 60.0 / window,
+        }
+        if self._ears:
+            out['ear'] = float(sum(self._ears) / len(self._ears))
+        return out
@@ -0,0 +1,129 @@
+"""
+Stable per-session face track IDs from frame-to-frame bounding boxes.
+
+Each frame's faces are matched to the session's tracks greedily: highest IoU
+first (at least `iou_threshold`), then, for what is left, nearest centroid
+within `centroid_distance` times the track's box size (fast movement or a
+low frame rate can leave consecutive boxes without overlap). Unmatched faces
+open new tracks; tracks unseen for more than `max_missed` frames are
+dropped. With a handful of faces this is a few small numpy operations.
+
+One face per frame is the primary: the previous primary while it stays in
+view, otherwise the largest face. It gets the top-level landmarks, ROI and
+metrics, so those follow one person rather than whoever MediaPipe lists
+first.
+
+The state is a small plain dict so it can be shared between workers like
+the other session fields (shared_sessions.py):
+
+    {'next_id': 4, 'primary': 2, 'tracks': [[id, x0, y0, x1, y1, missed], ...]}
+"""
+import numpy as np
+
+# Tracks kept per session (and the size of the shared table's track area)
+MAX_TRACKS = 16
+
+
+def face_boxes(faces):
+    """Normalized (x0, y0, x1, y1) boxes, shape (faces, 4), of a (faces, landmarks, 3) array."""
+    if faces is None or len(faces) == 0:
+        return np.zeros((0, 4), dtype=np.float64)
+    xy = np.asarray(faces)[:, :, :2].astype(np.float64)
+    return np.concatenate([xy.min(axis=1), xy.max(axis=1)], axis=1)
+
+
+def box_areas(boxes):
+    """Area of each normalized box as a percentage of the frame."""
+    return np.clip(boxes[:, 2] - boxes[:, 0], 0, None) * np.clip(boxes[:, 3] - boxes[:, 1], 0, None) * 100.0
+
+
+def union_box(boxes):
+    """One normalized box around every row of `boxes`, or None."""
+    if len(boxes) == 0:
+        return None
+    return (float(boxes[:, 0].min()), float(boxes[:, 1].min()), float(boxes[:, 2].max()), float(boxes[:, 3].max()))
+
+
+def _iou(a, b):
+    """IoU matrix (len(a), len(b)) of two box arrays."""
+    x0 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y0 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x1 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y1 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x1 - x0, 0, None) * np.clip(y1 - y0, 0, None)
+    union = box_areas(a)[:, None] / 100.0 + box_areas(b)[None, :] / 100.0 - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-12), 0.0)
+
+
+def _greedy(score, allowed, matches, used_rows, used_cols, descending=True):
+    """Pair rows with columns best-score-first where `allowed`, skipping ones already used."""
+    order = np.argsort(-score if descending else score, axis=None)
+    for flat in order:
+        r, c = divmod(int(flat), score.shape[1])
+        if not allowed[r, c]:
+            break
+        if r in used_rows or c in used_cols:
+            continue
+        matches[r] = c
+        used_rows.add(r)
+        used_cols.add(c)
+
+
+def live_tracks(state):
+    """Tracks seen in the last processed frame."""
+    if not state:
+        return 0
+    return sum(1 for track in state['tracks'] if track[5] == 0)
+
+
+def update(state, boxes, iou_threshold=0.3, centroid_distance=0.5, max_missed=15):
+    """Match this frame's `boxes` to the tracks in `state`.
+
+    Returns (track ids aligned with `boxes`, index of the primary face or
+    None, the new state). `state` may be None for a new session.
+    """
+    state = state or {'next_id': 1, 'primary': None, 'tracks': []}
+    tracks = state['tracks']
+    n = len(boxes)
+    prev = np.array([t[1:5] for t in tracks], dtype=np.float64).reshape(-1, 4)
+
+    matches = {}
+    if n and len(prev):
+        used_rows, used_cols = set(), set()
+        iou = _iou(boxes, prev)
+        _greedy(iou, iou >= iou_threshold, matches, used_rows, used_cols)
+        if len(matches) < min(n, len(prev)):
+            centres = (boxes[:, :2] + boxes[:, 2:]) / 2.0
+            prev_centres = (prev[:, :2] + prev[:, 2:]) / 2.0
+            size = np.maximum(prev[:, 2] - prev[:, 0], prev[:, 3] - prev[:, 1])
+            dist = np.linalg.norm(centres[:, None, :] - prev_centres[None, :, :], axis=2) / np.maximum(size, 1e-6)[None, :]
+            _greedy(dist, dist <= centroid_distance, matches, used_rows, used_cols, descending=False)
+
+    next_id = int(state['next_id'])
+    ids = []
+    kept = []
+    for r in range(n):
+        if r in matches:
+            track_id = int(tracks[matches[r]][0])
+        else:
+            track_id, next_id = next_id, next_id + 1
+        ids.append(track_id)
+        kept.append([track_id, *(float(v) for v in boxes[r]), 0])
+    matched = set(matches.values())
+    for c, track in enumerate(tracks):
+        if c not in matched and track[5] < max_missed:
+            kept.append([track[0], *track[1:5], track[5] + 1])
+    # Seen most recently first, so the cap drops the longest-missing tracks
+    kept.sort(key=lambda t: t[5])
+
+    primary = None
+    if n:
+        if state.get('primary') in ids:
+            primary = ids.index(state['primary'])
+        else:
+            primary = int(np.argmax(box_areas(boxes)))
+    return ids, primary, {
+        'next_id': next_id,
+        'primary': ids[primary] if primary is not None else state.get('primary'),
+        'tracks': kept[:MAX_TRACKS],
+    }
@@ -0,0 +1,211 @@
+"""
+Bounded pool of MediaPipe FaceMesh graphs.
+
+A single FaceMesh graph must not be driven from several threads at once, so
+request threads check an instance out, run inference and check it back in.
+Instances that keep failing are closed and rebuilt on check-in, and
+`start_health_checks(interval)` also probes the idle ones periodically, so a
+graph that broke while idle is replaced before a request draws it.
+
+With `prefill=False` the pool starts empty and `fill()` builds the graphs
+later, in the process that serves requests (see startup.py); checkouts
+meanwhile wait for the first graph. A forked child never uses graphs built
+by its parent; its pool starts empty again.
+"""
+import logging
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """Raised when no FaceMesh instance became free within the wait timeout."""
+
+
+class _PooledMesh:
+    __slots__ = ('mesh', 'failures', 'uses')
+
+    def __init__(self, mesh):
+        self.mesh = mesh
+        self.failures = 0
+        self.uses = 0
+
+
+class FaceMeshPool:
+    """Fixed-size pool of FaceMesh instances with checkout/checkin.
+
+    `factory` is a zero-argument callable returning a new FaceMesh. `timeout`
+    is the default number of seconds a caller waits for a free instance.
+    After `max_failures` consecutive errors an instance is health-checked on a
+    blank frame and replaced if the probe also fails.
+    """
+
+    def __init__(self, factory, size=2, timeout=5.0, max_failures=3, prefill=True):
+        if size < 1:
+            raise ValueError('pool size must be >= 1')
+        self._factory = factory
+        self.size = size
+        self.timeout = timeout
+        self.max_failures = max_failures
+        # Graphs inherited through fork; kept referenced so they are never torn down here
+        self._inherited = []
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+        if prefill:
+            self.fill()
+
+    def _reset(self):
+        # LIFO so the most recently used (warm) graph is handed out first
+        self._idle = queue.LifoQueue(maxsize=self.size)
+        self._lock = threading.Lock()
+        self._created = 0
+        self._stats = {'checkouts': 0, 'timeouts': 0, 'errors': 0, 'replaced': 0, 'health_checks': 0}
+        # The health-check thread does not survive a fork; the child starts its own
+        self._health_thread = None
+        self._stopped = threading.Event()
+
+    def _after_fork(self):
+        if self._created:
+            self._inherited.append(self._idle)
+        self._reset()
+
+    def fill(self, warmup=None):
+        """Build the missing graphs, running `warmup(mesh)` on each before it is handed out."""
+        while True:
+            with self._lock:
+                if self._created >= self.size:
+                    return
+                self._created += 1
+            try:
+                mesh = self._factory()
+                if warmup is not None:
+                    warmup(mesh)
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+            self._idle.put(_PooledMesh(mesh))
+
+    @contextmanager
+    def checkout(self, timeout=None):
+        """Yield a FaceMesh instance for exclusive use; raise PoolTimeout when none frees up."""
+        wait = self.timeout if timeout is None else timeout
+        try:
+            slot = self._idle.get(timeout=wait)
+        except queue.Empty:
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise PoolTimeout(f'no FaceMesh instance available after {wait:.1f}s')
+
+        with self._lock:
+            self._stats['checkouts'] += 1
+        try:
+            yield slot.mesh
+        except Exception:
+            slot.failures += 1
+            with self._lock:
+                self._stats['errors'] += 1
+            raise
+        else:
+            slot.failures = 0
+        finally:
+            slot.uses += 1
+            self._checkin(slot)
+
+    def _checkin(self, slot):
+        if slot.failures >= self.max_failures and not self._probe(slot.mesh):
+            slot = self._replace(slot)
+        self._idle.put(slot)
+
+    @staticmethod
+    def _probe(mesh):
+        """Run a tiny blank frame through `mesh`; return False if the graph errors."""
+        try:
+            mesh.process(np.zeros((32, 32, 3), dtype=np.uint8))
+            return True
+        except Exception:
+            return False
+
+    def _replace(self, slot):
+        try:
+            fresh = _PooledMesh(self._factory())
+        except Exception as e:
+            # Keep the old instance rather than shrinking the pool
+            logger.error(f'Failed to rebuild unhealthy FaceMesh instance: {e}', exc_info=True)
+            return slot
+        try:
+            slot.mesh.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._stats['replaced'] += 1
+        logger.warning(f'Replaced unhealthy FaceMesh instance after {slot.failures} consecutive failures')
+        return fresh
+
+    def start_health_checks(self, interval):
+        """Run `check_health` every `interval` seconds on a background thread (0 disables)."""
+        if interval <= 0:
+            return
+        with self._lock:
+            if self._health_thread is not None:
+                return
+            self._health_thread = threading.Thread(
+                target=self._health_loop, args=(interval, self._stopped), name='facemesh-health', daemon=True)
+            self._health_thread.start()
+
+    def _health_loop(self, interval, stopped):
+        while not stopped.wait(interval):
+            try:
+                self.check_health()
+            except Exception as e:
+                logger.warning(f'FaceMesh health check failed: {e}')
+
+    def check_health(self, timeout=0.0):
+        """Probe every currently idle instance and replace the ones that fail.
+
+        Returns the number of instances probed. Busy instances are skipped; the
+        idle ones are out of the pool only for the probe (a blank 32x32 frame).
+        """
+        with self._lock:
+            self._stats['health_checks'] += 1
+        probed = []
+        try:
+            while True:
+                probed.append(self._idle.get(timeout=timeout) if timeout else self._idle.get_nowait())
+        except queue.Empty:
+            pass
+        for slot in probed:
+            if not self._probe(slot.mesh):
+                slot.failures = max(slot.failures, self.max_failures)
+                slot = self._replace(slot)
+            else:
+                slot.failures = 0
+            self._idle.put(slot)
+        return len(probed)
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+        out['size'] = self.size
+        out['idle'] = self._idle.qsize()
+        out['built'] = self._created
+        out['in_use'] = self._created - out['idle']
+        return out
+
+    def close(self):
+        self._stopped.set()
+        while True:
+            try:
+                slot = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                slot.mesh.close()
+            except Exception:
+                pass
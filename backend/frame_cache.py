@@ -0,0 +1,173 @@
+"""
+Per-session cache of landmark results for repeated frames.
+
+Clients resend identical frames (retries, a paused stream) and a static
+camera sends frames that barely differ. Both used to pay for a full decode
+and a FaceMesh run. Before inference, a frame is looked up in its session's
+cache:
+
+* exact: a BLAKE2b hash of the raw bytes (and size/format for raw frames);
+* near-duplicate (optional): a 64-bit difference hash (dHash) of a 9x8
+  grayscale thumbnail. JPEGs are decoded for it at 1/8 scale, raw frames are
+  sampled with a stride, so it costs a fraction of the real decode. A frame
+  whose dHash is within `max_distance` bits of a cached one reuses that result.
+
+Each session keeps its `max_entries` most recent results (LRU), and at most
+`max_sessions` sessions are cached (LRU). Hits are counted together with the
+inference time they saved.
+"""
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+from preprocess import RawFrame
+
+# Thumbnail for the difference hash: 9 columns give 8 horizontal gradients per row
+_HASH_W, _HASH_H = 9, 8
+
+
+def exact_key(img_bytes):
+    """Content hash of an encoded frame or RawFrame."""
+    h = hashlib.blake2b(digest_size=16)
+    if isinstance(img_bytes, RawFrame):
+        h.update(f'{img_bytes.fmt}:{img_bytes.width}x{img_bytes.height}:'.encode('ascii'))
+        h.update(img_bytes.data)
+    else:
+        h.update(img_bytes)
+    return h.digest()
+
+
+def _gray_thumbnail(img_bytes):
+    if isinstance(img_bytes, RawFrame):
+        w, h = img_bytes.width, img_bytes.height
+        buf = np.frombuffer(img_bytes.data, dtype=np.uint8)
+        step = max(1, min(w, h) // 64)
+        if img_bytes.fmt == 'nv21':
+            gray = buf[:w * h].reshape(h, w)[::step, ::step]
+        else:
+            gray = buf.reshape(h, w, 3)[::step, ::step].mean(axis=2).astype(np.uint8)
+        image = Image.fromarray(np.ascontiguousarray(gray))
+    else:
+        image = Image.open(io.BytesIO(img_bytes))
+        # JPEG: decode straight to grayscale at the smallest DCT scale
+        image.draft('L', (_HASH_W * 8, _HASH_H * 8))
+        image = image.convert('L')
+    return np.asarray(image.resize((_HASH_W, _HASH_H), Image.BILINEAR), dtype=np.int16)
+
+
+def perceptual_hash(img_bytes):
+    """64-bit difference hash: bit set where a pixel is brighter than its right neighbour."""
+    thumb = _gray_thumbnail(img_bytes)
+    bits = (thumb[:, :-1] > thumb[:, 1:]).ravel()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class _Entry:
+    __slots__ = ('phash', 'value', 'cost')
+
+    def __init__(self, phash, value, cost):
+        self.phash = phash
+        self.value = value
+        self.cost = cost
+
+
+class FrameCache:
+    """Recent inference results per session, looked up by exact and (optionally) perceptual hash.
+
+    `lookup` returns (value, probe); on a miss the caller computes the result
+    and passes the probe back to `store`, so the hashes are computed once.
+    """
+
+    def __init__(self, max_entries=8, max_sessions=256, near_duplicates=False, max_distance=4):
+        self.max_entries = max(1, int(max_entries))
+        self.max_sessions = max(1, int(max_sessions))
+        self.near_duplicates = near_duplicates
+        self.max_distance = int(max_distance)
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            'lookups': 0, 'exact_hits': 0, 'near_hits': 0, 'misses': 0,
+            'evicted': 0, 'hash_errors': 0, 'saved_seconds': 0.0,
+        }
+
+    def lookup(self, session_id, img_bytes):
+        key = exact_key(img_bytes)
+        phash = None
+        with self._lock:
+            self._stats['lookups'] += 1
+            entries = self._sessions.get(session_id)
+            if entries is not None:
+                self._sessions.move_to_end(session_id)
+                entry = entries.get(key)
+                if entry is not None:
+                    entries.move_to_end(key)
+                    self._stats['exact_hits'] += 1
+                    self._stats['saved_seconds'] += entry.cost
+                    return entry.value, None
+        if self.near_duplicates:
+            try:
+                phash = perceptual_hash(img_bytes)
+            except Exception:
+                # Undecodable here; inference will report the bad frame
+                with self._lock:
+                    self._stats['hash_errors'] += 1
+            if phash is not None:
+                with self._lock:
+                    entries = self._sessions.get(session_id)
+                    best_key, best = None, None
+                    for k, entry in (entries or {}).items():
+                        d = hamming(phash, entry.phash) if entry.phash is not None else self.max_distance + 1
+                        if d <= self.max_distance and (best is None or d < best[0]):
+                            best_key, best = k, (d, entry)
+                    if best is not None:
+                        entries.move_to_end(best_key)
+                        self._stats['near_hits'] += 1
+                        self._stats['saved_seconds'] += best[1].cost
+                        return best[1].value, None
+        with self._lock:
+            self._stats['misses'] += 1
+        return None, (key, phash)
+
+    def store(self, session_id, probe, value, cost=0.0):
+        """Cache `value` for the frame `probe` came from; `cost` is the seconds it took."""
+        if probe is None:
+            return
+        key, phash = probe
+        with self._lock:
+            entries = self._sessions.get(session_id)
+            if entries is None:
+                entries = self._sessions[session_id] = OrderedDict()
+                while len(self._sessions) > self.max_sessions:
+                    _, dropped = self._sessions.popitem(last=False)
+                    self._stats['evicted'] += len(dropped)
+            else:
+                self._sessions.move_to_end(session_id)
+            entries[key] = _Entry(phash, value, cost)
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+                self._stats['evicted'] += 1
+
+    def discard(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out['sessions'] = len(self._sessions)
+            out['entries'] = sum(len(e) for e in self._sessions.values())
+        hits = out['exact_hits'] + out['near_hits']
+        out['hit_rate'] = hits / out['lookups'] if out['lookups'] else 0.0
+        out['saved_seconds'] = round(out['saved_seconds'], 3)
+        out['near_duplicates'] = self.near_duplicates
+        out['max_distance'] = self.max_distance
+        return out
@@ -0,0 +1,190 @@
+"""
+Per-connection frame streaming over a WebSocket.
+
+A receiver thread reads client messages into a small bounded queue; the
+connection's handler thread takes frames from it, runs detection and sends
+results back in order. If the client sends faster than inference keeps up,
+the oldest queued frame is dropped (drop-oldest backpressure) and the running
+drop count is reported with every result, so the client always gets the
+freshest frame processed next.
+
+Client -> server messages:
+  binary                          an encoded JPEG/PNG frame, or raw pixels
+                                  after a `config` message
+  {"type": "config", "format": "rgb"|"nv21", "width": W, "height": H}
+  {"type": "config", "format": "encoded"}
+  {"dataUrl": "data:image/jpeg;base64,..."}   (same keys as /detect)
+  {"type": "close"}
+
+Server -> client messages are JSON text: a `ready` message after the session
+is validated, then `{"type": "result", "seq", "status", "dropped", ...}` per
+processed frame, or `{"type": "error", ...}`. An invalid `config` message is
+answered with an error and leaves the previous layout in place.
+"""
+import io
+import json
+import logging
+import threading
+from collections import deque
+
+from ingest import read_base64_field, InvalidDataUrl
+from preprocess import RAW_FORMATS, RawFrame
+
+logger = logging.getLogger(__name__)
+
+
+def _dimension(value):
+    """A positive integer width or height from a config message, or None."""
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        return None
+    try:
+        n = int(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return n if n > 0 else None
+
+
+class FrameStream:
+    """Run one streaming connection: `process(frame) -> (body, status)` per frame.
+
+    `ws` needs blocking `receive()` / `send()` and raises on a closed
+    connection (flask-sock / simple-websocket semantics).
+    """
+
+    def __init__(self, ws, process, image_keys, max_queue=2, max_frame_bytes=None):
+        self.ws = ws
+        self._process = process
+        self._image_keys = image_keys
+        self._max_frame_bytes = max_frame_bytes
+        self._queue = deque()
+        self._max_queue = max(1, int(max_queue))
+        self._cv = threading.Condition()
+        self._send_lock = threading.Lock()
+        self._closed = False
+        self._seq = 0
+        self.dropped = 0
+        self.processed = 0
+        # Layout of binary messages; None means encoded JPEG/PNG
+        self._raw = None
+
+    def send(self, msg):
+        data = json.dumps(msg, default=str)
+        with self._send_lock:
+            self.ws.send(data)
+
+    def run(self, ready=None):
+        self.send(dict(ready or {}, type='ready', max_queue=self._max_queue))
+        receiver = threading.Thread(target=self._receive_loop, name='frame-stream-recv', daemon=True)
+        receiver.start()
+        try:
+            while True:
+                item = self._next()
+                if item is None:
+                    break
+                seq, frame, error = item
+                if error is not None:
+                    self.send({'type': 'error', 'seq': seq, 'error': error})
+                    continue
+                body, status = self._process(frame)
+                self.processed += 1
+                self.send(dict(body, type='result', seq=seq, status=status, dropped=self.dropped))
+        except Exception as e:
+            # Client went away mid-send; nothing left to report to
+            logger.info(f'Frame stream closed: {e}')
+        finally:
+            self._stop()
+
+    def _next(self):
+        with self._cv:
+            while not self._queue and not self._closed:
+                self._cv.wait()
+            if not self._queue:
+                return None
+            return self._queue.popleft()
+
+    def _stop(self, drain=False):
+        """Stop accepting frames; queued frames are discarded unless `drain` is set."""
+        with self._cv:
+            self._closed = True
+            if not drain:
+                self._queue.clear()
+            self._cv.notify_all()
+
+    def _enqueue(self, frame=None, error=None):
+        with self._cv:
+            self._seq += 1
+            if len(self._queue) >= self._max_queue:
+                self._queue.popleft()
+                self.dropped += 1
+            self._queue.append((self._seq, frame, error))
+            self._cv.notify()
+
+    def _receive_loop(self):
+        try:
+            while not self._closed:
+                msg = self.ws.receive()
+                if msg is None:
+                    continue
+                if isinstance(msg, (bytes, bytearray)):
+                    self._on_binary(msg)
+                elif not self._on_text(msg):
+                    break
+        except Exception:
+            # Connection closed by the client or the server
+            pass
+        finally:
+            # Frames already queued still get answered (e.g. after a `close` message)
+            self._stop(drain=True)
+
+    def _on_binary(self, msg):
+        if self._raw is None:
+            self._enqueue(frame=bytes(msg))
+            return
+        try:
+            self._enqueue(frame=RawFrame(msg, *self._raw))
+        except ValueError as e:
+            self._enqueue(error=f'Invalid raw frame: {e}')
+
+    def _on_text(self, msg):
+        """Handle a JSON text message; return False when the client asked to close."""
+        # Control messages are tiny; only frames are worth streaming through the base64 reader
+        if len(msg) <= 4096:
+            try:
+                control = json.loads(msg)
+            except ValueError:
+                self._enqueue(error='Invalid JSON message')
+                return True
+            kind = control.get('type') if isinstance(control, dict) else None
+            if kind == 'close':
+                return False
+            if kind == 'config':
+                self._on_config(control)
+                return True
+        try:
+            frame = read_base64_field(io.BytesIO(msg.encode()), self._image_keys, max_bytes=self._max_frame_bytes)
+        except InvalidDataUrl:
+            self._enqueue(error='Invalid data URL')
+            return True
+        except ValueError:
+            self._enqueue(error='Failed to decode image data')
+            return True
+        if not frame:
+            self._enqueue(error='No image provided')
+        else:
+            self._enqueue(frame=frame)
+        return True
+
+    def _on_config(self, control):
+        fmt = str(control.get('format') or 'encoded').lower()
+        if fmt in ('encoded', 'jpeg', 'png'):
+            self._raw = None
+        elif fmt not in RAW_FORMATS:
+            self.send({'type': 'error', 'error': f'Unsupported frame format {fmt!r}'})
+            return
+        else:
+            width, height = _dimension(control.get('width')), _dimension(control.get('height'))
+            if width is None or height is None:
+                self.send({'type': 'error', 'error': 'Raw frames need positive integer width and height'})
+                return
+            self._raw = (fmt, width, height)
+        self.send({'type': 'config', 'format': fmt})
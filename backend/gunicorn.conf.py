@@ -0,0 +1,45 @@
+"""
+gunicorn settings for the backend.
+
+Loaded automatically when gunicorn starts from backend/ (the Docker image),
+or with `-c backend/gunicorn.conf.py` from the repo root (Procfile).
+
+Each worker process keeps its own metrics. For /internal/metrics to report
+all workers, prometheus_client's multiprocess mode is switched on here,
+before any worker imports the app: values are written to files under
+PROMETHEUS_MULTIPROC_DIR, which is emptied when the server starts. A dead
+worker's live gauges are dropped when gunicorn reaps it.
+
+FaceMesh graphs, inference workers and other per-process state are built
+by the app's startup hooks (startup.py). They are started here in each
+worker after it forks, never in the master, so `--preload` is safe.
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'neurovision-prometheus'))
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from startup import lifecycle  # noqa: E402
+
+lifecycle.defer()
+
+
+def on_starting(server):
+    # Counters from a previous run would otherwise be added to this one's
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def post_worker_init(worker):
+    # The app is loaded (imported here, or inherited with --preload); build and warm up
+    lifecycle.start()
+
+
+def child_exit(server, worker):
+    from telemetry import mark_process_dead
+    mark_process_dead(worker.pid)
@@ -0,0 +1,301 @@
+"""
+Process-pool inference engine.
+
+Each worker process owns one warm FaceMesh graph. Encoded frames are copied
+once into a per-worker shared-memory slot and only a (request id, slot,
+length) tuple crosses the pipe, so request threads do I/O and dispatch while
+decoding and inference run in the workers. Crashed or hung workers are
+restarted and their in-flight requests fail instead of taking serving down.
+
+With `start=False` no worker is spawned until `start()`, so the engine can
+be defined at import and started in the serving process (see startup.py).
+Until then `infer` waits for a slot like it does under load. A forked child
+does not inherit the parent's workers; its engine is unstarted again.
+"""
+import itertools
+import logging
+import multiprocessing as mp_proc
+import os
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from multiprocessing import shared_memory
+
+from landmark_codec import landmarks_array
+
+logger = logging.getLogger(__name__)
+
+
+class EngineError(Exception):
+    """Inference failed inside a worker (or the worker died mid-request)."""
+
+
+class EngineBusy(EngineError):
+    """No shared-memory slot became free, or the result did not arrive, in time."""
+
+
+class BadFrame(EngineError):
+    """The frame could not be decoded or does not fit in a slot."""
+
+
+def _worker_main(conn, slot_names, mesh_kwargs):
+    """Worker loop: read frames from shared memory, reply with landmark arrays."""
+    import mediapipe as mp
+    from preprocess import decode_image, detect_landmarks, RawFrame
+
+    slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+    mesh = mp.solutions.face_mesh.FaceMesh(**mesh_kwargs)
+    data = img_np = None
+    try:
+        while True:
+            try:
+                msg = conn.recv()
+            except (EOFError, OSError):
+                break
+            if msg is None:
+                break
+            req_id, slot, nbytes, opts = msg
+            try:
+                data = slots[slot].buf[:nbytes]
+                if opts.get('raw'):
+                    # Copy so no array keeps the shared segment exported
+                    data = RawFrame(bytes(data), *opts['raw'])
+                img_np = decode_image(data, opts.get('max_long_edge', 0))
+            except Exception as e:
+                conn.send((req_id, 'bad_frame', str(e)))
+                continue
+            try:
+                faces = detect_landmarks(lambda frame: landmarks_array(mesh.process(frame)), img_np,
+                                         opts.get('roi'), opts.get('margin', 0.5), opts.get('min_faces', 1))
+                conn.send((req_id, 'ok', (faces, img_np.shape[:2])))
+            except Exception as e:
+                conn.send((req_id, 'error', str(e)))
+    finally:
+        mesh.close()
+        # The last frame's view would keep its segment exported and make close() fail
+        data = img_np = None
+        for shm in slots:
+            shm.close()
+
+
+class _Worker:
+    def __init__(self, index, slots):
+        self.index = index
+        self.slots = slots
+        self.free = list(range(len(slots)))
+        # req_id -> (future, slot, dispatch time)
+        self.pending = {}
+        self.send_lock = threading.Lock()
+        self.proc = None
+        self.conn = None
+        self.restarts = 0
+        self.processed = 0
+
+
+class ProcessInferenceEngine:
+    """Fan frames out to `workers` FaceMesh processes over shared memory.
+
+    Each worker has `slots_per_worker` slots of `slot_bytes`, which bounds both
+    the largest accepted frame and the per-worker queue depth. `timeout` is the
+    default wait for a slot and for the result. A worker holding a request for
+    longer than `hang_timeout` seconds is killed and restarted.
+    """
+
+    def __init__(self, mesh_kwargs, workers=2, slots_per_worker=2, slot_bytes=16 * 1024 * 1024,
+                 timeout=5.0, hang_timeout=30.0, start_method=None, start=True):
+        self._mesh_kwargs = dict(mesh_kwargs)
+        self.workers = workers
+        self.slots_per_worker = slots_per_worker
+        self.slot_bytes = slot_bytes
+        self.timeout = timeout
+        self.hang_timeout = hang_timeout
+        self._ctx = mp_proc.get_context(start_method)
+        # Workers of a parent process, kept referenced so nothing here closes them
+        self._inherited = []
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+        if start:
+            self.start()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        # No capacity until the workers exist
+        self._capacity = threading.Semaphore(0)
+        self._ids = itertools.count()
+        self._closed = False
+        self._started = False
+        self._workers = []
+
+    def _after_fork(self):
+        self._inherited.extend(self._workers)
+        self._reset()
+
+    def start(self):
+        """Spawn the worker processes; later calls do nothing."""
+        with self._lock:
+            if self._started or self._closed:
+                return
+            self._started = True
+        for i in range(self.workers):
+            slots = [shared_memory.SharedMemory(create=True, size=self.slot_bytes) for _ in range(self.slots_per_worker)]
+            worker = _Worker(i, slots)
+            self._spawn(worker)
+            with self._lock:
+                self._workers.append(worker)
+            threading.Thread(target=self._reader, args=(worker,), name=f'inference-reader-{i}', daemon=True).start()
+            for _ in range(self.slots_per_worker):
+                self._capacity.release()
+        self._watchdog = threading.Thread(target=self._watch, name='inference-watchdog', daemon=True)
+        self._watchdog.start()
+
+    def _spawn(self, worker):
+        parent_conn, child_conn = self._ctx.Pipe()
+        proc = self._ctx.Process(
+            target=_worker_main,
+            args=(child_conn, [s.name for s in worker.slots], self._mesh_kwargs),
+            name=f'facemesh-worker-{worker.index}',
+            daemon=True,
+        )
+        proc.start()
+        # Close our copy of the child end so recv() sees EOF when the worker dies
+        child_conn.close()
+        worker.proc = proc
+        worker.conn = parent_conn
+
+    def infer(self, img_bytes, timeout=None, max_long_edge=0, roi=None, margin=0.5, min_faces=1, with_size=False):
+        """Decode and run FaceMesh on encoded image bytes in a worker process.
+
+        `img_bytes` may also be a preprocess.RawFrame. `max_long_edge`, `roi`,
+        `margin` and `min_faces` are passed to the worker's preprocessing (see preprocess.py). Returns a float32 array shaped
+        (faces, 478, 3) in full-frame coordinates, or `(faces, (height, width))`
+        of the decoded frame when `with_size` is set. Raises BadFrame,
+        EngineBusy or EngineError.
+        """
+        wait = self.timeout if timeout is None else timeout
+        nbytes = len(img_bytes)
+        if nbytes > self.slot_bytes:
+            raise BadFrame(f'frame of {nbytes} bytes exceeds slot size {self.slot_bytes}')
+        if self._closed:
+            raise EngineError('inference engine is closed')
+        if not self._capacity.acquire(timeout=wait):
+            raise EngineBusy(f'no inference slot free after {wait:.1f}s')
+
+        fut = Future()
+        with self._lock:
+            # Least-loaded worker that still has a free slot
+            worker = min((w for w in self._workers if w.free), key=lambda w: len(w.pending))
+            slot = worker.free.pop()
+            req_id = next(self._ids)
+            worker.pending[req_id] = (fut, slot, time.monotonic())
+            conn = worker.conn
+        opts = {'max_long_edge': max_long_edge, 'roi': roi, 'margin': margin, 'min_faces': min_faces}
+        raw = getattr(img_bytes, 'fmt', None)
+        if raw is not None:
+            opts['raw'] = (img_bytes.fmt, img_bytes.width, img_bytes.height)
+            img_bytes = img_bytes.data
+        worker.slots[slot].buf[:nbytes] = img_bytes
+        try:
+            with worker.send_lock:
+                conn.send((req_id, slot, nbytes, opts))
+        except (OSError, ValueError) as e:
+            self._complete(worker, req_id, ('error', f'worker unavailable: {e}'))
+
+        try:
+            status, payload = fut.result(timeout=wait)
+        except FutureTimeout:
+            # The slot stays reserved until the worker answers or is restarted
+            raise EngineBusy(f'inference result not ready after {wait:.1f}s')
+        if status == 'ok':
+            return payload if with_size else payload[0]
+        if status == 'bad_frame':
+            raise BadFrame(payload)
+        raise EngineError(payload)
+
+    def _complete(self, worker, req_id, result):
+        with self._lock:
+            entry = worker.pending.pop(req_id, None)
+            if entry is None:
+                return
+            fut, slot, _ = entry
+            worker.free.append(slot)
+            worker.processed += 1
+        self._capacity.release()
+        fut.set_result(result)
+
+    def _reader(self, worker):
+        while not self._closed:
+            try:
+                req_id, status, payload = worker.conn.recv()
+            except (EOFError, OSError):
+                if self._closed:
+                    break
+                self._restart(worker)
+                continue
+            self._complete(worker, req_id, (status, payload))
+
+    def _restart(self, worker):
+        proc = worker.proc
+        proc.join(timeout=1.0)
+        logger.error(f'Inference worker {worker.index} (pid {proc.pid}) exited with code {proc.exitcode}; restarting')
+        with self._lock:
+            lost = list(worker.pending)
+        for req_id in lost:
+            self._complete(worker, req_id, ('error', 'inference worker crashed'))
+        try:
+            worker.conn.close()
+        except Exception:
+            pass
+        with worker.send_lock:
+            self._spawn(worker)
+        worker.restarts += 1
+
+    def _watch(self):
+        while not self._closed:
+            time.sleep(1.0)
+            now = time.monotonic()
+            for worker in self._workers:
+                with self._lock:
+                    oldest = min((t for _, _, t in worker.pending.values()), default=None)
+                if oldest is not None and now - oldest > self.hang_timeout and worker.proc.is_alive():
+                    logger.error(f'Inference worker {worker.index} hung for {now - oldest:.1f}s; killing it')
+                    worker.proc.kill()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'mode': 'process',
+                'workers': [
+                    {
+                        'index': w.index,
+                        'pid': w.proc.pid,
+                        'alive': w.proc.is_alive(),
+                        'queue_depth': len(w.pending),
+                        'free_slots': len(w.free),
+                        'processed': w.processed,
+                        'restarts': w.restarts,
+                    }
+                    for w in self._workers
+                ],
+            }
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for worker in self._workers:
+            try:
+                with worker.send_lock:
+                    worker.conn.send(None)
+            except Exception:
+                pass
+        for worker in self._workers:
+            worker.proc.join(timeout=2.0)
+            if worker.proc.is_alive():
+                worker.proc.kill()
+            for shm in worker.slots:
+                shm.close()
+                try:
+                    shm.unlink()
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,85 @@
+"""
+Frame ingestion helpers for the detect endpoints.
+
+`read_base64_field` pulls a base64 image out of a JSON body while reading
+the request stream in chunks. The JSON is never parsed into a Python string,
+so a large frame is not held as text and decoded bytes at the same time.
+"""
+import binascii
+import re
+
+_B64_ALPHABET = b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/='
+# Every byte that can't be part of a base64 payload (whitespace, backslashes, ...)
+_NON_B64 = bytes(b for b in range(256) if b not in _B64_ALPHABET)
+# JSON escapes that stand for characters outside the alphabet; `\/` is kept as '/'
+_JSON_ESCAPES = (b'\\n', b'\\r', b'\\t')
+
+
+class InvalidDataUrl(ValueError):
+    """The value starts with `data:` but has no `,` separating header and payload."""
+
+
+def read_base64_field(stream, keys, chunk_size=64 * 1024, max_bytes=None):
+    """Decode the base64 string value of the first of `keys` found in a JSON body.
+
+    A leading `data:...;base64,` header is skipped. Returns the decoded bytes,
+    or None if none of the keys occurs. Raises ValueError on malformed input.
+    Only the decoded output plus one chunk is kept in memory.
+    """
+    key_re = re.compile(b'"(' + b'|'.join(re.escape(k.encode()) for k in keys) + b')"\\s*:\\s*"')
+    window = b''
+    # 1) scan for `"key": "`, keeping a tail long enough to span chunk borders
+    keep = max(len(k) for k in keys) + 16
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return None
+        window += chunk
+        m = key_re.search(window)
+        if m:
+            rest = window[m.end():]
+            break
+        window = window[-keep:]
+
+    # 2) skip a data: URL header if present
+    while len(rest) < 5 or (rest.startswith(b'data:') and b',' not in rest):
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        rest += chunk
+    if rest.startswith(b'data:'):
+        comma = rest.find(b',')
+        if comma < 0:
+            raise InvalidDataUrl('Invalid data URL')
+        rest = rest[comma + 1:]
+
+    # 3) decode up to the closing quote in 4-character groups
+    out = bytearray()
+    carry = b''
+    chunk = rest
+    while True:
+        end = chunk.find(b'"')
+        part = chunk if end < 0 else chunk[:end]
+        part = carry + part
+        # A trailing backslash may start an escape that continues in the next chunk
+        carry = b''
+        if end < 0 and part.endswith(b'\\'):
+            part, carry = part[:-1], b'\\'
+        for esc in _JSON_ESCAPES:
+            part = part.replace(esc, b'')
+        part = part.translate(None, _NON_B64)
+        usable = len(part) - (len(part) % 4) if end < 0 else len(part)
+        if usable:
+            try:
+                out += binascii.a2b_base64(part[:usable])
+            except binascii.Error as e:
+                raise ValueError(f'Failed to decode image data: {e}')
+        carry = part[usable:] + carry
+        if max_bytes is not None and len(out) > max_bytes:
+            raise ValueError('Image data too large')
+        if end >= 0:
+            break
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            raise ValueError('Unterminated image string')
+    return bytes(out)
@@ -0,0 +1,245 @@
+"""
+Per-session landmark archive: fixed-stride float16 records in one file per session.
+
+Each detection with a face appends one record to `<dir>/<session>.lmk`:
+
+    t          float64   wall time, seconds since the epoch (UTC)
+    landmarks  float16   (478, 3) normalized x, y, z, row-major
+
+Records are 2876 bytes, after a 64-byte header (magic, landmark count,
+record size). A record goes out in a single O_APPEND write, so workers on
+one host can append to the same session without locking, and readers never
+see a torn record (a trailing partial one is ignored).
+
+Records are stamped when they are appended, so each process writes them
+in time order. Across processes an append can still land just behind a
+later one (a worker preempted between taking the time and writing).
+
+Reading maps the file and views it as a structured array
+(`open_session(...).records`): selecting a time range is a binary search on
+the timestamp column, widened by `ORDER_SLACK` seconds for those records,
+and a slice of the map. Nothing outside the range is read, whatever the
+session length.
+"""
+import bisect
+import hashlib
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'NVLMARK1'
+HEADER_BYTES = 64
+_HEADER = struct.Struct('<8sII')
+
+# How far out of timestamp order a record may land (see above)
+ORDER_SLACK = 1.0
+
+
+def record_dtype(n_landmarks):
+    return np.dtype([('t', '<f8'), ('landmarks', '<f2', (n_landmarks, 3))])
+
+
+class ArchiveView:
+    """Read-only memory map of one session's archive; use as a context manager or call close()."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_BYTES)
+            if len(header) < HEADER_BYTES:
+                raise ValueError(f'{path}: truncated header')
+            magic, n_landmarks, record_bytes = _HEADER.unpack_from(header)
+            if magic != MAGIC:
+                raise ValueError(f'{path}: not a landmark archive')
+            self.dtype = record_dtype(n_landmarks)
+            if self.dtype.itemsize != record_bytes:
+                raise ValueError(f'{path}: unexpected record size {record_bytes}')
+            size = os.fstat(f.fileno()).st_size
+            count = (size - HEADER_BYTES) // record_bytes
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if count else None
+        self.n_landmarks = n_landmarks
+        self.records = (np.frombuffer(self._map, dtype=self.dtype, count=count, offset=HEADER_BYTES)
+                        if count else np.empty(0, dtype=self.dtype))
+
+    def __len__(self):
+        return len(self.records)
+
+    def select(self, start=None, end=None, stride=1):
+        """Records with start <= t <= end (seconds since the epoch), every `stride`-th.
+
+        A view of the map when the records in range are in timestamp order,
+        else a copy of the matching records.
+        """
+        if start is None and end is None:
+            return self.records[::stride]
+        # bisect probes ~log2(n) records; np.searchsorted would copy the strided column (every page)
+        t = self.records['t']
+        lo = 0 if start is None else bisect.bisect_left(t, start - ORDER_SLACK)
+        hi = len(t) if end is None else bisect.bisect_right(t, end + ORDER_SLACK)
+        window = self.records[lo:hi]
+        wt = window['t']
+        if np.all(wt[1:] >= wt[:-1]):
+            lo = 0 if start is None else int(np.searchsorted(wt, start, 'left'))
+            hi = len(wt) if end is None else int(np.searchsorted(wt, end, 'right'))
+            return window[lo:hi:stride]
+        mask = np.ones(len(wt), dtype=bool)
+        if start is not None:
+            mask &= wt >= start
+        if end is not None:
+            mask &= wt <= end
+        return window[mask][::stride]
+
+    def close(self):
+        self.records = None
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # A caller still holds a slice; the map goes when it does
+                pass
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LandmarkArchive:
+    """Appends per-session landmark records under `directory` and opens them for reading.
+
+    Up to `max_open` append descriptors are kept open (LRU). Files not
+    written for `retention` seconds are deleted by `prune()`.
+    """
+
+    def __init__(self, directory, n_landmarks=478, max_open=64, retention=None):
+        self.directory = directory
+        self.n_landmarks = n_landmarks
+        self.dtype = record_dtype(n_landmarks)
+        self.max_open = max(1, max_open)
+        self.retention = retention
+        os.makedirs(directory, exist_ok=True)
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._fds = OrderedDict()
+        self._stats = {'appended': 0, 'errors': 0, 'pruned': 0}
+
+    def _after_fork(self):
+        # The parent keeps its own copies; each process opens what it appends to
+        for fd in self._fds.values():
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self._reset()
+
+    def path(self, session_id):
+        name = session_id if re.fullmatch(r'[A-Za-z0-9_-]{1,128}', session_id) else \
+            hashlib.sha256(session_id.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + '.lmk')
+
+    def _create(self, path):
+        # Header written to a private file and linked into place, so no
+        # process ever appends to a file without one
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, self.n_landmarks, self.dtype.itemsize).ljust(HEADER_BYTES, b'\0'))
+        try:
+            os.link(tmp, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(tmp)
+
+    def _fd(self, session_id):
+        fd = self._fds.get(session_id)
+        if fd is not None:
+            self._fds.move_to_end(session_id)
+            return fd
+        path = self.path(session_id)
+        if not os.path.exists(path):
+            self._create(path)
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | getattr(os, 'O_BINARY', 0))
+        self._fds[session_id] = fd
+        while len(self._fds) > self.max_open:
+            _, old = self._fds.popitem(last=False)
+            os.close(old)
+        return fd
+
+    def append(self, session_id, points, timestamp=None):
+        """Append one face's (478, 3) landmarks, stamped `timestamp` (seconds
+        since the epoch; default now, taken just before the write)."""
+        try:
+            landmarks = np.asarray(points, dtype='<f2').tobytes()
+            if 8 + len(landmarks) != self.dtype.itemsize:
+                raise ValueError(f'expected {self.n_landmarks} landmarks, got {np.shape(points)}')
+            with self._lock:
+                fd = self._fd(session_id)
+                t = time.time() if timestamp is None else timestamp
+                os.write(fd, struct.pack('<d', t) + landmarks)
+                self._stats['appended'] += 1
+        except Exception as e:
+            with self._lock:
+                self._stats['errors'] += 1
+            logger.warning(f'Failed to archive landmarks for session {session_id}: {e}')
+
+    def release(self, session_id):
+        """Close the session's append descriptor (the file stays)."""
+        with self._lock:
+            fd = self._fds.pop(session_id, None)
+        if fd is not None:
+            os.close(fd)
+
+    def open_session(self, session_id):
+        """ArchiveView of the session, or None when nothing was archived for it."""
+        try:
+            return ArchiveView(self.path(session_id))
+        except FileNotFoundError:
+            return None
+
+    def prune(self, max_age=None):
+        """Delete archives not written for `max_age` seconds (default: the retention); returns how many."""
+        max_age = self.retention if max_age is None else max_age
+        if not max_age:
+            return 0
+        cutoff = time.time() - max_age
+        removed = 0
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.name.endswith('.lmk') and entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+                    removed += 1
+            except OSError:
+                pass
+        with self._lock:
+            self._stats['pruned'] += removed
+        return removed
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out['open'] = len(self._fds)
+        out['directory'] = self.directory
+        return out
+
+    def close(self):
+        with self._lock:
+            fds, self._fds = list(self._fds.values()), OrderedDict()
+        for fd in fds:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
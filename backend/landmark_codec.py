@@ -0,0 +1,119 @@
+"""
+Landmark arrays and their wire encodings.
+
+FaceMesh results are turned into float32 arrays straight from the serialized
+protobuf: a NormalizedLandmarkList with only x/y/z set is a run of fixed
+17-byte records, which numpy can view with a structured dtype. That avoids
+creating a Python object per landmark.
+
+Encodings for /detect responses:
+  json  list of {'x', 'y', 'z'} dicts (the default, unchanged shape)
+  f32   packed little-endian float32, row-major (n, 3)
+  f16   packed little-endian float16
+  i16   little-endian int16, value = round(coord * I16_SCALE)
+Any encoding can be restricted to a named landmark subset.
+"""
+import base64
+
+import numpy as np
+
+N_LANDMARKS = 478
+
+# Landmark indices of the refined (478-point) FaceMesh topology, taken from
+# mediapipe.solutions.face_mesh_connections.
+LEFT_EYE = (249, 263, 362, 373, 374, 380, 381, 382, 384, 385, 386, 387, 388, 390, 398, 466)
+RIGHT_EYE = (7, 33, 133, 144, 145, 153, 154, 155, 157, 158, 159, 160, 161, 163, 173, 246)
+LEFT_IRIS = (474, 475, 476, 477)
+RIGHT_IRIS = (469, 470, 471, 472)
+LIPS = (0, 13, 14, 17, 37, 39, 40, 61, 78, 80, 81, 82, 84, 87, 88, 91, 95, 146, 178, 181, 185, 191,
+        267, 269, 270, 291, 308, 310, 311, 312, 314, 317, 318, 321, 324, 375, 402, 405, 409, 415)
+
+SUBSETS = {
+    'eyes': LEFT_EYE + RIGHT_EYE,
+    'iris': LEFT_IRIS + RIGHT_IRIS,
+    'mouth': LIPS,
+}
+
+ENCODINGS = ('json', 'f32', 'f16', 'i16')
+I16_SCALE = 16384.0
+
+# One serialized NormalizedLandmark with x, y, z set:
+#   0x0a <len=15> 0x0d <x:f32> 0x15 <y:f32> 0x1d <z:f32>
+_WIRE = np.dtype([
+    ('tag', 'u1'), ('len', 'u1'),
+    ('tx', 'u1'), ('x', '<f4'),
+    ('ty', 'u1'), ('y', '<f4'),
+    ('tz', 'u1'), ('z', '<f4'),
+])
+
+
+def face_array(face):
+    """(landmarks, 3) float32 array from one NormalizedLandmarkList."""
+    buf = face.SerializeToString()
+    if len(buf) % _WIRE.itemsize == 0:
+        rec = np.frombuffer(buf, dtype=_WIRE)
+        if (
+            (rec['tag'] == 0x0A).all() and (rec['len'] == 0x0F).all()
+            and (rec['tx'] == 0x0D).all() and (rec['ty'] == 0x15).all() and (rec['tz'] == 0x1D).all()
+        ):
+            out = np.empty((len(rec), 3), dtype=np.float32)
+            out[:, 0] = rec['x']
+            out[:, 1] = rec['y']
+            out[:, 2] = rec['z']
+            return out
+    # Unexpected layout (e.g. visibility/presence set): read fields one by one
+    return np.array([(lm.x, lm.y, lm.z) for lm in face.landmark], dtype=np.float32).reshape(-1, 3)
+
+
+def landmarks_array(results):
+    """Return MediaPipe FaceMesh results as a float32 array shaped (faces, landmarks, 3)."""
+    faces = getattr(results, 'multi_face_landmarks', None) if results is not None else None
+    if not faces:
+        return np.zeros((0, N_LANDMARKS, 3), dtype=np.float32)
+    return np.stack([face_array(face) for face in faces])
+
+
+def subset_indices(names):
+    """Sorted landmark indices for a comma-separated or iterable list of subset names."""
+    if isinstance(names, str):
+        names = [n.strip().lower() for n in names.split(',') if n.strip()]
+    unknown = [n for n in names if n not in SUBSETS]
+    if unknown:
+        raise ValueError(f'unknown landmark subset(s): {", ".join(unknown)}')
+    return np.array(sorted({i for n in names for i in SUBSETS[n]}), dtype=np.intp)
+
+
+def pack(points, encoding):
+    """Pack a (n, 3) float array into little-endian bytes for `encoding` (f32, f16 or i16)."""
+    if encoding == 'f32':
+        return np.ascontiguousarray(points, dtype='<f4').tobytes()
+    if encoding == 'f16':
+        return np.ascontiguousarray(points, dtype='<f2').tobytes()
+    if encoding == 'i16':
+        q = np.clip(np.rint(np.asarray(points, dtype=np.float32) * I16_SCALE), -32768, 32767)
+        return q.astype('<i2').tobytes()
+    raise ValueError(f'unsupported packed encoding {encoding!r}')
+
+
+def to_dicts(points):
+    """The default JSON shape: a list of {'x', 'y', 'z'} dicts."""
+    return [{'x': x, 'y': y, 'z': z} for x, y, z in points.tolist()]
+
+
+def encode_json(points, encoding='json', indices=None):
+    """JSON-ready landmark fields for one face; packed encodings are base64 strings."""
+    if indices is not None and points is not None:
+        points = points[indices]
+    fields = {}
+    if encoding == 'json':
+        fields['landmarks'] = to_dicts(points) if points is not None else []
+    else:
+        n = 0 if points is None else len(points)
+        fields['landmarks'] = base64.b64encode(pack(points, encoding)).decode('ascii') if n else ''
+        fields['landmarks_encoding'] = encoding
+        fields['landmarks_shape'] = [n, 3]
+        if encoding == 'i16':
+            fields['landmarks_scale'] = I16_SCALE
+    if indices is not None:
+        fields['landmark_indices'] = indices.tolist()
+    return fields
@@ -0,0 +1,210 @@
+"""
+Bucketed storage for per-session metric samples.
+
+Samples are not pushed onto the session document any more. Each one is
+appended to a bucket document covering `bucket_seconds` of one session, with
+the values stored column-wise:
+
+    {'sessionId', 'bucket': <epoch // bucket_seconds>, 'start', 'end', 'count',
+     'timestamps': [t0, t1, ...],
+     'values': {'attentionPercent': [...], 'ear': [...], ...}}
+
+Every column has one entry per timestamp (None where a sample lacked the
+field). The session document only carries running aggregates under
+`metrics_summary`: per field n, sum, sum of squares, min, max and a quantile
+sketch. Both are single upserts whose size does not depend on how long the
+session has been running, so a report can read its statistics in O(1).
+
+The sketch is a log-bucketed histogram (as in DDSketch): a value v > 0 is
+counted in bin ceil(log_gamma(v)) with gamma = (1 + a) / (1 - a), so any
+quantile is returned within relative error `a` (SKETCH_ALPHA). Bins are
+plain counters, which MongoDB can `$inc` atomically from any worker, and the
+number of bins grows only with the log of the value range.
+
+The functions here build the Mongo filter/update documents; callers send them
+directly or through the write-behind queue.
+"""
+import math
+from datetime import timezone, datetime
+
+BUCKETS_COLLECTION = 'metrics_buckets'
+
+# Numeric fields kept column-wise (the keys the app posts, plus server-side extras)
+METRIC_FIELDS = (
+    'attentionPercent', 'drowsinessPercent', 'blinkRate', 'blinkCount',
+    'faceAreaPercent', 'ear', 'landmarkCount',
+)
+
+
+# Report keys -> stored metric fields
+REPORT_FIELDS = {
+    'attention': 'attentionPercent',
+    'drowsiness': 'drowsinessPercent',
+    'blink_rate': 'blinkRate',
+    'face_area': 'faceAreaPercent',
+    'ear': 'ear',
+}
+
+SKETCH_ALPHA = 0.01
+SKETCH_GAMMA = (1 + SKETCH_ALPHA) / (1 - SKETCH_ALPHA)
+SKETCH_LOG_GAMMA = math.log(SKETCH_GAMMA)
+# Values at or below this (zeros, and negatives, which no stored metric has) share one bin
+SKETCH_MIN_VALUE = 1e-9
+SKETCH_ZERO_BIN = 'z'
+
+
+def sketch_bin(v):
+    """Sketch bin name for value `v`."""
+    if v <= SKETCH_MIN_VALUE:
+        return SKETCH_ZERO_BIN
+    return str(math.ceil(math.log(v) / SKETCH_LOG_GAMMA))
+
+
+def sketch_quantile(bins, q):
+    """Approximate `q` quantile (0..1) from a {bin name: count} sketch, or None if empty."""
+    if not bins:
+        return None
+    ordered = sorted(bins.items(), key=lambda kv: -math.inf if kv[0] == SKETCH_ZERO_BIN else int(kv[0]))
+    total = sum(c for _, c in ordered)
+    if total <= 0:
+        return None
+    rank = q * (total - 1)
+    seen = 0
+    for name, count in ordered:
+        seen += count
+        if seen > rank:
+            if name == SKETCH_ZERO_BIN:
+                return 0.0
+            k = int(name)
+            # Midpoint of the bin (gamma^(k-1), gamma^k] in relative terms
+            return 2.0 * SKETCH_GAMMA ** k / (SKETCH_GAMMA + 1)
+    return None
+
+
+def sample_values(data):
+    """Numeric METRIC_FIELDS of a posted metrics dict, as floats."""
+    values = {}
+    if not isinstance(data, dict):
+        return values
+    for field in METRIC_FIELDS:
+        v = data.get(field)
+        if isinstance(v, bool) or v is None:
+            continue
+        try:
+            values[field] = float(v)
+        except (TypeError, ValueError):
+            continue
+    return values
+
+
+def bucket_number(timestamp, bucket_seconds):
+    return int(timestamp.timestamp() // bucket_seconds)
+
+
+def bucket_update(session_id, timestamp, values, bucket_seconds=60):
+    """(filter, update) appending one sample to its session/time bucket (upsert)."""
+    n = bucket_number(timestamp, bucket_seconds)
+    push = {'timestamps': timestamp}
+    for field in METRIC_FIELDS:
+        push[f'values.{field}'] = values.get(field)
+    update = {
+        '$setOnInsert': {'start': datetime.fromtimestamp(n * bucket_seconds, timezone.utc)},
+        '$max': {'end': timestamp},
+        '$inc': {'count': 1},
+        '$push': push,
+    }
+    return {'sessionId': session_id, 'bucket': n}, update
+
+
+def summary_update(session_id, timestamp, values):
+    """Update for the session document: running count/sum/sumsq/min/max and sketch per field."""
+    inc = {'metrics_summary.count': 1}
+    mins = {}
+    maxs = {}
+    for field, v in values.items():
+        inc[f'metrics_summary.fields.{field}.n'] = 1
+        inc[f'metrics_summary.fields.{field}.sum'] = v
+        inc[f'metrics_summary.fields.{field}.sumsq'] = v * v
+        inc[f'metrics_summary.fields.{field}.sketch.{sketch_bin(v)}'] = 1
+        mins[f'metrics_summary.fields.{field}.min'] = v
+        maxs[f'metrics_summary.fields.{field}.max'] = v
+    update = {
+        '$set': {'last_activity': timestamp, 'sessionId': session_id},
+        '$inc': inc,
+        '$max': dict(maxs, **{'metrics_summary.last': timestamp}),
+        '$min': dict(mins, **{'metrics_summary.first': timestamp}),
+    }
+    return update
+
+
+def iter_bucket_samples(buckets):
+    """Yield legacy-shaped {'timestamp', 'metrics'} samples from bucket documents, in order."""
+    for doc in buckets:
+        columns = doc.get('values') or {}
+        for i, ts in enumerate(doc.get('timestamps') or []):
+            metrics = {}
+            for field, col in columns.items():
+                if i < len(col) and col[i] is not None:
+                    metrics[field] = col[i]
+            yield {'timestamp': ts, 'metrics': metrics}
+
+
+def field_stats(rollup):
+    """count/mean/std/min/max/p50/p90/p95 from one field's running aggregates."""
+    n = (rollup or {}).get('n') or 0
+    if n <= 0:
+        return {'count': 0, 'mean': None, 'std': None, 'min': None, 'max': None, 'p50': None, 'p90': None, 'p95': None}
+    mean = rollup['sum'] / n
+    # Population variance; clamp tiny negatives from float cancellation
+    var = max(0.0, rollup.get('sumsq', 0.0) / n - mean * mean)
+    sketch = rollup.get('sketch') or {}
+    return {
+        'count': n,
+        'mean': mean,
+        'std': math.sqrt(var),
+        'min': rollup.get('min'),
+        'max': rollup.get('max'),
+        'p50': sketch_quantile(sketch, 0.50),
+        'p90': sketch_quantile(sketch, 0.90),
+        'p95': sketch_quantile(sketch, 0.95),
+    }
+
+
+def rollup_report_stats(summary):
+    """Per report key statistics from a session's `metrics_summary`."""
+    fields = (summary or {}).get('fields') or {}
+    return {key: field_stats(fields.get(field)) for key, field in REPORT_FIELDS.items()}
+
+
+def strided_samples_pipeline(session_id, stride):
+    """Aggregation returning every `stride`-th sample of each bucket, columns aligned.
+
+    The striding happens inside MongoDB, so only the downsampled series is sent.
+    """
+    def every(path):
+        return {'$map': {
+            'input': {'$range': [0, {'$size': '$timestamps'}, stride]},
+            'as': 'i',
+            'in': {'$arrayElemAt': [path, '$$i']},
+        }}
+    project = {
+        '_id': 0,
+        'timestamps': every('$timestamps'),
+        'values': {field: every(f'$values.{field}') for field in METRIC_FIELDS},
+    }
+    return [
+        {'$match': {'sessionId': session_id}},
+        {'$sort': {'bucket': 1}},
+        {'$project': project},
+    ]
+
+
+def downsample(points, max_points):
+    """Evenly strided subset of at most `max_points` items (always keeps the last one)."""
+    n = len(points)
+    if max_points <= 0 or n <= max_points:
+        return list(points)
+    step = n / float(max_points)
+    picked = [points[int(i * step)] for i in range(max_points - 1)]
+    picked.append(points[-1])
+    return picked
@@ -0,0 +1,155 @@
+"""
+Frame preprocessing before landmark inference.
+
+Two cheap reductions keep large phone uploads from dominating decode and
+inference time:
+
+* reduce-on-load: JPEGs are decoded at 1/2, 1/4 or 1/8 scale via
+  `Image.draft`, other formats are box-reduced by an integer factor, so the
+  long edge lands between half the target and the target without a costly
+  resample. Landmarks are normalized to the image size, so the output
+  coordinates do not change.
+* ROI cropping: when the previous frame's face box is known, inference runs
+  on that box plus a margin and the landmarks are mapped back to full-frame
+  normalized coordinates. If no face is found in the crop the full frame is
+  retried.
+
+Uncompressed camera frames (RGB or Android NV21) arrive as `RawFrame` and are
+wrapped with `np.frombuffer` instead of going through an image decoder.
+"""
+import io
+import math
+
+import numpy as np
+from PIL import Image
+
+
+# Bytes per pixel of each supported raw layout
+RAW_FORMATS = {'rgb': 3.0, 'nv21': 1.5}
+
+
+class RawFrame:
+    """Uncompressed frame: `data` is a bytes-like buffer laid out as `fmt` ('rgb' or 'nv21')."""
+
+    __slots__ = ('data', 'fmt', 'width', 'height')
+
+    def __init__(self, data, fmt, width, height):
+        fmt = fmt.lower()
+        if fmt not in RAW_FORMATS:
+            raise ValueError(f'unsupported raw frame format {fmt!r}')
+        if width <= 0 or height <= 0:
+            raise ValueError('raw frame width and height must be positive')
+        if fmt == 'nv21' and (width % 2 or height % 2):
+            raise ValueError('nv21 frames need even width and height')
+        expected = int(width * height * RAW_FORMATS[fmt])
+        if len(data) != expected:
+            raise ValueError(f'{fmt} frame of {width}x{height} needs {expected} bytes, got {len(data)}')
+        self.data = data
+        self.fmt = fmt
+        self.width = width
+        self.height = height
+
+    def __len__(self):
+        return len(self.data)
+
+
+def _raw_to_rgb(frame, max_long_edge=0):
+    step = math.ceil(max(frame.width, frame.height) / max_long_edge) if max_long_edge else 1
+    step = max(1, step)
+    w, h = frame.width, frame.height
+    buf = np.frombuffer(frame.data, dtype=np.uint8)
+    if frame.fmt == 'rgb':
+        rgb = buf.reshape(h, w, 3)
+        # Strided view for downscaling; only the (smaller) result is copied
+        return rgb[::step, ::step] if step > 1 else rgb
+
+    # NV21: full-res Y plane followed by interleaved V/U at half resolution (BT.601 full range)
+    y = buf[:w * h].reshape(h, w)[::step, ::step].astype(np.float32)
+    vu = buf[w * h:].reshape(h // 2, w // 2, 2)
+    rows = np.arange(0, h, step) // 2
+    cols = np.arange(0, w, step) // 2
+    vu = vu[rows[:, None], cols[None, :]].astype(np.float32) - 128.0
+    v, u = vu[..., 0], vu[..., 1]
+    rgb = np.empty(y.shape + (3,), dtype=np.float32)
+    rgb[..., 0] = y + 1.402 * v
+    rgb[..., 1] = y - 0.344136 * u - 0.714136 * v
+    rgb[..., 2] = y + 1.772 * u
+    return np.clip(rgb, 0, 255, out=rgb).astype(np.uint8)
+
+
+def decode_image(img_bytes, max_long_edge=0):
+    """Decode encoded image bytes (or a RawFrame) to an RGB uint8 array, at most `max_long_edge` px on the long side."""
+    if isinstance(img_bytes, RawFrame):
+        return np.ascontiguousarray(_raw_to_rgb(img_bytes, max_long_edge))
+    image = Image.open(io.BytesIO(img_bytes))
+    if max_long_edge and max(image.size) > max_long_edge:
+        # JPEG only: draft picks the strongest DCT scale still >= the requested
+        # size, so asking for half the target lands in [target/2, target]
+        scale = max_long_edge / 2.0 / max(image.size)
+        image.draft('RGB', (math.ceil(image.size[0] * scale), math.ceil(image.size[1] * scale)))
+    image = image.convert('RGB')
+    if max_long_edge and max(image.size) > max_long_edge:
+        image = image.reduce(math.ceil(max(image.size) / max_long_edge))
+    return np.asarray(image)
+
+
+def landmark_bbox(faces):
+    """Normalized (min_x, min_y, max_x, max_y) of the first face, or None."""
+    if faces is None or len(faces) == 0:
+        return None
+    xy = faces[0][:, :2]
+    lo = xy.min(axis=0)
+    hi = xy.max(axis=0)
+    return (float(lo[0]), float(lo[1]), float(hi[0]), float(hi[1]))
+
+
+def roi_box(bbox, width, height, margin=0.5, max_fraction=0.6):
+    """Pixel crop box (left, top, right, bottom) around a normalized bbox.
+
+    The box is grown by `margin` times the face size on every side. Returns
+    None when the box is degenerate or would cover more than `max_fraction` of
+    the frame (cropping would not save enough to be worth it).
+    """
+    if not bbox:
+        return None
+    x0, y0, x1, y1 = bbox
+    bw, bh = x1 - x0, y1 - y0
+    if bw <= 0 or bh <= 0:
+        return None
+    left = max(0, int((x0 - bw * margin) * width))
+    top = max(0, int((y0 - bh * margin) * height))
+    right = min(width, int(np.ceil((x1 + bw * margin) * width)))
+    bottom = min(height, int(np.ceil((y1 + bh * margin) * height)))
+    if right - left < 16 or bottom - top < 16:
+        return None
+    if (right - left) * (bottom - top) > max_fraction * width * height:
+        return None
+    return (left, top, right, bottom)
+
+
+def uncrop_landmarks(faces, box, width, height):
+    """Map landmarks normalized to crop `box` back to full-frame normalized coordinates, in place."""
+    left, top, right, bottom = box
+    cw, ch = right - left, bottom - top
+    faces[..., 0] = (faces[..., 0] * cw + left) / width
+    faces[..., 1] = (faces[..., 1] * ch + top) / height
+    # MediaPipe z shares the x (width) scale
+    faces[..., 2] = faces[..., 2] * (cw / width)
+    return faces
+
+
+def detect_landmarks(infer, img_np, roi=None, margin=0.5, min_faces=1):
+    """Run `infer(rgb_array) -> (faces, 478, 3) array`, trying the ROI crop first.
+
+    The crop is kept when it holds at least `min_faces` faces (the faces
+    tracked so far), otherwise the full frame is run. Returns landmarks in
+    full-frame normalized coordinates.
+    """
+    height, width = img_np.shape[:2]
+    box = roi_box(roi, width, height, margin=margin)
+    if box is not None:
+        left, top, right, bottom = box
+        faces = infer(np.ascontiguousarray(img_np[top:bottom, left:right]))
+        if len(faces) >= max(1, min_faces):
+            return uncrop_landmarks(faces, box, width, height)
+    return infer(img_np)
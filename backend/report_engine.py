@@ -0,0 +1,316 @@
+"""
+Report statistics for sessions without ingest-time rollups.
+
+Sessions recorded before rollups (see metrics_store.py) keep one document per
+metric sample, and sessions run without MongoDB keep their samples in memory.
+Both are summarized here by a backend with the same output:
+
+    {'count': <samples>,
+     'stats': {report key: metrics_store.field_stats(...)},
+     'series': [{'timestamp': <UTC datetime>, 'metrics': {field: mean}}, ...]}
+
+`MongoReportBackend` pushes the work into one aggregation round-trip: a
+`$facet` with a `$group` for count/sum/sum of squares/min/max, one `$group`
+per field building the same quantile sketch as the rollups, and a
+`$bucketAuto` on the timestamp for the downsampled series.
+`MemoryReportBackend` keeps samples in growable NumPy columns and computes the
+same result with the same bucketing rules. Every float in the output is
+rounded to 12 significant digits, so the last-bit differences between
+NumPy's pairwise sums and MongoDB's double-double `$sum`/`$avg` do not show.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+import metrics_store
+from metrics_store import REPORT_FIELDS
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _utc(ts):
+    """BSON datetimes come back naive (UTC); make them aware like the in-memory ones."""
+    if isinstance(ts, datetime) and ts.tzinfo is None:
+        return ts.replace(tzinfo=timezone.utc)
+    return ts
+
+
+def _ms_to_datetime(ms):
+    return _EPOCH + timedelta(milliseconds=int(ms))
+
+
+def _datetime_to_ms(ts):
+    # BSON datetimes have millisecond precision; store the same in memory
+    return (_utc(ts) - _EPOCH) // timedelta(milliseconds=1)
+
+
+def _round(x):
+    return None if x is None else float(f'{x:.12g}')
+
+
+def _stats(n, total, sumsq, lo, hi, sketch):
+    if not n:
+        return metrics_store.field_stats(None)
+    stats = metrics_store.field_stats({
+        'n': int(n), 'sum': float(total), 'sumsq': float(sumsq),
+        'min': float(lo), 'max': float(hi), 'sketch': sketch,
+    })
+    return {k: (v if k == 'count' else _round(v)) for k, v in stats.items()}
+
+
+def bucket_auto_bounds(sorted_keys, buckets):
+    """(start, end) index ranges of `$bucketAuto` over already sorted keys.
+
+    Same rules as MongoDB: each bucket takes round(n / buckets) documents,
+    then any further documents equal to its last key; the last bucket takes
+    everything left.
+    """
+    n = len(sorted_keys)
+    if n == 0:
+        return []
+    # std::round (half away from zero), not Python's banker's rounding
+    size = max(1, int(math.floor(n / buckets + 0.5)))
+    bounds = []
+    i = 0
+    for b in range(buckets):
+        if i >= n:
+            break
+        if b == buckets - 1:
+            j = n
+        else:
+            j = min(n, i + size)
+            while j < n and sorted_keys[j] == sorted_keys[j - 1]:
+                j += 1
+        bounds.append((i, j))
+        i = j
+    return bounds
+
+
+def summarize_columns(ts_ms, columns, max_points):
+    """Report data from int64 epoch-ms timestamps and {field: float64 array} (NaN = missing)."""
+    ts_ms = np.asarray(ts_ms, dtype=np.int64)
+    order = np.argsort(ts_ms, kind='stable')
+    ts_ms = ts_ms[order]
+    columns = {field: np.asarray(col, dtype=np.float64)[order] for field, col in columns.items()}
+    n = len(ts_ms)
+
+    stats = {}
+    for key, field in REPORT_FIELDS.items():
+        col = columns.get(field)
+        v = col[~np.isnan(col)] if col is not None else np.empty(0)
+        if not len(v):
+            stats[key] = _stats(0, 0, 0, None, None, None)
+            continue
+        zero = v <= metrics_store.SKETCH_MIN_VALUE
+        sketch = {}
+        if zero.any():
+            sketch[metrics_store.SKETCH_ZERO_BIN] = int(zero.sum())
+        bins, counts = np.unique(np.ceil(np.log(v[~zero]) / metrics_store.SKETCH_LOG_GAMMA).astype(np.int64), return_counts=True)
+        sketch.update((str(b), int(c)) for b, c in zip(bins.tolist(), counts.tolist()))
+        stats[key] = _stats(len(v), v.sum(), np.dot(v, v), v.min(), v.max(), sketch)
+
+    bounds = bucket_auto_bounds(ts_ms, max_points)
+    if not bounds:
+        return {'count': n, 'stats': stats, 'series': []}
+    starts = np.array([start for start, _ in bounds])
+    means = {}
+    for field, col in columns.items():
+        present = ~np.isnan(col)
+        counts = np.add.reduceat(present, starts)
+        sums = np.add.reduceat(np.where(present, col, 0.0), starts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means[field] = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan).tolist()
+    series = []
+    for i, start in enumerate(starts.tolist()):
+        metrics = {field: _round(m[i]) for field, m in means.items() if m[i] == m[i]}
+        series.append({'timestamp': _ms_to_datetime(ts_ms[start]), 'metrics': metrics})
+    return {'count': n, 'stats': stats, 'series': series}
+
+
+class MongoReportBackend:
+    """Report data for per-sample metric documents, computed by one aggregation."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    @staticmethod
+    def pipeline(session_id, max_points):
+        fields = list(REPORT_FIELDS.values())
+        project = {'_id': 0, 'timestamp': 1}
+        for field in fields:
+            # Samples nest values under 'metrics'; very old ones had them top-level
+            project[field] = {'$let': {
+                'vars': {'v': {'$ifNull': [f'$metrics.{field}', f'${field}']}},
+                'in': {'$cond': [{'$isNumber': '$$v'}, '$$v', None]},
+            }}
+        group = {'_id': None, 'count': {'$sum': 1}}
+        for field in fields:
+            group[f'{field}_n'] = {'$sum': {'$cond': [{'$isNumber': f'${field}'}, 1, 0]}}
+            group[f'{field}_sum'] = {'$sum': f'${field}'}
+            group[f'{field}_sumsq'] = {'$sum': {'$multiply': [f'${field}', f'${field}']}}
+            group[f'{field}_min'] = {'$min': f'${field}'}
+            group[f'{field}_max'] = {'$max': f'${field}'}
+        facets = {
+            'summary': [{'$group': group}],
+            'series': [{'$bucketAuto': {
+                'groupBy': '$timestamp',
+                'buckets': max(1, int(max_points)),
+                'output': dict({'timestamp': {'$min': '$timestamp'}}, **{f: {'$avg': f'${f}'} for f in fields}),
+            }}],
+        }
+        for field in fields:
+            facets[f'sketch_{field}'] = [
+                {'$match': {field: {'$ne': None}}},
+                {'$group': {
+                    '_id': {'$cond': [
+                        {'$lte': [f'${field}', metrics_store.SKETCH_MIN_VALUE]},
+                        metrics_store.SKETCH_ZERO_BIN,
+                        {'$toString': {'$toLong': {'$ceil': {'$divide': [{'$ln': f'${field}'}, metrics_store.SKETCH_LOG_GAMMA]}}}},
+                    ]},
+                    'count': {'$sum': 1},
+                }},
+            ]
+        return [
+            {'$match': {'sessionId': session_id}},
+            {'$project': project},
+            {'$facet': facets},
+        ]
+
+    def report_data(self, session_id, max_points):
+        return self.parse(next(iter(self.collection.aggregate(self.pipeline(session_id, max_points))), None))
+
+    async def areport_data(self, session_id, max_points):
+        """report_data on an async (motor) collection."""
+        return self.parse(next(iter(await self.collection.aggregate(self.pipeline(session_id, max_points)).to_list(1)), None))
+
+    @staticmethod
+    def parse(result):
+        """Report data from the pipeline's single result document."""
+        result = result or {}
+        summary = (result.get('summary') or [{}])[0]
+        stats = {}
+        for key, field in REPORT_FIELDS.items():
+            sketch = {doc['_id']: int(doc['count']) for doc in result.get(f'sketch_{field}') or []}
+            stats[key] = _stats(
+                summary.get(f'{field}_n', 0), summary.get(f'{field}_sum'), summary.get(f'{field}_sumsq'),
+                summary.get(f'{field}_min'), summary.get(f'{field}_max'), sketch,
+            )
+        series = []
+        for point in result.get('series') or []:
+            metrics = {f: _round(float(point[f])) for f in REPORT_FIELDS.values() if point.get(f) is not None}
+            series.append({'timestamp': _utc(point.get('timestamp')), 'metrics': metrics})
+        return {'count': int(summary.get('count', 0)), 'stats': stats, 'series': series}
+
+
+class _Columns:
+    __slots__ = ('ts', 'cols', 'n', 'touched')
+
+    def __init__(self, capacity=256):
+        self.ts = np.empty(capacity, dtype=np.int64)
+        self.cols = {field: np.full(capacity, np.nan) for field in REPORT_FIELDS.values()}
+        self.n = 0
+        self.touched = time.monotonic()
+
+    @property
+    def nbytes(self):
+        return self.ts.nbytes + sum(col.nbytes for col in self.cols.values())
+
+
+class MemoryReportBackend:
+    """Per-session metric samples in NumPy columns, for running without MongoDB.
+
+    At most `max_samples` are kept per session; past that the oldest half is
+    discarded. Whole sessions are dropped least recently used first past
+    `max_sessions` or `max_bytes` of columns, and when not added to or
+    reported on for `idle_ttl` seconds (0 keeps them).
+    """
+
+    def __init__(self, max_samples=100000, max_sessions=10000, idle_ttl=3600.0, max_bytes=256 * 1024 * 1024):
+        self.max_samples = max(2, int(max_samples))
+        self.max_sessions = max(1, int(max_sessions))
+        self.idle_ttl = float(idle_ttl)
+        self.max_bytes = int(max_bytes)
+        self._sessions = OrderedDict()
+        self._bytes = 0
+        self._evicted = 0
+        self._lock = threading.Lock()
+
+    def _touch_locked(self, session_id, data, now):
+        data.touched = now
+        self._sessions.move_to_end(session_id)
+
+    def _evict_locked(self, now):
+        # Touched sessions move to the end, so idle ones collect at the front
+        while self._sessions:
+            session_id, data = next(iter(self._sessions.items()))
+            idle = self.idle_ttl > 0 and now - data.touched >= self.idle_ttl
+            # Keep at least the newest session even if it alone is over budget
+            over = len(self._sessions) > self.max_sessions or (self._bytes > self.max_bytes and len(self._sessions) > 1)
+            if not (idle or over):
+                break
+            self._drop_locked(session_id)
+            self._evicted += 1
+
+    def _drop_locked(self, session_id):
+        data = self._sessions.pop(session_id, None)
+        if data is not None:
+            self._bytes -= data.nbytes
+
+    def add(self, session_id, timestamp, values):
+        """Append one sample; `values` maps metric fields to floats (see metrics_store.sample_values)."""
+        now = time.monotonic()
+        with self._lock:
+            data = self._sessions.get(session_id)
+            if data is None:
+                data = self._sessions[session_id] = _Columns()
+                self._bytes += data.nbytes
+            self._touch_locked(session_id, data, now)
+            if data.n == self.max_samples:
+                keep = self.max_samples // 2
+                data.ts[:keep] = data.ts[data.n - keep:data.n]
+                for col in data.cols.values():
+                    col[:keep] = col[data.n - keep:data.n]
+                    col[keep:] = np.nan
+                data.n = keep
+            if data.n == len(data.ts):
+                grow = min(self.max_samples, 2 * len(data.ts))
+                self._bytes -= data.nbytes
+                data.ts = np.resize(data.ts, grow)
+                for field, col in data.cols.items():
+                    bigger = np.full(grow, np.nan)
+                    bigger[:data.n] = col[:data.n]
+                    data.cols[field] = bigger
+                self._bytes += data.nbytes
+            i = data.n
+            data.ts[i] = _datetime_to_ms(timestamp)
+            for field, col in data.cols.items():
+                v = values.get(field)
+                col[i] = np.nan if v is None else v
+            data.n += 1
+            self._evict_locked(now)
+
+    def discard(self, session_id):
+        with self._lock:
+            self._drop_locked(session_id)
+
+    def stats(self):
+        with self._lock:
+            return {'sessions': len(self._sessions), 'bytes': self._bytes, 'evicted': self._evicted,
+                    'max_sessions': self.max_sessions, 'max_bytes': self.max_bytes}
+
+    def report_data(self, session_id, max_points):
+        now = time.monotonic()
+        with self._lock:
+            self._evict_locked(now)
+            data = self._sessions.get(session_id)
+            if data is not None:
+                self._touch_locked(session_id, data, now)
+            if data is None:
+                return {'count': 0, 'stats': {key: _stats(0, 0, 0, None, None, None) for key in REPORT_FIELDS}, 'series': []}
+            ts = data.ts[:data.n].copy()
+            cols = {field: col[:data.n].copy() for field, col in data.cols.items()}
+        return summarize_columns(ts, cols, max_points)
@@ -4,17 +4,21 @@ Usage:
     python run_server.py
 """
 import os
-from app import app
 
-port = int(os.environ.get('APP_PORT') or os.environ.get('PORT') or 5000)
-host = '0.0.0.0'
+# Guarded so spawned inference workers (INFERENCE_ENGINE=process on Windows)
+# can re-import this module without starting another server.
+if __name__ == '__main__':
+    from app import app
 
-try:
-    # Prefer waitress for local and Windows environments
-    from waitress import serve
-    print(f"Starting server with Waitress on {host}:{port}")
-    serve(app, host=host, port=port)
-except Exception as e:
-    # Fallback to Flask built-in (not recommended for production)
-    print(f"Waitress not available or failed to start ({e}), falling back to Flask dev server")
-    app.run(host=host, port=port, debug=False)
+    port = int(os.environ.get('APP_PORT') or os.environ.get('PORT') or 5000)
+    host = '0.0.0.0'
+
+    try:
+        # Prefer waitress for local and Windows environments
+        from waitress import serve
+        print(f"Starting server with Waitress on {host}:{port}")
+        serve(app, host=host, port=port)
+    except Exception as e:
+        # Fallback to Flask built-in (not recommended for production)
+        print(f"Waitress not available or failed to start ({e}), falling back to Flask dev server")
+        app.run(host=host, port=port, debug=False)
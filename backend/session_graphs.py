@@ -0,0 +1,199 @@
+"""
+Session-affine cache of tracking-mode FaceMesh graphs.
+
+With static_image_mode=False a FaceMesh graph only runs face detection on the
+first frame and then tracks landmarks from frame to frame, which is much
+cheaper for a client streaming one camera. Tracking state belongs to a single
+stream, so each active session gets its own graph. The cache is LRU with an
+idle TTL and a hard cap on the number of graphs, so memory stays bounded no
+matter how many sessions are open. Graphs being built, and graphs dropped
+while a frame is still using them, count toward the cap.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from facemesh_pool import PoolTimeout
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ('mesh', 'lock', 'last_used', 'busy', 'evicted')
+
+    def __init__(self, mesh):
+        self.mesh = mesh
+        # Frames of one session must reach its graph in order, one at a time
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.busy = 0
+        self.evicted = False
+
+
+class SessionGraphCache:
+    """Per-session tracking graphs, at most `max_graphs`, dropped after `idle_ttl` seconds idle.
+
+    `checkout(session_id)` yields the session's graph, or None when the cache
+    is full of busy graphs so the caller can fall back to the shared pool.
+    """
+
+    def __init__(self, factory, max_graphs=8, idle_ttl=120.0, timeout=5.0):
+        self._factory = factory
+        self.max_graphs = max(1, int(max_graphs))
+        self.idle_ttl = float(idle_ttl)
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        # Graphs being built (session id -> Event set when done) and graphs
+        # dropped from the cache but still in use; both hold a slot of the cap
+        self._building = {}
+        self._draining = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'fallbacks': 0, 'evicted_lru': 0, 'evicted_ttl': 0, 'evicted_end': 0}
+
+    @contextmanager
+    def checkout(self, session_id, timeout=None):
+        wait = self.timeout if timeout is None else timeout
+        entry = self._acquire(session_id, wait)
+        if entry is None:
+            yield None
+            return
+        if not entry.lock.acquire(timeout=wait):
+            self._release(session_id, entry, failed=False)
+            raise PoolTimeout(f'tracking graph for session {session_id} busy after {wait:.1f}s')
+        failed = False
+        try:
+            yield entry.mesh
+        except Exception:
+            failed = True
+            raise
+        finally:
+            entry.lock.release()
+            self._release(session_id, entry, failed=failed)
+
+    def _acquire(self, session_id, wait):
+        to_close = []
+        try:
+            while True:
+                with self._lock:
+                    to_close.extend(self._sweep_locked())
+                    entry = self._entries.get(session_id)
+                    if entry is not None:
+                        self._entries.move_to_end(session_id)
+                        entry.busy += 1
+                        self._stats['hits'] += 1
+                        return entry
+                    building = self._building.get(session_id)
+                    if building is None:
+                        if len(self._entries) + len(self._building) + self._draining >= self.max_graphs:
+                            victim = next((sid for sid, e in self._entries.items() if e.busy == 0), None)
+                            if victim is None:
+                                self._stats['fallbacks'] += 1
+                                return None
+                            to_close.append(self._entries.pop(victim).mesh)
+                            self._stats['evicted_lru'] += 1
+                        self._stats['misses'] += 1
+                        # Reserve the slot before building, so concurrent misses cannot pass the cap
+                        building = self._building[session_id] = threading.Event()
+                        break
+                # Another thread is building this session's graph; use it when ready
+                if not building.wait(wait):
+                    with self._lock:
+                        self._stats['fallbacks'] += 1
+                    return None
+
+            # Building a graph is slow; do it without holding the cache lock
+            try:
+                mesh = self._factory()
+            except Exception as e:
+                logger.error(f'Failed to build tracking FaceMesh for session {session_id}: {e}', exc_info=True)
+                with self._lock:
+                    del self._building[session_id]
+                    self._stats['fallbacks'] += 1
+                building.set()
+                return None
+
+            with self._lock:
+                del self._building[session_id]
+                entry = _Entry(mesh)
+                entry.busy = 1
+                self._entries[session_id] = entry
+            building.set()
+            return entry
+        finally:
+            self._close_all(to_close)
+
+    def _retire_locked(self, entry):
+        """Mark a graph dropped from the cache; returns its mesh if it can be closed now."""
+        entry.evicted = True
+        if entry.busy == 0:
+            return entry.mesh
+        # Closed by the last user to release it; holds its slot until then
+        self._draining += 1
+        return None
+
+    def _release(self, session_id, entry, failed):
+        close = None
+        with self._lock:
+            entry.busy -= 1
+            entry.last_used = time.monotonic()
+            if failed and not entry.evicted:
+                # Tracking state may be corrupt after an error; start fresh next frame
+                if self._entries.get(session_id) is entry:
+                    del self._entries[session_id]
+                close = self._retire_locked(entry)
+            elif entry.evicted and entry.busy == 0:
+                self._draining -= 1
+                close = entry.mesh
+        if close is not None:
+            self._close_all([close])
+
+    def _sweep_locked(self):
+        if self.idle_ttl <= 0:
+            return []
+        cutoff = time.monotonic() - self.idle_ttl
+        expired = [sid for sid, e in self._entries.items() if e.busy == 0 and e.last_used < cutoff]
+        meshes = []
+        for sid in expired:
+            meshes.append(self._entries.pop(sid).mesh)
+        self._stats['evicted_ttl'] += len(expired)
+        return meshes
+
+    def evict(self, session_id):
+        """Drop the graph for `session_id` (e.g. when the session ends)."""
+        close = None
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is None:
+                return False
+            self._stats['evicted_end'] += 1
+            close = self._retire_locked(entry)
+        if close is not None:
+            self._close_all([close])
+        return True
+
+    def sweep(self):
+        """Close graphs idle for longer than the TTL; returns how many were dropped."""
+        with self._lock:
+            meshes = self._sweep_locked()
+        self._close_all(meshes)
+        return len(meshes)
+
+    @staticmethod
+    def _close_all(meshes):
+        for mesh in meshes:
+            try:
+                mesh.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out['graphs'] = len(self._entries)
+            out['building'] = len(self._building)
+            out['draining'] = self._draining
+        out['max_graphs'] = self.max_graphs
+        out['idle_ttl'] = self.idle_ttl
+        return out
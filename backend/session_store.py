@@ -0,0 +1,344 @@
+"""
+Bounded in-memory store for session records.
+
+Each worker keeps a small record per session it has seen: status, times,
+metadata, counters, the last face box (for ROI cropping), the last
+detection's summary and the rolling metrics state. Detection payloads are
+not kept; they go to MongoDB. Records are evicted when
+
+  - the store holds `max_sessions` records (least recently used first),
+  - a record has not been touched for `idle_ttl` seconds (`completed_ttl`
+    once the session has ended), or
+  - the estimated size of all records exceeds `max_bytes`. A record's size
+    is estimated when it is stored and again on every recorded frame and
+    on completion, since the metrics state and face tracks grow after the
+    record is created.
+
+An evicted session is reloaded from MongoDB on its next request when
+persistence is configured (see app._hydrate_session).
+
+With a shared `backend` (see shared_sessions.py) the store becomes a
+read-through cache in front of a table every worker process uses: records
+are written through on start, end and every detected frame, and a local
+record older than `cache_ttl` seconds is refreshed from the table, so
+sessions are found, and counted, on whichever worker a request lands.
+"""
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+
+from shared_sessions import SHARED_FIELDS
+
+logger = logging.getLogger(__name__)
+
+# Allowance per record for what the size estimate does not see: locks, the
+# entry itself and allocator overhead
+RECORD_OVERHEAD_BYTES = 1024
+
+# Expired records are found by a full scan (completed records are moved to
+# the front, so expiry is not in LRU order); inserts run it at most this often
+SWEEP_INTERVAL = 1.0
+
+
+def approx_size(obj, _depth=0):
+    """Rough deep size in bytes of plain data (dicts, lists, tuples, deques,
+    scalars) and of objects' attributes, such as the rolling metrics state."""
+    size = sys.getsizeof(obj)
+    if _depth > 4:
+        return size
+    if isinstance(obj, dict):
+        size += sum(approx_size(k, _depth + 1) + approx_size(v, _depth + 1) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(approx_size(v, _depth + 1) for v in obj)
+    elif hasattr(obj, '__dict__') and not isinstance(obj, type):
+        size += approx_size(vars(obj), _depth + 1)
+    return size
+
+
+class _Entry:
+    __slots__ = ('record', 'nbytes', 'expires', 'completed', 'synced')
+
+    def __init__(self, record, nbytes, expires, synced):
+        self.record = record
+        self.nbytes = nbytes
+        self.expires = expires
+        self.completed = False
+        self.synced = synced
+
+
+class SessionStore:
+    """Session records by id, LRU with an idle TTL and a memory budget.
+
+    Supports the dict operations the app uses (`get`, `in`, `[]`, `pop`,
+    `len`). `get` and `[]` count hits and misses and refresh the record's
+    TTL; `in` does neither. `on_evict(session_id, record)` is called, outside
+    the lock, for every record dropped by a limit.
+    """
+
+    def __init__(self, max_sessions=10000, idle_ttl=3600.0, completed_ttl=300.0,
+                 max_bytes=64 * 1024 * 1024, on_evict=None, backend=None, cache_ttl=1.0):
+        self.max_sessions = max(1, int(max_sessions))
+        self.idle_ttl = float(idle_ttl)
+        self.completed_ttl = float(completed_ttl)
+        self.max_bytes = int(max_bytes)
+        self._on_evict = on_evict
+        self.backend = backend
+        self.cache_ttl = float(cache_ttl)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._next_sweep = 0.0
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0, 'misses': 0, 'shared_hits': 0, 'shared_errors': 0,
+            'evicted_lru': 0, 'evicted_ttl': 0, 'evicted_memory': 0,
+        }
+
+    def _ttl(self, entry):
+        return self.completed_ttl if entry.completed else self.idle_ttl
+
+    def _deadline(self, ttl, now):
+        return now + ttl if ttl > 0 else None
+
+    def _expired(self, entry, now):
+        return entry.expires is not None and entry.expires <= now
+
+    def _drop_locked(self, session_id, reason, evicted):
+        entry = self._entries.pop(session_id)
+        self._bytes -= entry.nbytes
+        self._stats[f'evicted_{reason}'] += 1
+        evicted.append((session_id, entry.record))
+
+    def _sweep_locked(self, now, evicted):
+        expired = [sid for sid, entry in self._entries.items() if self._expired(entry, now)]
+        for session_id in expired:
+            self._drop_locked(session_id, 'ttl', evicted)
+        self._next_sweep = now + SWEEP_INTERVAL
+
+    def _trim_locked(self, keep, evicted):
+        """Evict from the front until within the memory budget, sparing `keep`
+        even if it alone is over budget."""
+        while self._bytes > self.max_bytes:
+            victim = next((sid for sid in self._entries if sid != keep), None)
+            if victim is None:
+                break
+            self._drop_locked(victim, 'memory', evicted)
+
+    def _resize(self, session_id, record):
+        """Re-estimate the size of `record` after it changed in place."""
+        nbytes = approx_size(record) + RECORD_OVERHEAD_BYTES
+        evicted = []
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None or entry.record is not record:
+                return
+            self._bytes += nbytes - entry.nbytes
+            entry.nbytes = nbytes
+            self._trim_locked(session_id, evicted)
+        self._notify(evicted)
+
+    def _notify(self, evicted):
+        if self._on_evict is None:
+            return
+        for session_id, record in evicted:
+            try:
+                self._on_evict(session_id, record)
+            except Exception as e:
+                logger.warning(f'Session eviction hook failed for {session_id}: {e}')
+
+    def get(self, session_id, default=None):
+        evicted = []
+        now = time.monotonic()
+        stale = False
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None and self._expired(entry, now):
+                self._drop_locked(session_id, 'ttl', evicted)
+                entry = None
+            if entry is not None and self.backend is not None and now - entry.synced > self.cache_ttl:
+                stale = True
+            elif entry is None:
+                if self.backend is None:
+                    self._stats['misses'] += 1
+            else:
+                self._stats['hits'] += 1
+                entry.expires = self._deadline(self._ttl(entry), now)
+                self._entries.move_to_end(session_id)
+        self._notify(evicted)
+        if entry is not None and not stale:
+            return entry.record
+        if self.backend is None:
+            return default
+        return self._read_through(session_id, entry, default)
+
+    def _read_through(self, session_id, entry, default):
+        try:
+            shared = self.backend.get(session_id)
+        except Exception as e:
+            logger.warning(f'Shared session lookup failed for {session_id}: {e}')
+            with self._lock:
+                self._stats['shared_errors'] += 1
+            # Serve the local copy, stale or not, rather than failing the request
+            return entry.record if entry is not None else default
+        if shared is None:
+            if entry is None:
+                with self._lock:
+                    self._stats['misses'] += 1
+                return default
+            # Dropped from the shared table (expired there, or evicted when
+            # full) while still in use here: share the local copy again
+            with self._lock:
+                self._stats['hits'] += 1
+                entry.synced = time.monotonic()
+            self._put_shared(session_id, entry.record)
+            return entry.record
+        now = time.monotonic()
+        if entry is not None:
+            with self._lock:
+                self._stats['shared_hits'] += 1
+                entry.record.update(shared)
+                entry.synced = now
+                entry.completed = shared.get('status') == 'completed'
+                entry.expires = self._deadline(self._ttl(entry), now)
+                if self._entries.get(session_id) is entry:
+                    self._entries.move_to_end(session_id)
+            return entry.record
+        record = dict(shared, session_id=session_id)
+        with self._lock:
+            self._stats['shared_hits'] += 1
+        self._insert(session_id, record, completed=shared.get('status') == 'completed')
+        return record
+
+    def __getitem__(self, session_id):
+        record = self.get(session_id)
+        if record is None:
+            raise KeyError(session_id)
+        return record
+
+    def __contains__(self, session_id):
+        with self._lock:
+            entry = self._entries.get(session_id)
+            return entry is not None and not self._expired(entry, time.monotonic())
+
+    def __setitem__(self, session_id, record):
+        self._insert(session_id, record)
+        if self.backend is not None:
+            self._put_shared(session_id, record)
+
+    def _put_shared(self, session_id, record):
+        try:
+            self.backend.put(session_id, self._shared(record), self._shared_ttl(record))
+        except Exception as e:
+            logger.warning(f'Failed to share session {session_id}: {e}')
+            with self._lock:
+                self._stats['shared_errors'] += 1
+
+    def _insert(self, session_id, record, completed=False):
+        nbytes = approx_size(record) + RECORD_OVERHEAD_BYTES
+        evicted = []
+        now = time.monotonic()
+        with self._lock:
+            old = self._entries.pop(session_id, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            entry = _Entry(record, nbytes, None, now)
+            entry.completed = completed
+            entry.expires = self._deadline(self._ttl(entry), now)
+            self._entries[session_id] = entry
+            if completed:
+                self._entries.move_to_end(session_id, last=False)
+            self._bytes += nbytes
+            if now >= self._next_sweep:
+                self._sweep_locked(now, evicted)
+            while len(self._entries) > self.max_sessions:
+                self._drop_locked(next(iter(self._entries)), 'lru', evicted)
+            self._trim_locked(session_id, evicted)
+        self._notify(evicted)
+
+    @staticmethod
+    def _shared(record):
+        return {field: record.get(field) for field in SHARED_FIELDS}
+
+    def _shared_ttl(self, record):
+        ttl = self.completed_ttl if record.get('status') == 'completed' else self.idle_ttl
+        # The shared table always expires records; 0 (never) becomes a day
+        return ttl if ttl > 0 else 86400.0
+
+    def record_frame(self, session_id, record, faces):
+        """Account for one processed frame of `record` (already counted locally):
+        re-estimate its size and share the frame with the other workers."""
+        self._resize(session_id, record)
+        if self.backend is None:
+            return
+        fields = {field: record.get(field) for field in ('last_activity', 'last_bbox', 'last_detection', 'face_tracks')}
+        try:
+            if not self.backend.record_frame(session_id, 1, 1 if faces else 0, fields, self._shared_ttl(record)):
+                # Gone from the shared table (expired or evicted): share it again
+                self.backend.put(session_id, self._shared(record), self._shared_ttl(record))
+        except Exception as e:
+            logger.warning(f'Failed to share frame for session {session_id}: {e}')
+            with self._lock:
+                self._stats['shared_errors'] += 1
+
+    def pop(self, session_id, default=None):
+        if self.backend is not None:
+            try:
+                self.backend.delete(session_id)
+            except Exception as e:
+                logger.warning(f'Failed to remove shared session {session_id}: {e}')
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is None:
+                return default
+            self._bytes -= entry.nbytes
+            return entry.record
+
+    def complete(self, session_id):
+        """Mark an ended session: it now expires after `completed_ttl` and is evicted first."""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return False
+            entry.completed = True
+            entry.expires = self._deadline(self.completed_ttl, time.monotonic())
+            self._entries.move_to_end(session_id, last=False)
+            record = entry.record
+        self._resize(session_id, record)
+        if self.backend is not None:
+            fields = {'status': record.get('status'), 'end_time': record.get('end_time')}
+            try:
+                if not self.backend.update(session_id, fields, self._shared_ttl(record)):
+                    self.backend.put(session_id, self._shared(record), self._shared_ttl(record))
+            except Exception as e:
+                logger.warning(f'Failed to share end of session {session_id}: {e}')
+                with self._lock:
+                    self._stats['shared_errors'] += 1
+        return True
+
+    def sweep(self):
+        """Drop expired records; returns how many were dropped."""
+        evicted = []
+        with self._lock:
+            self._sweep_locked(time.monotonic(), evicted)
+        self._notify(evicted)
+        return len(evicted)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out['sessions'] = len(self._entries)
+            out['bytes'] = self._bytes
+        out['max_sessions'] = self.max_sessions
+        out['max_bytes'] = self.max_bytes
+        out['idle_ttl'] = self.idle_ttl
+        if self.backend is not None:
+            try:
+                out['shared'] = self.backend.stats()
+            except Exception as e:
+                out['shared'] = {'error': str(e)}
+        return out
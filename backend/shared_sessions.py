@@ -0,0 +1,406 @@
+"""
+Session records shared between worker processes.
+
+gunicorn runs several workers, each with its own memory. The SessionStore in
+each worker (session_store.py) caches records locally for a short time and
+reads through to one of these tables, so a session started on one worker is
+found by every other worker without a MongoDB round-trip:
+
+  MmapSessionTable   a fixed-size hash table in a memory-mapped file, guarded
+                     by flock; for workers on one host (the default on POSIX)
+  RedisSessionTable  a hash per session on a Redis-protocol server (Redis,
+                     Valkey, KeyDB, ...); for workers spread across hosts
+
+Only the plain fields in SHARED_FIELDS are shared. Per-worker state such as
+the rolling metrics window stays in the local record. Each write sets the
+record's expiry to now + `ttl` (wall-clock), so abandoned sessions disappear
+from the table on their own.
+"""
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from face_tracks import MAX_TRACKS
+
+try:
+    import fcntl
+except Exception:
+    # Windows: run a single process (Waitress) and keep sessions local
+    fcntl = None
+MMAP_AVAILABLE = fcntl is not None
+
+try:
+    import redis
+except Exception:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+SHARED_FIELDS = (
+    'status', 'start_time', 'end_time', 'last_activity', 'metadata',
+    'frames_processed', 'frames_with_face', 'last_bbox', 'last_detection', 'face_tracks',
+)
+
+
+def _epoch(ts):
+    """datetime (naive = UTC) -> epoch seconds, None -> NaN."""
+    if ts is None:
+        return math.nan
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.timestamp()
+
+
+def _datetime(x):
+    return None if x is None or x != x else datetime.fromtimestamp(x, timezone.utc)
+
+
+def _bbox(values):
+    return None if values is None or any(v != v for v in values) else tuple(float(v) for v in values)
+
+
+# Slot layout: state, key, status, start/end/last activity, frame counters,
+# last bbox, last detection (timestamp, faces, area), expiry, metadata length
+_SLOT_HEAD = struct.Struct('<B B 64s 16s d d d Q Q 4f d I d d I')
+# Face tracks (face_tracks.py): next id, primary id (0 = none), count, then
+# MAX_TRACKS entries of id, box, frames missed
+_TRACKS_HEAD = struct.Struct('<I I I')
+_TRACK = struct.Struct('<I 4f I')
+_TRACKS_BYTES = _TRACKS_HEAD.size + MAX_TRACKS * _TRACK.size
+_HEADER = struct.Struct('<8s I I I')
+_MAGIC = b'NVSESS02'
+_EMPTY, _USED, _DELETED = 0, 1, 2
+_MAX_KEY = 64
+
+
+class MmapSessionTable:
+    """Open-addressing hash table of session records in a shared memory-mapped file.
+
+    Every process (and thread) takes an exclusive flock on the file for each
+    operation; an operation only touches one probe window, so this is a few
+    microseconds. When a window of `max_probe` slots is full of live records,
+    the one closest to expiry is evicted.
+    """
+
+    def __init__(self, path, slots=8192, meta_bytes=1024, max_probe=32):
+        if fcntl is None:
+            raise RuntimeError('MmapSessionTable needs fcntl (POSIX)')
+        self.path = path
+        self.slots = max(16, int(slots))
+        self.meta_bytes = max(0, int(meta_bytes))
+        self.max_probe = max(1, min(int(max_probe), self.slots))
+        self.slot_size = _SLOT_HEAD.size + _TRACKS_BYTES + self.meta_bytes
+        self.size = _HEADER.size + self.slots * self.slot_size
+        self._open()
+        # A forked child must not share the parent's open file description,
+        # or flock would no longer exclude between the two
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reopen)
+
+    def _open(self):
+        self._lock = threading.Lock()
+        self._stats = {'evicted': 0, 'oversized_metadata': 0}
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size != self.size:
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, self.size)
+            self._mm = mmap.mmap(self._fd, self.size)
+            magic, slots, slot_size, _ = _HEADER.unpack_from(self._mm, 0)
+            if magic != _MAGIC or slots != self.slots or slot_size != self.slot_size:
+                # New file, or one written with another layout: start empty
+                self._mm[:] = bytes(self.size)
+                _HEADER.pack_into(self._mm, 0, _MAGIC, self.slots, self.slot_size, 0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _reopen(self):
+        try:
+            self._mm.close()
+            os.close(self._fd)
+        except Exception:
+            pass
+        self._open()
+
+    @contextmanager
+    def _locked(self):
+        # flock excludes other processes; threads share the descriptor, so
+        # they also need the thread lock
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _offset(self, i):
+        return _HEADER.size + i * self.slot_size
+
+    def _key(self, session_id):
+        key = session_id.encode('utf-8')
+        if len(key) > _MAX_KEY:
+            raise ValueError(f'session id longer than {_MAX_KEY} bytes')
+        return key
+
+    def _find(self, key, now, for_insert=False):
+        """Slot index holding `key` (None if absent); with `for_insert`, the slot to write it to."""
+        start = zlib.crc32(key) % self.slots
+        free = None
+        victim, victim_expires = None, math.inf
+        for n in range(self.max_probe):
+            i = (start + n) % self.slots
+            off = self._offset(i)
+            state = self._mm[off]
+            if state == _EMPTY:
+                return (free if free is not None else i) if for_insert else None
+            head = _SLOT_HEAD.unpack_from(self._mm, off)
+            expires = head[16]
+            if state == _USED and head[2].rstrip(b'\0') == key:
+                if expires <= now:
+                    return i if for_insert else None
+                return i
+            if state == _DELETED or expires <= now:
+                if free is None:
+                    free = i
+            elif expires < victim_expires:
+                victim, victim_expires = i, expires
+        if not for_insert:
+            return None
+        if free is not None:
+            return free
+        self._stats['evicted'] += 1
+        return victim
+
+    def _read(self, i, with_metadata=True):
+        off = self._offset(i)
+        head = _SLOT_HEAD.unpack_from(self._mm, off)
+        (_, _, _, status, start, end, last, frames, with_face,
+         b0, b1, b2, b3, det_ts, det_faces, det_area, _, meta_len) = head
+        meta = {}
+        if meta_len and with_metadata:
+            body = off + _SLOT_HEAD.size + _TRACKS_BYTES
+            meta = json.loads(bytes(self._mm[body:body + meta_len]).decode('utf-8'))
+        return {
+            'status': status.rstrip(b'\0').decode('ascii') or 'active',
+            'start_time': _datetime(start),
+            'end_time': _datetime(end),
+            'last_activity': _datetime(last),
+            'metadata': meta,
+            'frames_processed': frames,
+            'frames_with_face': with_face,
+            'last_bbox': _bbox((b0, b1, b2, b3)),
+            'last_detection': None if det_ts != det_ts else {
+                'timestamp': _datetime(det_ts), 'faces': det_faces,
+                'face_area_percent': None if det_area != det_area else det_area,
+            },
+            'face_tracks': self._read_tracks(off + _SLOT_HEAD.size),
+        }
+
+    def _read_tracks(self, off):
+        next_id, primary, count = _TRACKS_HEAD.unpack_from(self._mm, off)
+        if not next_id:
+            return None
+        tracks = []
+        for n in range(min(count, MAX_TRACKS)):
+            track_id, x0, y0, x1, y1, missed = _TRACK.unpack_from(self._mm, off + _TRACKS_HEAD.size + n * _TRACK.size)
+            tracks.append([track_id, x0, y0, x1, y1, missed])
+        return {'next_id': next_id, 'primary': primary or None, 'tracks': tracks}
+
+    def _write_tracks(self, off, state):
+        if not state:
+            _TRACKS_HEAD.pack_into(self._mm, off, 0, 0, 0)
+            return
+        tracks = state['tracks'][:MAX_TRACKS]
+        _TRACKS_HEAD.pack_into(self._mm, off, int(state['next_id']), int(state.get('primary') or 0), len(tracks))
+        for n, (track_id, x0, y0, x1, y1, missed) in enumerate(tracks):
+            _TRACK.pack_into(self._mm, off + _TRACKS_HEAD.size + n * _TRACK.size,
+                             int(track_id), x0, y0, x1, y1, int(missed))
+
+    def _write(self, i, key, record, expires, keep_metadata=False):
+        """Write `record` to slot i; `keep_metadata` leaves the stored metadata as it is."""
+        off = self._offset(i)
+        if keep_metadata:
+            meta = None
+            meta_len = _SLOT_HEAD.unpack_from(self._mm, off)[17]
+        else:
+            meta = json.dumps(record.get('metadata') or {}, separators=(',', ':'), default=str).encode('utf-8')
+            if len(meta) > self.meta_bytes:
+                # Other workers see empty metadata; MongoDB keeps the full document
+                self._stats['oversized_metadata'] += 1
+                meta = b''
+            meta_len = len(meta)
+        bbox = record.get('last_bbox') or (math.nan,) * 4
+        det = record.get('last_detection') or {}
+        det_area = det.get('face_area_percent')
+        _SLOT_HEAD.pack_into(
+            self._mm, off, _USED, 0, key,
+            str(record.get('status') or 'active').encode('ascii', 'replace')[:16],
+            _epoch(record.get('start_time')), _epoch(record.get('end_time')), _epoch(record.get('last_activity')),
+            int(record.get('frames_processed') or 0), int(record.get('frames_with_face') or 0),
+            *[float(v) for v in bbox],
+            _epoch(det.get('timestamp')), int(det.get('faces') or 0),
+            math.nan if det_area is None else float(det_area),
+            expires, meta_len,
+        )
+        self._write_tracks(off + _SLOT_HEAD.size, record.get('face_tracks'))
+        if meta is not None:
+            body = off + _SLOT_HEAD.size + _TRACKS_BYTES
+            self._mm[body:body + meta_len] = meta
+
+    def get(self, session_id):
+        key = self._key(session_id)
+        with self._locked():
+            i = self._find(key, time.time())
+            return None if i is None else self._read(i)
+
+    def put(self, session_id, record, ttl):
+        key = self._key(session_id)
+        now = time.time()
+        with self._locked():
+            self._write(self._find(key, now, for_insert=True), key, record, now + ttl)
+
+    def update(self, session_id, fields, ttl):
+        """Set `fields` on an existing record; returns False if there is none."""
+        key = self._key(session_id)
+        now = time.time()
+        with self._locked():
+            i = self._find(key, now)
+            if i is None:
+                return False
+            keep = 'metadata' not in fields
+            record = self._read(i, with_metadata=not keep)
+            record.update(fields)
+            self._write(i, key, record, now + ttl, keep_metadata=keep)
+            return True
+
+    def record_frame(self, session_id, frames, frames_with_face, fields, ttl):
+        """Add to the frame counters and set `fields` (last box/detection/activity)."""
+        key = self._key(session_id)
+        now = time.time()
+        with self._locked():
+            i = self._find(key, now)
+            if i is None:
+                return False
+            # The hot path: leave the metadata alone
+            record = self._read(i, with_metadata=False)
+            record['frames_processed'] += frames
+            record['frames_with_face'] += frames_with_face
+            record.update(fields)
+            self._write(i, key, record, now + ttl, keep_metadata=True)
+            return True
+
+    def delete(self, session_id):
+        key = self._key(session_id)
+        with self._locked():
+            i = self._find(key, time.time())
+            if i is not None:
+                self._mm[self._offset(i)] = _DELETED
+
+    def stats(self):
+        with self._locked():
+            now = time.time()
+            live = 0
+            for i in range(self.slots):
+                off = self._offset(i)
+                if self._mm[off] == _USED and _SLOT_HEAD.unpack_from(self._mm, off)[16] > now:
+                    live += 1
+            return dict(self._stats, backend='mmap', path=self.path, slots=self.slots, sessions=live)
+
+
+class RedisSessionTable:
+    """Session records as Redis hashes (`<prefix><session id>`) with a key TTL."""
+
+    def __init__(self, url, prefix='neurovision:session:', client=None):
+        if client is None:
+            if redis is None:
+                raise RuntimeError('SESSION_BACKEND=redis needs the redis package')
+            client = redis.Redis.from_url(url)
+        self._redis = client
+        self.prefix = prefix
+
+    def _encode(self, record):
+        out = {}
+        for field in SHARED_FIELDS:
+            if field not in record:
+                continue
+            v = record[field]
+            if field in ('start_time', 'end_time', 'last_activity'):
+                v = _epoch(v)
+            elif field == 'last_detection' and v is not None:
+                v = dict(v, timestamp=_epoch(v.get('timestamp')))
+            elif field in ('frames_processed', 'frames_with_face'):
+                # Plain integers, so HINCRBY can add to them
+                v = int(v or 0)
+            out[field] = json.dumps(v, default=str)
+        return out
+
+    def _decode(self, raw):
+        if not raw:
+            return None
+        data = {k.decode() if isinstance(k, bytes) else k: v for k, v in raw.items()}
+        if 'status' not in data:
+            # Only counters written after the record expired
+            return None
+        record = {}
+        for field in SHARED_FIELDS:
+            v = json.loads(data[field]) if field in data else None
+            if field in ('start_time', 'end_time', 'last_activity'):
+                v = _datetime(v)
+            elif field == 'last_detection' and v is not None:
+                v['timestamp'] = _datetime(v.get('timestamp'))
+            elif field == 'last_bbox' and v is not None:
+                v = tuple(v)
+            elif field in ('frames_processed', 'frames_with_face'):
+                v = int(v or 0)
+            elif field == 'metadata':
+                v = v or {}
+            record[field] = v
+        return record
+
+    def get(self, session_id):
+        return self._decode(self._redis.hgetall(self.prefix + session_id))
+
+    def put(self, session_id, record, ttl):
+        key = self.prefix + session_id
+        pipe = self._redis.pipeline()
+        pipe.delete(key)
+        pipe.hset(key, mapping=self._encode(record))
+        pipe.expire(key, max(1, int(math.ceil(ttl))))
+        pipe.execute()
+
+    def update(self, session_id, fields, ttl):
+        key = self.prefix + session_id
+        if not self._redis.exists(key):
+            return False
+        pipe = self._redis.pipeline()
+        pipe.hset(key, mapping=self._encode(fields))
+        pipe.expire(key, max(1, int(math.ceil(ttl))))
+        pipe.execute()
+        return True
+
+    def record_frame(self, session_id, frames, frames_with_face, fields, ttl):
+        key = self.prefix + session_id
+        pipe = self._redis.pipeline()
+        pipe.hincrby(key, 'frames_processed', frames)
+        pipe.hincrby(key, 'frames_with_face', frames_with_face)
+        encoded = self._encode(fields)
+        if encoded:
+            pipe.hset(key, mapping=encoded)
+        pipe.expire(key, max(1, int(math.ceil(ttl))))
+        pipe.execute()
+        return True
+
+    def delete(self, session_id):
+        self._redis.delete(self.prefix + session_id)
+
+    def stats(self):
+        return {'backend': 'redis', 'prefix': self.prefix}
@@ -0,0 +1,152 @@
+"""
+Per-process startup: lazy optional imports, init hooks and readiness.
+
+Importing the app only defines things. Work that must happen once per
+serving process (building FaceMesh graphs or starting inference workers,
+the warmup inference, MongoDB index creation, replaying spilled writes) is
+registered as a hook and run by `lifecycle.start()` on a background thread:
+
+    @lifecycle.hook('inference')
+    def _init_inference():
+        ...
+
+`start()` runs in the process that serves requests. The app calls
+`autostart()` at the end of its import. Under gunicorn, gunicorn.conf.py
+calls `defer()` in the master and `start()` in each worker after it forks
+(`post_worker_init`), so with `--preload` no graph, thread or child process
+is created before the fork. A forked child starts over with no hooks run.
+
+`ready` is true once every hook has finished; /health/ready reports it
+separately from liveness. `status()` gives per-hook timings and errors.
+
+`lazy_import(name)` returns a stand-in that imports the module on first
+attribute access, or None when the module is not installed, so
+`if module is not None` checks keep working without paying for the import.
+"""
+import importlib
+import importlib.util
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PENDING, STARTING, READY, FAILED = 'pending', 'starting', 'ready', 'failed'
+
+
+class _LazyModule:
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            module = self.__dict__['_module'] = importlib.import_module(self.__dict__['_name'])
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_module'] is not None else 'not loaded'
+        return f'<lazy module {self.__dict__["_name"]!r} ({state})>'
+
+
+def lazy_import(name):
+    """Module `name`, imported on first attribute access; None if it is not installed."""
+    try:
+        if importlib.util.find_spec(name) is None:
+            return None
+    except (ImportError, ValueError):
+        return None
+    return _LazyModule(name)
+
+
+class Startup:
+    """Init hooks run once per process on a background thread, plus the resulting readiness."""
+
+    def __init__(self):
+        self._hooks = []
+        self.deferred = False
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._state = PENDING
+        self._steps = {}
+        self._started_at = None
+        self._seconds = None
+
+    def hook(self, name):
+        """Decorator registering `fn()` to run at start, in registration order."""
+        def register(fn):
+            self._hooks.append((name, fn))
+            return fn
+        return register
+
+    def defer(self):
+        """Leave starting to an explicit `start()` (gunicorn's post_worker_init)."""
+        self.deferred = True
+
+    def autostart(self):
+        if not self.deferred:
+            self.start()
+
+    def start(self):
+        """Run the hooks on a background thread; only the first call in a process does anything."""
+        with self._lock:
+            if self._state != PENDING:
+                return
+            self._state = STARTING
+            self._started_at = time.monotonic()
+        threading.Thread(target=self._run, name='startup', daemon=True).start()
+
+    def _run(self):
+        failed = False
+        for name, fn in self._hooks:
+            t0 = time.perf_counter()
+            step = {}
+            try:
+                fn()
+            except Exception as e:
+                logger.error(f'Startup step {name!r} failed: {e}', exc_info=True)
+                step['error'] = str(e)
+                failed = True
+            step['seconds'] = round(time.perf_counter() - t0, 3)
+            self._steps[name] = step
+        with self._lock:
+            self._state = FAILED if failed else READY
+            self._seconds = round(time.monotonic() - self._started_at, 3)
+        logger.info(f'Startup {self._state} in {self._seconds}s')
+        self._done.set()
+
+    @property
+    def ready(self):
+        return self._state == READY
+
+    @property
+    def finished(self):
+        """Every hook has run, successfully or not."""
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Start if nobody has, then wait up to `timeout` seconds; returns `ready`."""
+        self.start()
+        self._done.wait(timeout)
+        return self.ready
+
+    def status(self):
+        with self._lock:
+            return {
+                'state': self._state,
+                'seconds': self._seconds,
+                'steps': {name: dict(step) for name, step in self._steps.items()},
+            }
+
+
+lifecycle = Startup()
@@ -0,0 +1,41 @@
+"""
+A drawn face for warming up inference and for the benchmarks.
+
+`face_image` draws a frontal face (skin ellipse, hair, eyes with irises and
+brows, nose, mouth) on a plain background, slightly blurred. MediaPipe
+FaceMesh detects it at every size from 320x240 up, so running it through a
+fresh graph exercises both face detection and the landmark model. `shift`
+moves the face and `blink` narrows the eyes.
+"""
+import io
+
+from PIL import Image, ImageDraw, ImageFilter
+
+
+def face_image(width=640, height=480, shift=(0.0, 0.0), blink=0.0):
+    """RGB PIL image of a face; `shift` is (dx, dy) as a fraction of the frame, `blink` 0..1."""
+    img = Image.new('RGB', (width, height), (90, 110, 130))
+    d = ImageDraw.Draw(img)
+    cx = width / 2 + shift[0] * width
+    cy = height / 2 + shift[1] * height
+    fw = min(width, height) * 0.38
+    fh = fw * 1.3
+    d.ellipse([cx - fw / 2, cy - fh / 2, cx + fw / 2, cy + fh / 2], fill=(224, 172, 140))
+    d.chord([cx - fw / 2, cy - fh / 2 - fh * 0.05, cx + fw / 2, cy], 180, 360, fill=(60, 40, 30))
+    ew, eh = fw * 0.18, fw * 0.08 * (1.0 - 0.8 * blink)
+    ey = cy - fh * 0.08
+    for ex in (cx - fw * 0.2, cx + fw * 0.2):
+        d.ellipse([ex - ew / 2, ey - eh / 2, ex + ew / 2, ey + eh / 2], fill=(250, 250, 250))
+        d.ellipse([ex - eh / 2, ey - eh / 2, ex + eh / 2, ey + eh / 2], fill=(50, 40, 30))
+        d.line([ex - ew / 2, ey - fw * 0.13, ex + ew / 2, ey - fw * 0.14],
+               fill=(70, 50, 40), width=max(1, int(fw * 0.03)))
+    d.polygon([(cx, ey + fw * 0.08), (cx - fw * 0.07, cy + fh * 0.12), (cx + fw * 0.07, cy + fh * 0.12)],
+              fill=(200, 140, 115))
+    d.ellipse([cx - fw * 0.16, cy + fh * 0.2, cx + fw * 0.16, cy + fh * 0.28], fill=(170, 80, 80))
+    return img.filter(ImageFilter.GaussianBlur(max(1.0, min(width, height) / 320.0)))
+
+
+def face_jpeg(width=640, height=480, quality=85):
+    buf = io.BytesIO()
+    face_image(width, height).save(buf, 'JPEG', quality=quality)
+    return buf.getvalue()
@@ -0,0 +1,175 @@
+"""
+Request and stage timing, exported in the Prometheus text format.
+
+    with telemetry.stage('decode'):
+        img_np = decode_image(...)
+
+records the stage's duration in the `neurovision_stage_seconds{stage}`
+histogram and, for the current request, in a list that can be returned as a
+`Server-Timing` header. Request counts and durations by endpoint/status,
+MongoDB write latency, a few gauges (queue depths, session store size) and
+counters mirrored from components' running totals (frame cache hits) are
+recorded alongside.
+
+Under gunicorn each worker has its own registry; with PROMETHEUS_MULTIPROC_DIR
+set (gunicorn.conf.py does this), prometheus_client writes every worker's
+values to files in that directory and `render()` aggregates them, so any
+worker answers the scrape for all of them.
+
+prometheus_client is optional. Without it, or with telemetry disabled, every
+call here returns immediately (`stage` hands back a shared no-op context).
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+try:
+    import prometheus_client
+    from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+    from prometheus_client import multiprocess
+except Exception:
+    prometheus_client = None
+
+logger = logging.getLogger(__name__)
+
+_NULL = nullcontext()
+
+# Seconds; detect stages range from sub-millisecond (parse) to a few hundred ms (inference)
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Stage:
+    __slots__ = ('_telemetry', '_name', '_start')
+
+    def __init__(self, telemetry, name):
+        self._telemetry = telemetry
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._telemetry.observe_stage(self._name, time.perf_counter() - self._start)
+        return False
+
+
+class Telemetry:
+    """Prometheus metrics for the app; a no-op when disabled or prometheus_client is missing."""
+
+    def __init__(self, enabled=True, server_timing=False, namespace='neurovision'):
+        self.enabled = bool(enabled) and prometheus_client is not None
+        self.server_timing = self.enabled and bool(server_timing)
+        self.namespace = namespace
+        self.multiprocess = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+        self._local = threading.local()
+        if enabled and prometheus_client is None:
+            logger.warning('prometheus_client is not installed; metrics are disabled')
+        if not self.enabled:
+            return
+        self._stages = Histogram(
+            f'{namespace}_stage_seconds', 'Time spent in each request processing stage',
+            ['stage'], buckets=STAGE_BUCKETS)
+        self._requests = Counter(
+            f'{namespace}_requests', 'HTTP requests by endpoint, method and status',
+            ['endpoint', 'method', 'status'])
+        self._request_seconds = Histogram(
+            f'{namespace}_request_seconds', 'HTTP request duration by endpoint',
+            ['endpoint'], buckets=REQUEST_BUCKETS)
+        self._mongo_writes = Histogram(
+            f'{namespace}_mongo_write_seconds', 'MongoDB write latency (one batch or one write)',
+            ['collection', 'op'], buckets=STAGE_BUCKETS)
+        self._gauges = {}
+        self._totals = {}
+        # labels() builds and looks up a key on every call; stages are few and fixed
+        self._stage_children = {}
+
+    def stage(self, name):
+        """Context manager timing `name`; a shared no-op when disabled."""
+        if not self.enabled:
+            return _NULL
+        return _Stage(self, name)
+
+    def observe_stage(self, name, seconds):
+        if not self.enabled:
+            return
+        child = self._stage_children.get(name)
+        if child is None:
+            child = self._stage_children[name] = self._stages.labels(name)
+        child.observe(seconds)
+        timings = getattr(self._local, 'timings', None)
+        if timings is not None:
+            timings.append((name, seconds))
+
+    def observe_mongo_write(self, collection, op, seconds):
+        if self.enabled:
+            self._mongo_writes.labels(collection, op).observe(seconds)
+
+    def begin_request(self):
+        """Start collecting this thread's stage timings for Server-Timing."""
+        if self.server_timing:
+            self._local.timings = []
+
+    def end_request(self, endpoint, method, status, seconds):
+        """Count the request; returns the Server-Timing header value, or None."""
+        if not self.enabled:
+            return None
+        self._requests.labels(endpoint, method, str(status)).inc()
+        self._request_seconds.labels(endpoint).observe(seconds)
+        timings = getattr(self._local, 'timings', None)
+        self._local.timings = None
+        if not timings:
+            return None
+        totals = {}
+        for name, secs in timings:
+            totals[name] = totals.get(name, 0.0) + secs
+        return ', '.join(f'{name};dur={secs * 1000.0:.2f}' for name, secs in totals.items())
+
+    def set_gauge(self, name, value, documentation='', mode='livesum'):
+        """Set gauge `<namespace>_<name>`; `mode` is how workers' values combine (multiprocess)."""
+        if not self.enabled or value is None:
+            return
+        gauge = self._gauges.get(name)
+        if gauge is None:
+            gauge = self._gauges[name] = Gauge(
+                f'{self.namespace}_{name}', documentation or name, multiprocess_mode=mode)
+        gauge.set(value)
+
+    def set_total(self, name, total, documentation=''):
+        """Advance counter `<namespace>_<name>_total` to this process's running `total`.
+
+        For counts a component keeps itself: the counter is incremented by the
+        change since the last call, so it survives worker restarts (unlike a
+        gauge, whose share vanishes with the worker) and works with rate().
+        """
+        if not self.enabled or total is None:
+            return
+        entry = self._totals.get(name)
+        if entry is None:
+            entry = self._totals[name] = [Counter(f'{self.namespace}_{name}', documentation or name), 0]
+        counter, last = entry
+        # A total that went down was reset (e.g. a new cache): count it from zero
+        delta = total - last if total >= last else total
+        if delta:
+            counter.inc(delta)
+        entry[1] = total
+
+    def render(self):
+        """(body bytes, content type) of the current metrics, across workers in multiprocess mode."""
+        if not self.enabled:
+            return b'', 'text/plain; charset=utf-8'
+        if self.multiprocess:
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = prometheus_client.REGISTRY
+        return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    """gunicorn child_exit hook: drop a dead worker's live gauges from the multiprocess files."""
+    if prometheus_client is not None and os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+
+import admission
+from admission import AdmissionController, Rejected
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(admission.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def frame(controller, clock, latency, session_id=None):
+    with controller.admit(session_id):
+        clock[0] += latency
+
+
+def test_additive_increase_under_target(clock):
+    controller = AdmissionController(max_limit=4, initial_limit=2, target_latency=0.25)
+    frame(controller, clock, 0.1)
+    assert controller.stats()['limit'] == 2.5
+    frame(controller, clock, 0.1)
+    assert controller.stats()['limit'] == 2.9
+    for _ in range(20):
+        frame(controller, clock, 0.1)
+    assert controller.stats()['limit'] == 4
+
+
+def test_multiplicative_decrease_over_target(clock):
+    controller = AdmissionController(max_limit=10, min_limit=2, target_latency=0.25, decrease=0.5)
+    frame(controller, clock, 1.0)
+    assert controller.stats()['limit'] == 5
+    # Within one latency period of the last decrease: no second cut
+    frame(controller, clock, 0.3)
+    assert controller.stats()['limit'] == 5
+    clock[0] += 2.0
+    frame(controller, clock, 1.0)
+    assert controller.stats()['limit'] == 2.5
+    clock[0] += 2.0
+    frame(controller, clock, 1.0)
+    assert controller.stats()['limit'] == 2
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_sheds_once_queue_is_full():
+    # Latency is seeded with the target: each frame ahead adds 0.25 s of expected wait
+    controller = AdmissionController(max_limit=1, target_latency=0.25, queue_timeout=0.6)
+    held = controller.admit('a')
+    held.__enter__()
+    admitted = []
+
+    def waiter(session_id):
+        with controller.admit(session_id):
+            admitted.append(session_id)
+
+    threads = [threading.Thread(target=waiter, args=(sid,)) for sid in ('b', 'c')]
+    for i, t in enumerate(threads, 1):
+        t.start()
+        # Queued in this order
+        wait_for(lambda: controller.stats()['waiting'] == i)
+    with pytest.raises(Rejected) as excinfo:
+        with controller.admit('d'):
+            pass
+    assert excinfo.value.status == 503
+    assert excinfo.value.retry_after == pytest.approx(0.75)
+    assert controller.stats()['shed'] == 1
+    held.__exit__(None, None, None)
+    for t in threads:
+        t.join(5)
+    assert admitted == ['b', 'c']
+    assert controller.stats()['in_flight'] == 0
+
+
+def test_newer_frame_supersedes_waiting_one():
+    controller = AdmissionController(max_limit=1, target_latency=0.25, queue_timeout=2.0)
+    held = controller.admit('a')
+    held.__enter__()
+    errors = []
+
+    def older():
+        try:
+            with controller.admit('b'):
+                pass
+        except Rejected as e:
+            errors.append(e.status)
+
+    t = threading.Thread(target=older)
+    t.start()
+    wait_for(lambda: controller.stats()['waiting'] == 1)
+    newer = threading.Thread(target=older)
+    newer.start()
+    t.join(5)
+    assert errors == [429]
+    assert controller.stats()['superseded'] == 1
+    held.__exit__(None, None, None)
+    newer.join(5)
+    assert errors == [429]
+    assert controller.stats()['admitted'] == 2
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import ai_analysis
+from ai_analysis import FAILED, PENDING, READY, AnalysisError, AnalysisJobs, GeminiAnalyzer
+
+
+class StubGemini:
+    """HTTP server standing in for GEMINI_URL: echoes the prompt after `delay` seconds."""
+
+    def __init__(self):
+        self.requests = []
+        self.delay = 0.0
+        self.status = 200
+        self.gate = None
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                stub.requests.append({'body': body, 'authorization': self.headers.get('Authorization')})
+                if stub.gate is not None:
+                    stub.gate.wait(5)
+                time.sleep(stub.delay)
+                out = json.dumps({'output': f'analysis of {body["input"]}'}).encode()
+                self.send_response(stub.status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/generate'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        if self.gate is not None:
+            self.gate.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    server = StubGemini()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def analyzer(stub):
+    return GeminiAnalyzer(api_key='secret', url=stub.url, timeout=5.0)
+
+
+def test_http_fallback(stub, analyzer):
+    assert analyzer.enabled
+    assert analyzer('hello') == 'analysis of hello'
+    assert stub.requests == [{'body': {'input': 'hello', 'max_output_tokens': 512}, 'authorization': 'Bearer secret'}]
+
+
+def test_http_error_status(stub, analyzer):
+    stub.status = 503
+    with pytest.raises(AnalysisError) as excinfo:
+        analyzer('hello')
+    assert excinfo.value.details['status'] == 503
+
+
+def test_http_unreachable():
+    analyzer = GeminiAnalyzer(api_key='secret', url='http://127.0.0.1:9/generate', timeout=1.0)
+    with pytest.raises(AnalysisError):
+        analyzer('hello')
+
+
+def test_jobs_share_one_call_and_cache(stub, analyzer):
+    stub.delay = 0.1
+    jobs = AnalysisJobs(analyzer, workers=2)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(jobs.get('p', wait=5))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(stub.requests) == 1
+    assert {(status, result) for _, status, result, _ in results} == {(READY, 'analysis of p')}
+    assert jobs.get('p')[1:3] == (READY, 'analysis of p')
+    stats = jobs.stats()
+    assert (stats['misses'], stats['joined'], stats['hits']) == (1, 3, 1)
+    jobs.close()
+
+
+def test_miss_returns_pending(stub, analyzer):
+    stub.delay = 0.2
+    jobs = AnalysisJobs(analyzer)
+    key, status, result, error = jobs.get('p')
+    assert (status, result, error) == (PENDING, None, None)
+    assert key == jobs.key('p')
+    assert jobs.get('p', wait=5)[1] == READY
+    jobs.close()
+
+
+def test_failure_is_retried_after_error_ttl(stub, analyzer, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(ai_analysis.time, 'monotonic', lambda: clock[0])
+    stub.status = 500
+    jobs = AnalysisJobs(analyzer, error_ttl=60)
+    _, status, _, error = jobs.get('p', wait=5)
+    assert status == FAILED and error['status'] == 500
+    stub.status = 200
+    assert jobs.get('p')[1] == FAILED
+    clock[0] += 61
+    assert jobs.get('p', wait=5)[1:3] == (READY, 'analysis of p')
+    assert len(stub.requests) == 2
+    jobs.close()
+
+
+def test_lru_eviction(stub, analyzer):
+    jobs = AnalysisJobs(analyzer, max_entries=2)
+    for prompt in ('a', 'b', 'c'):
+        jobs.get(prompt, wait=5)
+    assert jobs.stats()['entries'] == 2
+    assert jobs.stats()['evicted'] == 1
+    jobs.close()
+
+
+def test_close_fails_jobs_that_never_started(stub, analyzer):
+    stub.gate = threading.Event()
+    jobs = AnalysisJobs(analyzer, workers=1)
+    jobs.get('running')
+    # Queued behind the running job on the single worker
+    assert jobs.get('queued')[1] == PENDING
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(jobs.get('queued', wait=5)))
+    waiter.start()
+    time.sleep(0.05)
+    started = time.monotonic()
+    jobs.close()
+    waiter.join(5)
+    assert time.monotonic() - started < 1
+    assert results[0][1] == FAILED
+    stub.gate.set()
+    # Expired, so the next request starts a fresh job
+    assert jobs.get('queued', wait=5)[1:3] == (READY, 'analysis of queued')
+    jobs.close()
+
+
+def test_aget_shares_one_call(stub, analyzer):
+    pytest.importorskip('httpx')
+    stub.delay = 0.1
+    jobs = AnalysisJobs(analyzer, agenerate=analyzer.agenerate)
+
+    async def main():
+        try:
+            return await asyncio.gather(*[jobs.aget('p', wait=5) for _ in range(4)])
+        finally:
+            await analyzer.aclose()
+
+    results = asyncio.run(main())
+    assert len(stub.requests) == 1
+    assert {(status, result) for _, status, result, _ in results} == {(READY, 'analysis of p')}
+    jobs.close()
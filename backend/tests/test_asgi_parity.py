@@ -0,0 +1,93 @@
+"""The async routes in asgi.py answer like the Flask routes they replace (no MongoDB)."""
+import importlib
+import sys
+
+import pytest
+
+pytest.importorskip('starlette')
+pytest.importorskip('a2wsgi')
+pytest.importorskip('httpx')
+from starlette.testclient import TestClient  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def clients():
+    with pytest.MonkeyPatch.context() as mp:
+        for name in ('MONGO_URI', 'GEMINI_API_KEY', 'GEMINI_URL'):
+            mp.delenv(name, raising=False)
+        mp.setenv('SESSION_BACKEND', 'local')
+        mp.setenv('PERSIST_WRITE_BEHIND', 'false')
+        import startup
+        # No inference warm-up: these routes never reach it
+        startup.lifecycle.defer()
+        asgi = importlib.import_module('asgi')
+    appmod = sys.modules['app']
+    assert appmod.mongo_db is None and appmod.memory_reports is not None
+    # Without the lifespan, so the deferred startup hooks stay unstarted
+    yield TestClient(asgi.app), appmod.app.test_client()
+
+
+@pytest.fixture
+def session_id(clients):
+    _, flask = clients
+    return flask.post('/api/sessions/start', json={}).get_json()['session_id']
+
+
+def test_post_metrics(clients, session_id):
+    asgi, flask = clients
+    for i, client in enumerate((asgi, flask)):
+        r = client.post(f'/api/sessions/{session_id}/metrics',
+                        json={'attentionPercent': 50 + i, 'ear': 0.3, 'blinkRate': 12})
+        assert r.status_code == 201
+    ra = asgi.post(f'/api/sessions/{session_id}/metrics', json={'ear': 0.31})
+    rf = flask.post(f'/api/sessions/{session_id}/metrics', json={'ear': 0.31})
+    assert (ra.status_code, ra.json()) == (rf.status_code, rf.get_json())
+    assert ra.headers.get('access-control-allow-origin') == rf.headers.get('Access-Control-Allow-Origin')
+
+
+def test_post_metrics_errors(clients, session_id):
+    asgi, flask = clients
+    ra, rf = asgi.post('/api/sessions/unknown/metrics', json={}), flask.post('/api/sessions/unknown/metrics', json={})
+    assert ra.status_code == rf.status_code == 404
+    assert ra.json() == rf.get_json()
+    ra = asgi.post(f'/api/sessions/{session_id}/metrics', content=b'x', headers={'Content-Type': 'text/plain'})
+    rf = flask.post(f'/api/sessions/{session_id}/metrics', data=b'x', content_type='text/plain')
+    assert ra.status_code == rf.status_code == 400
+    assert ra.json() == rf.get_json()
+
+
+def test_report_and_etag(clients, session_id):
+    asgi, flask = clients
+    for i in range(5):
+        flask.post(f'/api/sessions/{session_id}/metrics', json={'attentionPercent': 40 + i, 'ear': 0.3})
+    ra, rf = asgi.get(f'/api/sessions/{session_id}/report'), flask.get(f'/api/sessions/{session_id}/report')
+    assert ra.status_code == rf.status_code == 200
+    assert ra.json() == rf.get_json()
+    assert ra.json()['metrics_count'] == 5
+    assert ra.headers['etag'] == rf.headers['ETag']
+    assert ra.headers['cache-control'] == rf.headers['Cache-Control']
+    etag = ra.headers['etag']
+    ra = asgi.get(f'/api/sessions/{session_id}/report', headers={'If-None-Match': etag})
+    rf = flask.get(f'/api/sessions/{session_id}/report', headers={'If-None-Match': etag})
+    assert ra.status_code == rf.status_code == 304
+    assert ra.content == rf.data == b''
+    assert ra.headers['etag'] == etag
+
+
+def test_report_unknown_session(clients):
+    asgi, flask = clients
+    ra, rf = asgi.get('/api/sessions/unknown/report'), flask.get('/api/sessions/unknown/report')
+    assert ra.status_code == rf.status_code == 404
+    assert ra.json() == rf.get_json()
+
+
+def test_health(clients):
+    asgi, flask = clients
+    for path in ('/health', '/health/live', '/health/ready'):
+        ra, rf = asgi.get(path), flask.get(path)
+        assert ra.status_code == rf.status_code, path
+        body, expected = ra.json(), rf.get_json()
+        # Startup timings move between the two calls
+        body.pop('startup', None)
+        expected.pop('startup', None)
+        assert body == expected, path
@@ -0,0 +1,80 @@
+import numpy as np
+
+import face_tracks
+from face_tracks import MAX_TRACKS, update
+
+LEFT = (0.05, 0.2, 0.25, 0.5)
+RIGHT = (0.6, 0.2, 0.8, 0.5)
+
+
+def boxes(*rows):
+    return np.array(rows, dtype=np.float64).reshape(-1, 4)
+
+
+def shifted(box, dx, dy=0.0):
+    return (box[0] + dx, box[1] + dy, box[2] + dx, box[3] + dy)
+
+
+def test_ids_stay_stable_when_faces_swap_order():
+    ids, _, state = update(None, boxes(LEFT, RIGHT))
+    assert ids == [1, 2]
+    ids, _, state = update(state, boxes(shifted(RIGHT, 0.01), shifted(LEFT, -0.01)))
+    assert ids == [2, 1]
+    assert state['next_id'] == 3
+
+
+def test_fast_move_is_matched_by_centroid():
+    face = (0.3, 0.3, 0.5, 0.5)
+    _, _, state = update(None, boxes(face))
+    # Too little overlap for the IoU pass, but within half a box size
+    moved = shifted(face, 0.065, 0.065)
+    assert face_tracks._iou(boxes(moved), boxes(face))[0, 0] < 0.3
+    ids, _, state = update(state, boxes(moved))
+    assert ids == [1]
+    # Moving towards the camera: the box doubles around the same centre
+    ids, _, state = update(state, boxes((0.265, 0.265, 0.665, 0.665)))
+    assert ids == [1]
+    # Farther than half a box size is a new face
+    ids, _, _ = update(state, boxes(shifted((0.265, 0.265, 0.665, 0.665), 0.3)))
+    assert ids == [2]
+
+
+def test_track_dropped_after_max_missed():
+    _, _, state = update(None, boxes(LEFT), max_missed=2)
+    for missed in (1, 2):
+        ids, primary, state = update(state, boxes(), max_missed=2)
+        assert (ids, primary) == ([], None)
+        assert state['tracks'][0][0] == 1 and state['tracks'][0][5] == missed
+        assert face_tracks.live_tracks(state) == 0
+    # Still known after max_missed frames, so it comes back under its id
+    ids, _, _ = update(state, boxes(LEFT), max_missed=2)
+    assert ids == [1]
+    _, _, state = update(state, boxes(), max_missed=2)
+    assert state['tracks'] == []
+    ids, _, _ = update(state, boxes(LEFT), max_missed=2)
+    assert ids == [2]
+
+
+def test_primary_stays_while_in_view():
+    small = (0.1, 0.1, 0.2, 0.2)
+    large = (0.5, 0.3, 0.9, 0.9)
+    ids, primary, state = update(None, boxes(small))
+    assert primary == 0 and state['primary'] == 1
+    # A larger face arrives, listed first: the primary is still the first face
+    ids, primary, state = update(state, boxes(large, shifted(small, 0.01)))
+    assert ids == [2, 1] and primary == 1
+    # Once it leaves, the largest face becomes primary
+    ids, primary, state = update(state, boxes(shifted(large, 0.01)))
+    assert ids == [2] and primary == 0 and state['primary'] == 2
+
+
+def test_tracks_capped_keeping_the_most_recent():
+    grid = [(0.05 * i, 0.0, 0.05 * i + 0.04, 0.04) for i in range(MAX_TRACKS)]
+    _, _, state = update(None, boxes(*grid))
+    extra = [(0.05 * i, 0.5, 0.05 * i + 0.04, 0.54) for i in range(4)]
+    ids, _, state = update(state, boxes(*extra))
+    assert len(state['tracks']) == MAX_TRACKS
+    kept = [t[0] for t in state['tracks']]
+    # The new faces are kept; the same number of missed tracks are dropped
+    assert set(ids) <= set(kept)
+    assert sum(t[5] == 1 for t in state['tracks']) == MAX_TRACKS - len(extra)
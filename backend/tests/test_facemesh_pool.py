@@ -0,0 +1,63 @@
+import time
+
+import pytest
+
+from facemesh_pool import FaceMeshPool, PoolTimeout
+
+
+class FakeMesh:
+    def __init__(self, broken=False):
+        self.broken = broken
+        self.closed = False
+
+    def process(self, frame):
+        if self.broken:
+            raise RuntimeError('graph broken')
+        return None
+
+    def close(self):
+        self.closed = True
+
+
+def test_checkout_timeout():
+    pool = FaceMeshPool(FakeMesh, size=1, timeout=0.05)
+    with pool.checkout():
+        with pytest.raises(PoolTimeout):
+            with pool.checkout():
+                pass
+    assert pool.stats()['timeouts'] == 1
+
+
+def test_failing_instance_replaced_on_checkin():
+    pool = FaceMeshPool(FakeMesh, size=1, max_failures=2)
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            with pool.checkout() as mesh:
+                mesh.broken = True
+                mesh.process(None)
+    assert mesh.closed
+    with pool.checkout() as fresh:
+        assert fresh is not mesh
+    assert pool.stats()['replaced'] == 1
+
+
+def test_check_health_replaces_broken_idle_instances():
+    pool = FaceMeshPool(FakeMesh, size=2)
+    with pool.checkout() as broken:
+        broken.broken = True
+    assert pool.check_health() == 2
+    assert broken.closed
+    assert pool.stats()['replaced'] == 1
+
+
+def test_scheduled_health_checks():
+    pool = FaceMeshPool(FakeMesh, size=1)
+    with pool.checkout() as broken:
+        broken.broken = True
+    pool.start_health_checks(0.02)
+    deadline = time.monotonic() + 5
+    while not broken.closed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert broken.closed
+    assert pool.stats()['health_checks'] >= 1
+    pool.close()
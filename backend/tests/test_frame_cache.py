@@ -0,0 +1,83 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from frame_cache import FrameCache, hamming, perceptual_hash
+from preprocess import RawFrame
+from synthetic_face import face_image
+
+
+def jpeg(shift=(0.0, 0.0), quality=85, noise=0):
+    image = face_image(320, 240, shift=shift)
+    if noise:
+        pixels = np.asarray(image, dtype=np.int16)
+        jitter = np.random.default_rng(0).integers(-noise, noise + 1, pixels.shape)
+        image = Image.fromarray(np.clip(pixels + jitter, 0, 255).astype(np.uint8))
+    buf = io.BytesIO()
+    image.save(buf, format='JPEG', quality=quality)
+    return buf.getvalue()
+
+
+def miss_then_store(cache, session_id, frame, value):
+    cached, probe = cache.lookup(session_id, frame)
+    assert cached is None
+    cache.store(session_id, probe, value, cost=0.05)
+
+
+def test_exact_hit():
+    cache = FrameCache()
+    frame = jpeg()
+    miss_then_store(cache, 's', frame, 'result')
+    assert cache.lookup('s', frame) == ('result', None)
+    # Another session never sees it
+    assert cache.lookup('other', frame)[0] is None
+    stats = cache.stats()
+    assert (stats['exact_hits'], stats['misses']) == (1, 2)
+    assert stats['saved_seconds'] == 0.05
+
+
+def test_exact_key_covers_raw_layout():
+    cache = FrameCache()
+    data = bytes(range(256)) * 12
+    miss_then_store(cache, 's', RawFrame(data, 'rgb', 32, 32), 'square')
+    assert cache.lookup('s', RawFrame(data, 'rgb', 32, 32))[0] == 'square'
+    # Same bytes, other shape: not the same frame
+    assert cache.lookup('s', RawFrame(data, 'rgb', 64, 16))[0] is None
+
+
+def test_near_duplicate_hit():
+    cache = FrameCache(near_duplicates=True, max_distance=4)
+    miss_then_store(cache, 's', jpeg(), 'result')
+    # Re-encoded with sensor noise: different bytes, same picture
+    similar = jpeg(quality=70, noise=6)
+    assert hamming(perceptual_hash(similar), perceptual_hash(jpeg())) <= 4
+    assert cache.lookup('s', similar) == ('result', None)
+    assert cache.stats()['near_hits'] == 1
+
+
+def test_moved_face_misses():
+    cache = FrameCache(near_duplicates=True, max_distance=4)
+    miss_then_store(cache, 's', jpeg(), 'result')
+    moved = jpeg(shift=(0.15, 0.0))
+    assert hamming(perceptual_hash(moved), perceptual_hash(jpeg())) > 4
+    cached, probe = cache.lookup('s', moved)
+    assert cached is None and probe is not None
+    assert cache.stats()['near_hits'] == 0
+
+
+def test_near_duplicates_off_by_default():
+    cache = FrameCache()
+    miss_then_store(cache, 's', jpeg(), 'result')
+    assert cache.lookup('s', jpeg(quality=70))[0] is None
+
+
+def test_lru_limits():
+    cache = FrameCache(max_entries=2, max_sessions=1)
+    for i in range(3):
+        miss_then_store(cache, 'a', bytes([i]), i)
+    assert cache.lookup('a', bytes([0]))[0] is None
+    assert cache.lookup('a', bytes([2]))[0] == 2
+    miss_then_store(cache, 'b', bytes([9]), 9)
+    assert cache.lookup('a', bytes([2]))[0] is None
+    assert cache.stats()['evicted'] == 3
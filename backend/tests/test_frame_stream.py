@@ -0,0 +1,73 @@
+import json
+import queue
+
+from frame_stream import FrameStream
+
+
+class FakeWebSocket:
+    """Blocking receive()/send() over queued client messages; receive() raises when they run out."""
+
+    def __init__(self, messages):
+        self.incoming = queue.Queue()
+        for msg in messages:
+            self.incoming.put(msg)
+        self.sent = []
+
+    def receive(self):
+        try:
+            return self.incoming.get(timeout=2)
+        except queue.Empty:
+            raise ConnectionError('closed')
+
+    def send(self, data):
+        self.sent.append(json.loads(data))
+
+
+def process(frame):
+    return {'frame_bytes': len(frame), 'raw': getattr(frame, 'fmt', None)}, 200
+
+
+def run(messages):
+    ws = FakeWebSocket(messages)
+    FrameStream(ws, process, ('dataUrl',), max_queue=8).run()
+    return ws.sent
+
+
+def config(**fields):
+    return json.dumps(dict(fields, type='config'))
+
+
+def test_invalid_config_keeps_stream_running():
+    sent = run([
+        config(format='rgb', width='wide', height=2),
+        config(format='rgb', width=2.5, height=2),
+        config(format='rgb', width=None, height=2),
+        config(format='rgb', width=-2, height=2),
+        config(format='yuv', width=2, height=2),
+        b'\xff\xd8jpeg',
+        json.dumps({'type': 'close'}),
+    ])
+    assert sent[0]['type'] == 'ready'
+    errors = [msg for msg in sent if msg['type'] == 'error']
+    assert len(errors) == 5
+    assert all('seq' not in msg for msg in errors)
+    # The layout is unchanged, so the binary frame is still taken as encoded
+    results = [msg for msg in sent if msg['type'] == 'result']
+    assert [(r['frame_bytes'], r['raw']) for r in results] == [(6, None)]
+
+
+def test_raw_config():
+    sent = run([
+        config(format='rgb', width='2', height=2),
+        bytes(12),
+        json.dumps({'type': 'close'}),
+    ])
+    assert {'type': 'config', 'format': 'rgb'} in sent
+    results = [msg for msg in sent if msg['type'] == 'result']
+    assert [(r['frame_bytes'], r['raw']) for r in results] == [(12, 'rgb')]
+
+
+def test_invalid_json_is_reported_in_order():
+    sent = run(['{not json', json.dumps({'type': 'close'})])
+    errors = [msg for msg in sent if msg['type'] == 'error']
+    assert errors == [{'type': 'error', 'seq': 1, 'error': 'Invalid JSON message'}]
@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip('flask')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bench'))
+
+import cold_start  # noqa: E402
+
+# Median `import app` over a few fresh processes, in milliseconds
+IMPORT_BUDGET_MS = float(os.environ.get('IMPORT_BUDGET_MS', '1500'))
+
+
+def test_import_app_within_budget():
+    runs = [cold_start.probe_import() for _ in range(3)]
+    heavy = sorted(set().union(*(run['heavy'] for run in runs)))
+    assert not heavy, f'imported at app import: {", ".join(heavy)}'
+    median_ms = sorted(run['import'] for run in runs)[1] * 1000
+    assert median_ms <= IMPORT_BUDGET_MS, f'median import {median_ms:.0f} ms over the {IMPORT_BUDGET_MS:g} ms budget'
@@ -0,0 +1,87 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from landmark_archive import HEADER_BYTES, LandmarkArchive
+
+
+def points(i, n=478):
+    return np.full((n, 3), i / 100.0, dtype=np.float32)
+
+
+@pytest.fixture
+def archive(tmp_path):
+    archive = LandmarkArchive(str(tmp_path / 'lmk'), retention=3600)
+    yield archive
+    archive.close()
+
+
+def fill(archive, session_id, times):
+    for i, t in enumerate(times):
+        archive.append(session_id, points(i), timestamp=t)
+
+
+def test_round_trip(archive):
+    fill(archive, 's1', [100.0, 101.0, 102.0])
+    with archive.open_session('s1') as view:
+        assert len(view) == 3
+        assert view.records['t'].tolist() == [100.0, 101.0, 102.0]
+        np.testing.assert_allclose(view.records['landmarks'][2], points(2), atol=1e-3)
+    assert archive.open_session('missing') is None
+    assert archive.stats()['appended'] == 3
+
+
+def test_append_stamps_current_time(archive):
+    archive.append('s1', points(0))
+    with archive.open_session('s1') as view:
+        assert abs(view.records['t'][0] - time.time()) < 5
+
+
+def test_wrong_shape_is_counted_not_written(archive):
+    archive.append('s1', np.zeros((10, 3)), timestamp=1.0)
+    assert archive.stats()['errors'] == 1
+    assert archive.open_session('s1') is None
+
+
+def test_range_and_stride(archive):
+    fill(archive, 's1', [float(t) for t in range(100, 110)])
+    with archive.open_session('s1') as view:
+        assert view.select(102, 105)['t'].tolist() == [102.0, 103.0, 104.0, 105.0]
+        assert view.select(102, None, stride=3)['t'].tolist() == [102.0, 105.0, 108.0]
+        assert view.select(None, 101)['t'].tolist() == [100.0, 101.0]
+        assert view.select(stride=4)['t'].tolist() == [100.0, 104.0, 108.0]
+        assert len(view.select(200, 300)) == 0
+
+
+def test_range_tolerates_records_out_of_order(archive):
+    # A worker stamped 104.5 but appended after another worker's 105.2
+    fill(archive, 's1', [103.0, 104.0, 105.2, 104.5, 106.0, 107.0])
+    with archive.open_session('s1') as view:
+        assert sorted(view.select(104.2, 105.5)['t'].tolist()) == [104.5, 105.2]
+        assert view.select(104.2, 105.5, stride=2)['t'].tolist() == [105.2]
+
+
+def test_trailing_partial_record_is_ignored(archive):
+    fill(archive, 's1', [100.0, 101.0])
+    archive.release('s1')
+    path = archive.path('s1')
+    with open(path, 'ab') as f:
+        f.write(b'\x00' * 100)
+    with archive.open_session('s1') as view:
+        assert len(view) == 2
+        assert os.path.getsize(path) == HEADER_BYTES + 2 * view.dtype.itemsize + 100
+
+
+def test_prune(archive):
+    fill(archive, 'old', [1.0])
+    fill(archive, 'new', [2.0])
+    archive.close()
+    stale = os.path.getmtime(archive.path('old')) - 7200
+    os.utime(archive.path('old'), (stale, stale))
+    assert archive.prune() == 1
+    assert archive.open_session('old') is None
+    assert archive.open_session('new') is not None
+    assert archive.prune(max_age=0) == 0
+    assert archive.stats()['pruned'] == 1
@@ -0,0 +1,90 @@
+import base64
+
+import numpy as np
+import pytest
+
+landmark_pb2 = pytest.importorskip('mediapipe.framework.formats.landmark_pb2')
+
+import landmark_codec  # noqa: E402
+from landmark_codec import I16_SCALE, N_LANDMARKS  # noqa: E402
+
+
+def face(points, **extra):
+    msg = landmark_pb2.NormalizedLandmarkList()
+    for x, y, z in points:
+        msg.landmark.add(x=x, y=y, z=z, **extra)
+    return msg
+
+
+def random_points(n=N_LANDMARKS, seed=0):
+    rng = np.random.default_rng(seed)
+    pts = np.column_stack([rng.uniform(0.05, 0.95, n), rng.uniform(0.05, 0.95, n), rng.uniform(-0.1, 0.1, n)])
+    return pts.astype(np.float32)
+
+
+def expected(msg):
+    return np.array([(lm.x, lm.y, lm.z) for lm in msg.landmark], dtype=np.float32)
+
+
+def test_face_array_reads_the_wire_records():
+    msg = face(random_points())
+    # Every record is the fixed 17-byte layout, so the fast path is taken
+    assert len(msg.SerializeToString()) == N_LANDMARKS * landmark_codec._WIRE.itemsize
+    out = landmark_codec.face_array(msg)
+    assert out.shape == (N_LANDMARKS, 3) and out.dtype == np.float32
+    np.testing.assert_array_equal(out, expected(msg))
+
+
+@pytest.mark.parametrize('variant', ['missing_z', 'visibility'])
+def test_face_array_falls_back_on_other_layouts(variant):
+    pts = random_points()
+    if variant == 'missing_z':
+        # An unset field is not serialized, so that record is shorter
+        msg = face(pts[:-1])
+        msg.landmark.add(x=float(pts[-1, 0]), y=float(pts[-1, 1]))
+    else:
+        msg = face(pts, visibility=0.5)
+    assert len(msg.SerializeToString()) != N_LANDMARKS * landmark_codec._WIRE.itemsize
+    np.testing.assert_array_equal(landmark_codec.face_array(msg), expected(msg))
+
+
+def test_landmarks_array():
+    class Results:
+        multi_face_landmarks = [face(random_points(seed=1)), face(random_points(seed=2))]
+
+    out = landmark_codec.landmarks_array(Results())
+    assert out.shape == (2, N_LANDMARKS, 3)
+    np.testing.assert_array_equal(out[1], expected(Results.multi_face_landmarks[1]))
+    assert landmark_codec.landmarks_array(None).shape == (0, N_LANDMARKS, 3)
+
+
+@pytest.mark.parametrize('encoding, dtype, tolerance', [
+    ('f32', '<f4', 0.0),
+    ('f16', '<f2', 1e-3),
+    ('i16', '<i2', 0.5 / I16_SCALE),
+])
+def test_pack_round_trip(encoding, dtype, tolerance):
+    points = landmark_codec.face_array(face(random_points()))
+    data = landmark_codec.pack(points, encoding)
+    assert len(data) == points.size * np.dtype(dtype).itemsize
+    decoded = np.frombuffer(data, dtype=dtype).reshape(-1, 3).astype(np.float64)
+    if encoding == 'i16':
+        decoded /= I16_SCALE
+    np.testing.assert_allclose(decoded, points, rtol=0, atol=tolerance + 1e-9)
+
+
+def test_i16_clips_out_of_range():
+    data = landmark_codec.pack(np.array([[3.0, -3.0, 0.5]]), 'i16')
+    assert np.frombuffer(data, dtype='<i2').tolist() == [32767, -32768, 8192]
+
+
+def test_encode_json_subset():
+    points = landmark_codec.face_array(face(random_points()))
+    indices = landmark_codec.subset_indices('iris')
+    fields = landmark_codec.encode_json(points, 'f16', indices)
+    assert fields['landmarks_shape'] == [8, 3]
+    assert fields['landmark_indices'] == [469, 470, 471, 472, 474, 475, 476, 477]
+    decoded = np.frombuffer(base64.b64decode(fields['landmarks']), dtype='<f2').reshape(-1, 3)
+    np.testing.assert_allclose(decoded, points[indices], atol=1e-3)
+    with pytest.raises(ValueError):
+        landmark_codec.subset_indices('ears')
@@ -0,0 +1,129 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import report_engine
+from report_engine import REPORT_FIELDS, MemoryReportBackend, MongoReportBackend
+
+NOW = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def add(backend, session_id, n=1):
+    for _ in range(n):
+        backend.add(session_id, NOW, {'attentionPercent': 50.0})
+
+
+def test_keeps_at_most_max_samples():
+    backend = MemoryReportBackend(max_samples=10)
+    add(backend, 's', 25)
+    assert 5 <= backend.report_data('s', 100)['count'] <= 10
+
+
+def test_lru_past_max_sessions():
+    backend = MemoryReportBackend(max_sessions=2)
+    add(backend, 'a')
+    add(backend, 'b')
+    # A report counts as use, so 'b' is the least recently used
+    backend.report_data('a', 10)
+    add(backend, 'c')
+    assert backend.report_data('b', 10)['count'] == 0
+    assert backend.report_data('a', 10)['count'] == 1
+    assert backend.stats()['evicted'] == 1
+
+
+def test_memory_budget():
+    one = MemoryReportBackend()
+    add(one, 'a')
+    per_session = one.stats()['bytes']
+    backend = MemoryReportBackend(max_bytes=per_session * 3)
+    for session_id in 'abcde':
+        add(backend, session_id)
+    stats = backend.stats()
+    assert stats['sessions'] == 3
+    assert stats['bytes'] <= per_session * 3
+    assert backend.report_data('e', 10)['count'] == 1
+
+
+def test_idle_ttl(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(report_engine.time, 'monotonic', lambda: clock[0])
+    backend = MemoryReportBackend(idle_ttl=60)
+    add(backend, 'old')
+    clock[0] += 30
+    add(backend, 'new')
+    clock[0] += 40
+    assert backend.report_data('old', 10)['count'] == 0
+    assert backend.report_data('new', 10)['count'] == 1
+
+
+def test_discard_releases_bytes():
+    backend = MemoryReportBackend()
+    add(backend, 'a', 300)
+    backend.discard('a')
+    assert backend.stats() == dict(backend.stats(), sessions=0, bytes=0)
+
+
+def samples(n=40):
+    """(timestamp, values) pairs with gaps, zeros and a missing field, as both backends store them."""
+    out = []
+    for i in range(n):
+        values = {'attentionPercent': 40.0 + i, 'ear': 0.2 + i / 100, 'blinkRate': 0.0 if i % 3 == 0 else 10.0 + i}
+        if i % 4:
+            values['drowsinessPercent'] = float(i % 7)
+        out.append((NOW + timedelta(seconds=i), values))
+    return out
+
+
+def fill(collection, memory, session_id='s'):
+    for i, (ts, values) in enumerate(samples()):
+        if i % 10 == 0:
+            # Very old documents kept the values top-level
+            collection.insert_one(dict(values, sessionId=session_id, timestamp=ts))
+        else:
+            collection.insert_one({'sessionId': session_id, 'timestamp': ts, 'metrics': values})
+        memory.add(session_id, ts, values)
+    collection.insert_one({'sessionId': 'other', 'timestamp': NOW, 'metrics': {'attentionPercent': 1.0}})
+
+
+def test_pipeline_summary_matches_memory_backend():
+    mongomock = pytest.importorskip('mongomock')
+    collection = mongomock.MongoClient().db.metrics
+    memory = MemoryReportBackend()
+    fill(collection, memory)
+    pipeline = MongoReportBackend.pipeline('s', 8)
+    # mongomock has no $bucketAuto; the series is checked below and against MongoDB
+    del pipeline[-1]['$facet']['series']
+    result = MongoReportBackend.parse(next(iter(collection.aggregate(pipeline))))
+    expected = memory.report_data('s', 8)
+    assert result['count'] == expected['count'] == 40
+    assert result['stats'] == expected['stats']
+
+
+def test_pipeline_series_stage():
+    facet = MongoReportBackend.pipeline('s', 8)[-1]['$facet']['series']
+    assert facet == [{'$bucketAuto': {
+        'groupBy': '$timestamp',
+        'buckets': 8,
+        'output': dict({'timestamp': {'$min': '$timestamp'}}, **{f: {'$avg': f'${f}'} for f in REPORT_FIELDS.values()}),
+    }}]
+    assert MongoReportBackend.pipeline('s', 0)[-1]['$facet']['series'][0]['$bucketAuto']['buckets'] == 1
+    series = MongoReportBackend.parse({'series': [
+        {'_id': {'min': NOW, 'max': NOW}, 'timestamp': NOW.replace(tzinfo=None), 'attentionPercent': 41.25, 'ear': None},
+    ]})['series']
+    assert series == [{'timestamp': NOW, 'metrics': {'attentionPercent': 41.25}}]
+
+
+@pytest.mark.skipif(not os.environ.get('MONGO_TEST_URI'), reason='set MONGO_TEST_URI to compare against MongoDB')
+def test_mongo_backend_matches_memory_backend():
+    pymongo = pytest.importorskip('pymongo')
+    client = pymongo.MongoClient(os.environ['MONGO_TEST_URI'], serverSelectionTimeoutMS=5000)
+    collection = client.get_database('neurovision_test').get_collection(f'metrics_{os.getpid()}')
+    try:
+        memory = MemoryReportBackend()
+        fill(collection, memory)
+        for max_points in (1, 8, 40, 100):
+            assert MongoReportBackend(collection).report_data('s', max_points) == memory.report_data('s', max_points)
+    finally:
+        collection.drop()
+        client.close()
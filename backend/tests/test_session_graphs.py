@@ -0,0 +1,134 @@
+import threading
+import time
+
+import pytest
+
+from facemesh_pool import PoolTimeout
+from session_graphs import SessionGraphCache
+
+
+class Meshes:
+    """Factory of fake graphs that tracks how many are open at once."""
+
+    def __init__(self, delay=0.05, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.lock = threading.Lock()
+        self.open = 0
+        self.peak = 0
+        self.built = 0
+
+    def __call__(self):
+        with self.lock:
+            self.open += 1
+            self.peak = max(self.peak, self.open)
+        time.sleep(self.delay)
+        if self.fail:
+            self.closed()
+            raise RuntimeError('no graph')
+        with self.lock:
+            self.built += 1
+        return _Mesh(self)
+
+    def closed(self):
+        with self.lock:
+            self.open -= 1
+
+
+class _Mesh:
+    def __init__(self, meshes):
+        self.meshes = meshes
+
+    def close(self):
+        self.meshes.closed()
+
+
+def run_sessions(cache, session_ids, hold=0.02):
+    results = {}
+
+    def frame(session_id):
+        with cache.checkout(session_id) as mesh:
+            results[session_id] = mesh
+            time.sleep(hold)
+
+    threads = [threading.Thread(target=frame, args=(sid,)) for sid in session_ids]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_concurrent_misses_stay_under_cap():
+    meshes = Meshes()
+    cache = SessionGraphCache(meshes, max_graphs=2)
+    results = run_sessions(cache, [f's{i}' for i in range(8)])
+    assert meshes.peak <= 2
+    assert sum(mesh is not None for mesh in results.values()) >= 2
+    assert cache.stats()['fallbacks'] == sum(mesh is None for mesh in results.values())
+    assert cache.stats()['building'] == 0
+
+
+def test_concurrent_misses_for_one_session_build_once():
+    meshes = Meshes()
+    cache = SessionGraphCache(meshes, max_graphs=4)
+    results = {}
+
+    def frame(i):
+        with cache.checkout('s') as mesh:
+            results[i] = mesh
+
+    threads = [threading.Thread(target=frame, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert meshes.built == 1
+    assert len({id(mesh) for mesh in results.values()}) == 1
+
+
+def test_failed_build_releases_slot():
+    meshes = Meshes(delay=0, fail=True)
+    cache = SessionGraphCache(meshes, max_graphs=1)
+    with cache.checkout('a') as mesh:
+        assert mesh is None
+    meshes.fail = False
+    with cache.checkout('b') as mesh:
+        assert mesh is not None
+    assert cache.stats()['building'] == 0
+
+
+def test_evicted_busy_graph_holds_slot_until_released():
+    meshes = Meshes(delay=0)
+    cache = SessionGraphCache(meshes, max_graphs=1)
+    with cache.checkout('a') as mesh:
+        assert cache.evict('a')
+        assert cache.stats()['draining'] == 1
+        # The slot is still taken by 'a' and nothing idle can be evicted
+        with cache.checkout('b') as other:
+            assert other is None
+        assert meshes.open == 1
+    assert cache.stats()['draining'] == 0
+    assert meshes.open == 0
+    with cache.checkout('b') as mesh:
+        assert mesh is not None
+
+
+def test_busy_graph_times_out():
+    cache = SessionGraphCache(Meshes(delay=0), max_graphs=1, timeout=0.05)
+    started = threading.Event()
+    done = threading.Event()
+
+    def hold():
+        with cache.checkout('a'):
+            started.set()
+            done.wait(5)
+
+    t = threading.Thread(target=hold)
+    t.start()
+    started.wait(5)
+    with pytest.raises(PoolTimeout):
+        with cache.checkout('a'):
+            pass
+    done.set()
+    t.join()
@@ -0,0 +1,60 @@
+import session_store
+from face_metrics import SessionMetrics
+from session_store import SessionStore, approx_size
+
+
+def test_sweep_finds_expired_records_behind_completed_ones(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(session_store.time, 'monotonic', lambda: clock[0])
+    evicted = []
+    store = SessionStore(idle_ttl=10, completed_ttl=100, on_evict=lambda sid, rec: evicted.append(sid))
+    store['idle'] = {'status': 'active'}
+    store['ended'] = {'status': 'active'}
+    # Moved to the front with a deadline later than the idle record's
+    store.complete('ended')
+    clock[0] += 11
+    assert store.sweep() == 1
+    assert evicted == ['idle']
+    assert 'ended' in store
+
+
+def test_insert_sweeps_expired_records(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(session_store.time, 'monotonic', lambda: clock[0])
+    store = SessionStore(idle_ttl=10, completed_ttl=100)
+    store['idle'] = {}
+    store['ended'] = {}
+    store.complete('ended')
+    clock[0] += 11
+    store['new'] = {}
+    assert len(store) == 2
+    assert store.stats()['evicted_ttl'] == 1
+
+
+def test_size_reestimated_when_record_grows():
+    store = SessionStore()
+    record = {'status': 'active'}
+    store['s'] = record
+    before = store.stats()['bytes']
+    state = record['metrics_state'] = SessionMetrics()
+    state._blink_times.extend(float(i) for i in range(500))
+    store.record_frame('s', record, faces=1)
+    assert store.stats()['bytes'] - before >= approx_size(state._blink_times)
+
+
+def test_grown_record_evicts_others_to_stay_in_budget():
+    store = SessionStore(max_bytes=64 * 1024)
+    store['old'] = {}
+    record = store['busy'] = {}
+    record['face_tracks'] = {'tracks': [[float(i)] * 6 for i in range(400)]}
+    store.record_frame('busy', record, faces=1)
+    assert 'old' not in store
+    assert 'busy' in store
+    assert store.stats()['evicted_memory'] == 1
+
+
+def test_completed_insert_over_budget_is_kept():
+    store = SessionStore(max_bytes=1)
+    store['a'] = {}
+    store._insert('b', {}, completed=True)
+    assert 'b' in store and 'a' not in store
@@ -0,0 +1,26 @@
+import pytest
+
+pytest.importorskip('prometheus_client')
+
+from telemetry import Telemetry
+
+
+def test_gauges_use_namespace():
+    telemetry = Telemetry(namespace='gaugetest')
+    telemetry.set_gauge('frame_cache_hits', 3, 'Frames answered from the frame cache')
+    body, _ = telemetry.render()
+    assert b'gaugetest_frame_cache_hits 3.0' in body
+    assert b'# TYPE neurovision_frame_cache_hits gauge' not in body
+
+
+def test_totals_are_counters_advanced_by_delta():
+    telemetry = Telemetry(namespace='totaltest')
+    telemetry.set_total('hits', 5, 'Hits')
+    telemetry.set_total('hits', 8, 'Hits')
+    body, _ = telemetry.render()
+    assert b'# TYPE totaltest_hits_total counter' in body
+    assert b'totaltest_hits_total 8.0' in body
+    # A reset source (e.g. a new cache) counts on from zero
+    telemetry.set_total('hits', 2, 'Hits')
+    body, _ = telemetry.render()
+    assert b'totaltest_hits_total 10.0' in body
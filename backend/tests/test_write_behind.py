@@ -0,0 +1,282 @@
+import threading
+import time
+
+import pytest
+
+mongomock = pytest.importorskip('mongomock')
+from pymongo.errors import AutoReconnect, BulkWriteError  # noqa: E402
+
+import write_behind  # noqa: E402
+from write_behind import WriteBehindQueue  # noqa: E402
+
+
+class ScriptedCollection:
+    """A mongomock collection whose next calls can be made to fail.
+
+    Each entry of `failures` scripts one call: an exception to raise before
+    anything is written, or a dict `{'indexes': {...}, 'code': c, 'before': fn}`
+    that writes every other op and reports the listed ones as failed with
+    `code` (after calling `before`, e.g. to let another writer win a race).
+    """
+
+    def __init__(self, collection, failures=()):
+        self.collection = collection
+        self.failures = list(failures)
+        self.calls = []
+
+    def _next_failure(self):
+        return self.failures.pop(0) if self.failures else None
+
+    def _apply(self, kind, ops, write_one):
+        self.calls.append((kind, len(ops)))
+        failure = self._next_failure()
+        if isinstance(failure, Exception):
+            raise failure
+        failing = failure['indexes'] if failure else set()
+        if failure and failure.get('before'):
+            failure['before'](self.collection)
+        for i, op in enumerate(ops):
+            if i not in failing:
+                write_one(op)
+        if failing:
+            raise BulkWriteError({
+                'writeErrors': [{'index': i, 'code': failure['code'], 'errmsg': 'scripted'} for i in sorted(failing)],
+                'writeConcernErrors': [],
+            })
+
+    def insert_many(self, docs, ordered=True):
+        assert not ordered
+        self._apply('insert_many', docs, self.collection.insert_one)
+
+    def bulk_write(self, ops, ordered=True):
+        assert not ordered
+        self._apply('bulk_write', ops, lambda op: self.collection.bulk_write([op]))
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().db
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Backoff delays, recorded instead of slept."""
+    delays = []
+    monkeypatch.setattr(write_behind.time, 'sleep', delays.append)
+    return delays
+
+
+def make_queue(collections, **kwargs):
+    kwargs.setdefault('flush_interval', 60.0)
+    return WriteBehindQueue(collections.get, **kwargs)
+
+
+def test_batches_by_size(db):
+    col = ScriptedCollection(db.detections)
+    queue = make_queue({'detections': col}, batch_size=3)
+    for i in range(7):
+        assert queue.insert('detections', {'i': i})
+    assert queue.flush(timeout=5)
+    assert sorted(d['i'] for d in db.detections.find()) == list(range(7))
+    assert col.calls == [('insert_many', 3), ('insert_many', 3), ('insert_many', 1)]
+    stats = queue.stats()
+    assert (stats['written'], stats['batches'], stats['depth']) == (7, 3, 0)
+    queue.close()
+
+
+def test_flushes_after_interval(db):
+    queue = make_queue({'detections': db.detections}, batch_size=100, flush_interval=0.05)
+    queue.insert('detections', {'i': 1})
+    deadline = time.monotonic() + 5
+    while db.detections.count_documents({}) == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert db.detections.count_documents({}) == 1
+    queue.close()
+
+
+def test_mixed_batch_uses_bulk_write(db):
+    col = ScriptedCollection(db.sessions)
+    queue = make_queue({'sessions': col})
+    queue.insert('sessions', {'_id': 's1', 'n': 0})
+    queue.update('sessions', {'_id': 's1'}, {'$inc': {'n': 2}})
+    queue.update('sessions', {'_id': 's2'}, {'$inc': {'n': 1}}, upsert=True)
+    queue.flush(timeout=5)
+    assert col.calls == [('bulk_write', 3)]
+    assert db.sessions.find_one({'_id': 's1'})['n'] == 2
+    assert db.sessions.find_one({'_id': 's2'})['n'] == 1
+    queue.close()
+
+
+def test_overflow_drop(db):
+    queue = make_queue({'detections': db.detections}, max_queue=2, batch_size=100, overflow='drop')
+    assert queue.insert('detections', {'i': 1})
+    assert queue.insert('detections', {'i': 2})
+    assert not queue.insert('detections', {'i': 3})
+    assert queue.stats()['dropped'] == 1
+    queue.close()
+    assert db.detections.count_documents({}) == 2
+
+
+def test_overflow_block_times_out(db):
+    queue = make_queue({'detections': db.detections}, max_queue=1, batch_size=100,
+                       overflow='block', block_timeout=0.1)
+    queue.insert('detections', {'i': 1})
+    assert queue.would_block()
+    started = time.monotonic()
+    assert not queue.insert('detections', {'i': 2})
+    assert time.monotonic() - started >= 0.1
+    assert queue.stats()['dropped'] == 1
+    queue.close()
+
+
+def test_overflow_block_waits_for_room(db):
+    gate = threading.Event()
+
+    def resolve(name):
+        gate.wait(5)
+        return db.detections
+
+    queue = WriteBehindQueue(resolve, max_queue=1, batch_size=1, flush_interval=60.0,
+                             overflow='block', block_timeout=5.0)
+    queue.insert('detections', {'i': 1})
+    # The flusher holds the first write; the second fills the queue
+    deadline = time.monotonic() + 5
+    while queue.stats()['in_flight'] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    queue.insert('detections', {'i': 2})
+    threading.Timer(0.1, gate.set).start()
+    started = time.monotonic()
+    assert queue.insert('detections', {'i': 3})
+    assert time.monotonic() - started >= 0.05
+    queue.close()
+    assert sorted(d['i'] for d in db.detections.find()) == [1, 2, 3]
+
+
+def test_overflow_spill_and_replay(db, tmp_path):
+    spill = tmp_path / 'spill.jsonl'
+    queue = make_queue({'detections': db.detections}, max_queue=1, batch_size=100,
+                       overflow='spill', spill_path=str(spill))
+    queue.insert('detections', {'i': 1})
+    assert queue.insert('detections', {'i': 2})
+    assert queue.stats()['spilled'] == 1
+    assert len(spill.read_text().splitlines()) == 1
+    queue.flush(timeout=5)
+    assert queue.replay_spill() == 1
+    assert not spill.exists()
+    queue.flush(timeout=5)
+    assert sorted(d['i'] for d in db.detections.find()) == [1, 2]
+    queue.close()
+
+
+def test_replay_after_interrupted_replay(db, tmp_path, monkeypatch):
+    spill = tmp_path / 'spill.jsonl'
+    queue = make_queue({'detections': db.detections}, spill_path=str(spill))
+    queue._spill([('detections', 'insert', {'i': 1})])
+
+    def interrupted(item, wait_for_room=False):
+        raise RuntimeError('write-behind queue is closed')
+
+    monkeypatch.setattr(queue, '_put', interrupted)
+    with pytest.raises(RuntimeError):
+        queue.replay_spill()
+    monkeypatch.undo()
+    replay = tmp_path / 'spill.jsonl.replay'
+    assert replay.exists() and not spill.exists()
+    # Spilled again before the next replay, after a record cut short by a crash
+    replay.write_text(replay.read_text() + '{"collection": "detections", "op": "ins')
+    queue._spill([('detections', 'insert', {'i': 2})])
+    assert queue.replay_spill() == 2
+    assert not replay.exists() and not spill.exists()
+    queue.flush(timeout=5)
+    assert sorted(d['i'] for d in db.detections.find()) == [1, 2]
+    queue.close()
+
+
+def test_replay_spill_without_file(tmp_path, db):
+    queue = make_queue({'detections': db.detections}, spill_path=str(tmp_path / 'none.jsonl'))
+    assert queue.replay_spill() == 0
+    queue.close()
+
+
+def test_retries_with_backoff(db, sleeps):
+    col = ScriptedCollection(db.detections, failures=[AutoReconnect('down'), AutoReconnect('down')])
+    queue = make_queue({'detections': col}, backoff=0.1, max_backoff=0.15)
+    queue.insert('detections', {'i': 1})
+    queue.flush(timeout=5)
+    assert sleeps == [0.1, 0.15]
+    assert db.detections.count_documents({}) == 1
+    stats = queue.stats()
+    assert (stats['retries'], stats['written'], stats['failed']) == (2, 1, 0)
+    queue.close()
+
+
+def test_gives_up_then_spills(db, sleeps, tmp_path):
+    spill = tmp_path / 'spill.jsonl'
+    queue = WriteBehindQueue(lambda name: None, flush_interval=60.0, max_retries=2, spill_path=str(spill))
+    queue.insert('detections', {'i': 1})
+    queue.flush(timeout=5)
+    assert len(sleeps) == 2
+    assert queue.stats()['spilled'] == 1
+    assert len(spill.read_text().splitlines()) == 1
+    queue.close()
+
+
+def test_gives_up_without_spill(sleeps):
+    queue = WriteBehindQueue(lambda name: None, flush_interval=60.0, max_retries=1)
+    queue.insert('detections', {'i': 1})
+    queue.flush(timeout=5)
+    assert queue.stats()['failed'] == 1
+    queue.close()
+
+
+def test_duplicate_insert_counts_as_written(db):
+    db.detections.insert_one({'_id': 'a'})
+    queue = make_queue({'detections': db.detections})
+    queue.insert('detections', {'_id': 'a'})
+    queue.insert('detections', {'_id': 'b'})
+    queue.flush(timeout=5)
+    assert sorted(d['_id'] for d in db.detections.find()) == ['a', 'b']
+    stats = queue.stats()
+    assert (stats['written'], stats['retries']) == (2, 0)
+    queue.close()
+
+
+def test_partial_failure_retries_only_failed_updates(db, sleeps):
+    db.sessions.insert_many([{'_id': k, 'n': 0} for k in 'abc'])
+    col = ScriptedCollection(db.sessions, failures=[{'indexes': {1}, 'code': 91}])
+    queue = make_queue({'sessions': col})
+    for k in 'abc':
+        queue.update('sessions', {'_id': k}, {'$inc': {'n': 1}})
+    queue.flush(timeout=5)
+    # Applied updates are not resent, so nothing is counted twice
+    assert {d['_id']: d['n'] for d in db.sessions.find()} == {'a': 1, 'b': 1, 'c': 1}
+    assert col.calls == [('bulk_write', 3), ('bulk_write', 1)]
+    stats = queue.stats()
+    assert (stats['written'], stats['retries'], stats['batches']) == (3, 1, 2)
+    queue.close()
+
+
+def test_upsert_losing_race_is_retried_as_update(db, sleeps):
+    def other_worker(collection):
+        collection.insert_one({'_id': 'bucket', 'count': 5})
+
+    col = ScriptedCollection(db.buckets, failures=[{'indexes': {0}, 'code': 11000, 'before': other_worker}])
+    queue = make_queue({'buckets': col})
+    queue.update('buckets', {'_id': 'bucket'}, {'$inc': {'count': 1}}, upsert=True)
+    queue.update('buckets', {'_id': 'other'}, {'$inc': {'count': 1}}, upsert=True)
+    queue.flush(timeout=5)
+    assert db.buckets.find_one({'_id': 'bucket'})['count'] == 6
+    assert db.buckets.find_one({'_id': 'other'})['count'] == 1
+    assert queue.stats()['failed'] == 0
+    queue.close()
+
+
+def test_close_drains_queue(db):
+    queue = make_queue({'detections': db.detections}, batch_size=1000)
+    for i in range(50):
+        queue.insert('detections', {'i': i})
+    queue.close()
+    assert db.detections.count_documents({}) == 50
+    assert queue.stats()['depth'] == 0
+    with pytest.raises(RuntimeError):
+        queue.insert('detections', {'i': 50})
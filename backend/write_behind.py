@@ -0,0 +1,357 @@
+"""
+Write-behind persistence for detections and metrics.
+
+Request handlers enqueue writes and return; a background flusher groups them
+per collection and sends one `insert_many` (inserts only) or `bulk_write`
+(updates mixed in) per batch, both unordered, so one failed write does not
+stop the rest. A batch is flushed when `batch_size` writes are waiting or
+`flush_interval` seconds have passed since the first one.
+
+Only the writes that failed are retried, with exponential backoff: the
+updates are `$inc`/`$push`, so resending one that applied would count it
+twice. A duplicate-key error means an insert already landed (an earlier
+attempt), or an upsert lost the race to create its document against another
+worker; that upsert is retried as a plain update.
+
+The queue is bounded. When it is full the overflow policy decides:
+  block  wait up to `block_timeout` seconds for room, then drop
+  drop   drop the new write
+  spill  append the write to a JSON-lines file, replayed by `replay_spill()`
+Writes that still fail after `max_retries` are spilled too when a spill file
+is configured. `close()` flushes everything that is queued.
+`on_write(collection, op, seconds)` is called after each successful batch
+(op is 'insert_many' or 'bulk_write'), e.g. to record write latency.
+"""
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import deque
+
+try:
+    from pymongo import InsertOne, UpdateOne
+    from pymongo.errors import BulkWriteError
+    from bson import json_util
+except Exception:
+    InsertOne = None
+    UpdateOne = None
+    BulkWriteError = None
+    json_util = None
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ('block', 'drop', 'spill')
+_DUPLICATE_KEY = 11000
+
+
+class WriteBehindQueue:
+    """Bounded queue of Mongo writes drained by a background thread.
+
+    `resolve(name)` returns the collection for a collection name (or None when
+    Mongo is unavailable); writes are queued by name so they can be spilled
+    to disk and replayed.
+    """
+
+    def __init__(self, resolve, max_queue=10000, batch_size=500, flush_interval=0.2,
+                 overflow='block', block_timeout=1.0, spill_path=None,
+                 max_retries=5, backoff=0.1, max_backoff=5.0, on_write=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f'unknown overflow policy {overflow!r}')
+        if overflow == 'spill' and not spill_path:
+            raise ValueError('overflow policy "spill" needs a spill_path')
+        self._resolve = resolve
+        self.max_queue = max(1, int(max_queue))
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.spill_path = spill_path
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._on_write = on_write
+
+        self._closed = False
+        self._reset()
+        # The flusher thread does not survive a fork (gunicorn --preload); the
+        # child starts its own on first use
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._queue = deque()
+        self._cv = threading.Condition()
+        self._spill_lock = threading.Lock()
+        # One replay at a time; not _spill_lock, which replayed writes may need to spill
+        self._replay_lock = threading.Lock()
+        # Writes taken off the queue but not yet acknowledged by Mongo
+        self._in_flight = 0
+        self._first_at = None
+        # Callers waiting in flush(); the flusher sends partial batches while any are
+        self._flush_waiters = 0
+        self._counts = {
+            'enqueued': 0, 'written': 0, 'batches': 0, 'retries': 0,
+            'dropped': 0, 'spilled': 0, 'failed': 0,
+        }
+        self._thread = None
+
+    def _ensure_thread(self):
+        # Called with self._cv held
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+
+    def insert(self, collection, doc):
+        """Queue `doc` for insertion into `collection` (a name); returns False if it was dropped."""
+        return self._put((collection, 'insert', doc))
+
+    def update(self, collection, filter, update, upsert=False):
+        """Queue an update_one on `collection` (a name); returns False if it was dropped."""
+        return self._put((collection, 'update', {'filter': filter, 'update': update, 'upsert': upsert}))
+
+    def would_block(self):
+        """Whether queueing now would wait for room (overflow 'block' and a full queue)."""
+        with self._cv:
+            return self.overflow == 'block' and len(self._queue) >= self.max_queue
+
+    def _put(self, item, wait_for_room=False):
+        with self._cv:
+            if self._closed:
+                raise RuntimeError('write-behind queue is closed')
+            self._ensure_thread()
+            if len(self._queue) >= self.max_queue and (wait_for_room or self.overflow == 'block'):
+                deadline = None if wait_for_room else time.monotonic() + self.block_timeout
+                while len(self._queue) >= self.max_queue and not self._closed:
+                    left = None if deadline is None else deadline - time.monotonic()
+                    if left is not None and left <= 0:
+                        break
+                    self._cv.wait(left)
+            if len(self._queue) < self.max_queue:
+                self._queue.append(item)
+                self._counts['enqueued'] += 1
+                if self._first_at is None:
+                    self._first_at = time.monotonic()
+                if len(self._queue) >= self.batch_size:
+                    self._cv.notify_all()
+                return True
+        # Full: spill or drop outside the lock
+        if self.overflow == 'spill' and self._spill([item]):
+            return True
+        with self._cv:
+            self._counts['dropped'] += 1
+        logger.warning(f'Write-behind queue full ({self.max_queue}); dropped a {item[1]} on {item[0]}')
+        return False
+
+    def _run(self):
+        while True:
+            with self._cv:
+                while True:
+                    if self._queue and (
+                        self._closed or self._flush_waiters or len(self._queue) >= self.batch_size
+                        or time.monotonic() - self._first_at >= self.flush_interval
+                    ):
+                        break
+                    if self._closed and not self._queue:
+                        return
+                    wait = None
+                    if self._queue:
+                        wait = max(0.0, self._first_at + self.flush_interval - time.monotonic())
+                    self._cv.wait(wait)
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                self._first_at = time.monotonic() if self._queue else None
+                self._in_flight = len(batch)
+                # Room for blocked producers
+                self._cv.notify_all()
+            try:
+                self._write(batch)
+            except Exception as e:
+                logger.error(f'Write-behind flush failed: {e}', exc_info=True)
+            finally:
+                with self._cv:
+                    self._in_flight = 0
+                    self._cv.notify_all()
+
+    def _write(self, batch):
+        groups = {}
+        for item in batch:
+            groups.setdefault(item[0], []).append(item)
+        for name, items in groups.items():
+            attempt = 0
+            while items:
+                try:
+                    started = time.perf_counter()
+                    op, failed, error = self._write_group(name, items)
+                    elapsed = time.perf_counter() - started
+                except Exception as e:
+                    op, failed, error = None, items, e
+                written = len(items) - len(failed)
+                if written:
+                    with self._cv:
+                        self._counts['written'] += written
+                        self._counts['batches'] += 1
+                    if self._on_write is not None:
+                        try:
+                            self._on_write(name, op, elapsed)
+                        except Exception as e:
+                            logger.warning(f'Write-behind on_write hook failed: {e}')
+                if not failed:
+                    break
+                attempt += 1
+                if attempt > self.max_retries:
+                    logger.error(f'Giving up on {len(failed)} writes to {name} after {self.max_retries} retries: {error}')
+                    if not (self.spill_path and self._spill(failed)):
+                        with self._cv:
+                            self._counts['failed'] += len(failed)
+                    break
+                with self._cv:
+                    self._counts['retries'] += 1
+                delay = min(self.max_backoff, self.backoff * (2 ** (attempt - 1)))
+                logger.warning(f'{len(failed)} of {len(items)} writes to {name} failed ({error}); retry {attempt} in {delay:.2f}s')
+                items = failed
+                time.sleep(delay)
+
+    def _write_group(self, name, items):
+        """Send `items` to collection `name`; returns (op, items to retry, error).
+
+        Raises when nothing is known to have been written (e.g. no connection);
+        pymongo's retryable writes cover a connection lost mid-batch.
+        """
+        col = self._resolve(name)
+        if col is None:
+            raise RuntimeError(f'collection {name!r} unavailable')
+        op = 'insert_many' if all(kind == 'insert' for _, kind, _ in items) else 'bulk_write'
+        try:
+            if op == 'insert_many':
+                # insert_many sets each doc's _id in place, so a retry resends the same ids
+                col.insert_many([doc for _, _, doc in items], ordered=False)
+            else:
+                ops = [
+                    InsertOne(payload) if kind == 'insert'
+                    else UpdateOne(payload['filter'], payload['update'], upsert=payload['upsert'])
+                    for _, kind, payload in items
+                ]
+                col.bulk_write(ops, ordered=False)
+            return op, [], None
+        except Exception as e:
+            if BulkWriteError is None or not isinstance(e, BulkWriteError):
+                raise
+            error = e
+        # Unordered: every write not listed in writeErrors was applied
+        errors = error.details.get('writeErrors', [])
+        if not errors:
+            # Only a write concern error: applied, maybe not yet replicated
+            logger.warning(f'Write-behind batch to {name}: {error.details.get("writeConcernErrors")}')
+            return op, [], None
+        failed = []
+        for err in errors:
+            item = items[err['index']]
+            coll, kind, payload = item
+            if err.get('code') == _DUPLICATE_KEY:
+                if kind == 'insert':
+                    # Written by an earlier attempt
+                    continue
+                if payload['upsert']:
+                    # Another writer created the document first; update it instead
+                    item = (coll, kind, dict(payload, upsert=False))
+            failed.append(item)
+        return op, failed, errors[0].get('errmsg', error)
+
+    def _spill(self, items):
+        """Append writes to the spill file; returns False if that failed too."""
+        if not self.spill_path or json_util is None:
+            return False
+        try:
+            with self._spill_lock, open(self.spill_path, 'a', encoding='utf-8') as fh:
+                for name, kind, payload in items:
+                    fh.write(json_util.dumps({'collection': name, 'op': kind, 'payload': payload}) + '\n')
+        except Exception as e:
+            logger.error(f'Failed to spill {len(items)} writes to {self.spill_path}: {e}')
+            return False
+        with self._cv:
+            self._counts['spilled'] += len(items)
+        return True
+
+    def _append_spill(self, replay_path):
+        with open(replay_path, 'rb+') as out, open(self.spill_path, 'rb') as src:
+            out.seek(0, os.SEEK_END)
+            # A record cut short by a crash must not run into the next one
+            if out.tell():
+                out.seek(-1, os.SEEK_END)
+                if out.read(1) != b'\n':
+                    out.write(b'\n')
+            shutil.copyfileobj(src, out)
+            out.flush()
+            os.fsync(out.fileno())
+        os.remove(self.spill_path)
+
+    def replay_spill(self):
+        """Re-queue writes from the spill file (e.g. at startup); returns how many were queued.
+
+        The spill file is moved aside to `<spill_path>.replay` while it is
+        read. A `.replay` file left by an interrupted replay is replayed too:
+        the spill file is appended to it rather than replacing it.
+        """
+        if not self.spill_path or json_util is None:
+            return 0
+        with self._replay_lock:
+            replay_path = self.spill_path + '.replay'
+            with self._spill_lock:
+                if os.path.exists(self.spill_path):
+                    if os.path.exists(replay_path):
+                        self._append_spill(replay_path)
+                    else:
+                        os.replace(self.spill_path, replay_path)
+                if not os.path.exists(replay_path):
+                    return 0
+            count = 0
+            with open(replay_path, encoding='utf-8') as fh:
+                for line in fh:
+                    if not line.strip():
+                        continue
+                    try:
+                        rec = json_util.loads(line)
+                    except ValueError:
+                        logger.warning('Skipping unreadable spill record')
+                        continue
+                    # Wait for room rather than spilling the record straight back
+                    if self._put((rec['collection'], rec['op'], rec['payload']), wait_for_room=True):
+                        count += 1
+            os.remove(replay_path)
+            return count
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far has been written (or given up on)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cv:
+            # Flush now instead of waiting for the interval
+            self._flush_waiters += 1
+            self._cv.notify_all()
+            try:
+                while self._queue or self._in_flight:
+                    left = None if deadline is None else deadline - time.monotonic()
+                    if left is not None and left <= 0:
+                        return False
+                    self._cv.wait(left)
+            finally:
+                self._flush_waiters -= 1
+        return True
+
+    def close(self, timeout=30.0):
+        """Stop accepting writes and flush what is queued."""
+        with self._cv:
+            if self._closed:
+                return
+            self._closed = True
+            self._cv.notify_all()
+            thread = self._thread
+        if thread is None:
+            return
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.error(f'Write-behind queue did not drain within {timeout}s; {len(self._queue)} writes lost')
+
+    def stats(self):
+        with self._cv:
+            return dict(self._counts, depth=len(self._queue), in_flight=self._in_flight,
+                        max_queue=self.max_queue, overflow=self.overflow)